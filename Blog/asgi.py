@@ -0,0 +1,26 @@
+"""
+ASGI config for Blog project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Requests are served from Blog.urls_async, where the read views are async and
+wait for the database on a pool of ASYNC_DB_THREADS threads, so a worker can
+hold many more connections open than under WSGI.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import django
+from django.core.handlers.asgi import ASGIHandler, ASGIRequest
+
+
+class AsyncViewsRequest(ASGIRequest):
+    urlconf = 'Blog.urls_async'
+
+
+class AsyncViewsHandler(ASGIHandler):
+    request_class = AsyncViewsRequest
+
+
+django.setup(set_prefix=False)
+application = AsyncViewsHandler()
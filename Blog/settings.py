@@ -48,10 +48,84 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_THROTTLE_CLASSES': ['blog.throttling.BucketThrottle'],
+    'NUM_PROXIES': env('NUM_PROXIES', 0),
     'PAGE_SIZE': 10
 }
 
+# Throttling
+# Requests allowed per client (user, or address when not logged in) to each
+# scope, refilled evenly over the period, with up to that many at once. The
+# buckets live in the cache, so set CACHE_URL when running more than one process.
+# NUM_PROXIES is how many proxies in front of the site add to X-Forwarded-For;
+# the header is ignored while it is 0, as clients can send anything in it.
+
+THROTTLE_RATES = {
+    'search': {'anon': '30/min', 'user': '120/min'},
+    'suggest': {'anon': '300/min', 'user': '600/min'},
+    'api': {'anon': '120/min', 'user': '600/min'},
+}
+
+# Search
+# 'auto' uses the database's own full text search where available (SQLite FTS5,
+# Postgres) and falls back to blog.search.InvertedIndexBackend otherwise.
+
+SEARCH_BACKEND = env('SEARCH_BACKEND', 'auto')
+SEARCH_MAX_RESULTS = 1000
+
+# Search box suggestions come from an in-memory index of the newest post titles
+# and the most used categories, at most AUTOCOMPLETE_MAX_ITEMS of them, kept in
+# step across processes through the cache and rebuilt from the database every
+# AUTOCOMPLETE_REBUILD_SECONDS. The shared copy is saved in parts small enough
+# for memcached.
+AUTOCOMPLETE_MAX_ITEMS = 50000
+AUTOCOMPLETE_REBUILD_SECONDS = 60 * 60
+
+# Task queue
+# What follows a post write (search index, latest posts feed, category summaries
+# and orphans, cached pages) is queued in the blog_task table, in the same
+# transaction, and run by manage.py run_worker. TASKS_EAGER runs it right away
+# instead. A failing task is tried TASK_MAX_ATTEMPTS times, TASK_RETRY_DELAY
+# seconds apart and twice as long each time after. Workers check in on the task
+# they run every quarter of TASK_TIMEOUT; one not heard from for TASK_TIMEOUT is
+# taken to have died, and its task is queued again, or failed when it is out of
+# attempts. Finished tasks are kept for TASK_KEEP_SECONDS, for run_worker --stats.
+
+TASKS_EAGER = env('TASKS_EAGER', False)
+TASK_MAX_ATTEMPTS = 5
+TASK_RETRY_DELAY = 10
+TASK_TIMEOUT = 2 * 60
+TASK_KEEP_SECONDS = 24 * 60 * 60
+
+# Bulk API requests are written in transactions of BULK_BATCH_SIZE posts.
+BULK_BATCH_SIZE = 500
+BULK_MAX_ITEMS = 10000
+
+# Profiling
+# Off unless PROFILING is set, in which case every response gets a Server-Timing
+# header and a log line on blog.profiling. With PROFILING_SAMPLE_RATE = N, one
+# request in N is also run under cProfile, with the stats saved in PROFILING_DIR.
+
+PROFILING = env('PROFILING', False)
+PROFILING_SAMPLE_RATE = env('PROFILING_SAMPLE_RATE', 0)
+PROFILING_DIR = env('PROFILING_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILING_TOP_QUERIES = 5
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'blog.profiling': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'blog.tasks': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 MIDDLEWARE = [
+    'blog.middleware.ProfilingMiddleware',
+    'blog.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,6 +154,11 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'Blog.wsgi.application'
+ASGI_APPLICATION = 'Blog.asgi.application'
+
+# Under ASGI (Blog.asgi) the read views are async and run their database work on
+# a pool of ASYNC_DB_THREADS threads, each with its own connection.
+ASYNC_DB_THREADS = env('ASYNC_DB_THREADS', 20)
 
 
 # Database
@@ -89,6 +168,49 @@ DATABASES = {
     'default': database.config()
 }
 
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+# Read replicas
+# REPLICA_DATABASE_URLS is a comma separated list of database urls. When set,
+# the reads of GET and HEAD requests go to a replica; a client that has just
+# written reads from the primary for REPLICA_PIN_SECONDS, and a replica that
+# fails is left alone for REPLICA_RETRY_SECONDS.
+
+REPLICA_DATABASES = []
+for number, url in enumerate(filter(None, env('REPLICA_DATABASE_URLS', '').split(',')), 1):
+    alias = 'replica%d' % number
+    DATABASES[alias] = dict(database.parse_database_url(url.strip()), TEST={'MIRROR': 'default'})
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['blog.routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = env('REPLICA_PIN_SECONDS', 5)
+REPLICA_RETRY_SECONDS = 30
+
+
+# Caches
+# Set CACHE_URL to share the cache between processes, e.g. memcached://127.0.0.1:11211
+
+CACHES = {
+    'default': cache.config()
+}
+
+SANITIZER_CACHE_TIMEOUT = 24 * 60 * 60
+RENDERED_CONTENT_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+PAGE_CACHE_TIMEOUT = 5 * 60
+
+# The home page's first page is read from a feed of the newest LATEST_POSTS_SIZE
+# published and upcoming posts kept in the cache and updated on every write. It
+# should hold at least a page of posts; it is read again from the database after
+# LATEST_POSTS_TIMEOUT, or when the cache loses it.
+LATEST_POSTS_SIZE = 100
+LATEST_POSTS_TIMEOUT = 10 * 60
+
+# RSS, Atom and JSON feeds list the newest FEED_SIZE posts. Rendered items are
+# cached for FEED_ITEM_CACHE_TIMEOUT, so a document is rebuilt after a write
+# from the items that did not change and the ones that did.
+FEED_SIZE = 50
+FEED_ITEM_CACHE_TIMEOUT = 24 * 60 * 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -0,0 +1,11 @@
+"""
+The urls served by Blog.asgi: those of Blog.urls, with the blog's read views
+in their async versions.
+"""
+from django.contrib import admin
+from django.urls import include, path
+
+urlpatterns = [
+    path('blog/', include('blog.urls_async')),
+    path('admin/', admin.site.urls),
+]
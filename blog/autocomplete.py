@@ -0,0 +1,299 @@
+import bisect
+import re
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Category, Post
+
+POST = 'post'
+CATEGORY = 'category'
+
+VERSION_KEY = 'autocomplete:version'
+SNAPSHOT_KEY = 'autocomplete:snapshot'
+SNAPSHOT_PART_KEY = 'autocomplete:snapshot:%s:%d'
+CHANGE_KEY = 'autocomplete:change:%d'
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+# Keys are cut to this length and every title is indexed from its first few
+# words only, which keeps the index small; longer prefixes are checked against
+# the label.
+KEY_LENGTH = 24
+WORDS_PER_LABEL = 6
+# A lookup reads at most this many keys, so a one letter prefix costs no more
+# than a longer one.
+SCAN_LIMIT = 1000
+# Every this many changes the writer saves a fresh snapshot to the cache.
+SNAPSHOT_EVERY = 100
+# Memcached keeps values of up to 1 MB, so the snapshot is saved in parts of
+# this many items, which stay under that with labels of 200 characters.
+SNAPSHOT_PART_ITEMS = 1000
+
+
+def max_items():
+    return getattr(settings, 'AUTOCOMPLETE_MAX_ITEMS', 50000)
+
+def rebuild_seconds():
+    return getattr(settings, 'AUTOCOMPLETE_REBUILD_SECONDS', 60 * 60)
+
+
+class PrefixIndex:
+    """
+    Post titles and category names held as a sorted list of (key, kind, id)
+    tuples, with a key for the start of every word, searched with bisect.
+    items maps (kind, id) to (label, weight): posts weigh their create date as
+    a timestamp, categories their post count.
+    """
+
+    def __init__(self, items=None, built_at=None):
+        self.items = dict(items or {})
+        self.built_at = time.time() if built_at is None else built_at
+        self.keys = sorted(
+            key for ref, (label, _) in self.items.items() for key in self.make_keys(ref, label))
+
+    @staticmethod
+    def make_keys(ref, label):
+        text = label.lower()
+        return [
+            (text[match.start():match.start() + KEY_LENGTH],) + ref
+            for match in WORD_RE.finditer(text)
+        ][:WORDS_PER_LABEL]
+
+    def add(self, kind, pk, label, weight):
+        ref = (kind, pk)
+        if ref in self.items:
+            if self.items[ref][0] == label:
+                self.items[ref] = (label, weight)
+                return
+            self.remove(kind, pk)
+        self.items[ref] = (label, weight)
+        for key in self.make_keys(ref, label):
+            bisect.insort(self.keys, key)
+
+    def remove(self, kind, pk):
+        ref = (kind, pk)
+        item = self.items.pop(ref, None)
+        if item is None:
+            return
+        for key in self.make_keys(ref, item[0]):
+            position = bisect.bisect_left(self.keys, key)
+            if position < len(self.keys) and self.keys[position] == key:
+                del self.keys[position]
+
+    def apply(self, changes):
+        for change in changes:
+            if change[0] == 'add':
+                self.add(*change[1:])
+            else:
+                self.remove(*change[1:])
+
+    def trimmed(self, limit):
+        """
+        Returns the index cut down to limit items, dropping the oldest posts and
+        then the least used categories.
+        """
+        if len(self.items) <= limit:
+            return self
+        kept = sorted(self.items.items(), key=lambda item: (item[0][0] == CATEGORY, item[1][1]))
+        return PrefixIndex(kept[len(kept) - limit:], self.built_at)
+
+    def stale(self):
+        return time.time() - self.built_at > rebuild_seconds()
+
+    def suggest(self, prefix, limit=5, kinds=(CATEGORY, POST)):
+        """
+        Returns {kind: [(id, label, weight)]} for the items with a word starting
+        with prefix, heaviest first. Posts dated in the future and categories
+        without posts are left out.
+        """
+        prefix = ' '.join(prefix.lower().split())
+        found = {kind: {} for kind in kinds}
+        if not prefix:
+            return {kind: [] for kind in kinds}
+        probe = prefix[:KEY_LENGTH]
+        now = timezone.now().timestamp()
+        position = bisect.bisect_left(self.keys, (probe,))
+        end = min(len(self.keys), position + SCAN_LIMIT)
+        while position < end and self.keys[position][0].startswith(probe):
+            _, kind, pk = self.keys[position]
+            position += 1
+            if kind not in found:
+                continue
+            label, weight = self.items[(kind, pk)]
+            if (kind == POST and weight > now) or (kind == CATEGORY and not weight):
+                continue
+            if len(prefix) > KEY_LENGTH and prefix not in label.lower():
+                continue
+            found[kind][pk] = (pk, label, weight)
+        return {
+            kind: sorted(matches.values(), key=lambda match: (-match[2], match[1]))[:limit]
+            for kind, matches in found.items()
+        }
+
+
+# This process's copy of the index and the change it is up to.
+_lock = threading.RLock()
+_local = {'index': None, 'version': None}
+
+
+def build():
+    """
+    Reads the newest posts and the most used categories, up to
+    AUTOCOMPLETE_MAX_ITEMS together, into a new index.
+    """
+    limit = max_items()
+    items = {
+        (CATEGORY, pk): (name, count)
+        for pk, name, count in Category.objects.order_by('-post_count', 'id')
+        .values_list('id', 'name', 'post_count')[:limit]
+    }
+    posts = Post.objects.order_by('-create_date', '-id').values_list('id', 'title', 'create_date')
+    items.update(
+        ((POST, pk), (title, create_date.timestamp()))
+        for pk, title, create_date in posts[:limit - len(items)]
+    )
+    return PrefixIndex(items)
+
+def catch_up(index, since, version):
+    """
+    Applies the changes logged after since up to version to the index. Returns
+    False when some of them are no longer in the cache.
+    """
+    if since > version or version - since > 2 * SNAPSHOT_EVERY:
+        return False
+    keys = [CHANGE_KEY % number for number in range(since + 1, version + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) != len(keys):
+        return False
+    for key in keys:
+        index.apply(changes[key])
+    return True
+
+def current_index():
+    """
+    Returns this process's index, brought up to date with the changes logged in
+    the cache by every process since it was last used. It is loaded from the
+    shared snapshot, or built from the database when there is none, the first
+    time and whenever it falls too far behind or is older than
+    AUTOCOMPLETE_REBUILD_SECONDS.
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = start_version()
+    with _lock:
+        index = _local['index']
+        if index is not None and not index.stale() and catch_up(index, _local['version'], version):
+            _local['version'] = version
+            return index
+        snapshot = load_snapshot()
+        index = None
+        if snapshot is not None:
+            since, built_at, items = snapshot
+            index = PrefixIndex(items, built_at)
+            if index.stale() or not catch_up(index, since, version):
+                index = None
+        if index is None:
+            index = build()
+            save_snapshot(index, version)
+        _local.update(index=index, version=version)
+        return index
+
+def start_version():
+    """
+    Starts the change log, if the cache has none, at the current time in
+    milliseconds rather than at 0, so that after the cache is flushed no
+    process mistakes its old copy for one that is up to date.
+    """
+    cache.add(VERSION_KEY, int(time.time() * 1000), None)
+    return cache.get(VERSION_KEY, 0)
+
+def save_snapshot(index, version):
+    """
+    Saves the index to the cache for other processes: its parts first, then
+    the header listing them, so no process reads a snapshot half written.
+    """
+    items = list(index.items.items())
+    token = uuid.uuid4().hex
+    parts = {
+        SNAPSHOT_PART_KEY % (token, number): items[start:start + SNAPSHOT_PART_ITEMS]
+        for number, start in enumerate(range(0, len(items), SNAPSHOT_PART_ITEMS))
+    }
+    cache.set_many(parts, rebuild_seconds())
+    cache.set(SNAPSHOT_KEY, (version, index.built_at, list(parts)), rebuild_seconds())
+
+def load_snapshot():
+    """
+    Returns the (version, built_at, items) of the snapshot in the cache, or None
+    when there is none or some of its parts are gone.
+    """
+    snapshot = cache.get(SNAPSHOT_KEY)
+    if snapshot is None:
+        return None
+    version, built_at, keys = snapshot
+    parts = cache.get_many(keys)
+    if len(parts) != len(keys):
+        return None
+    return version, built_at, [item for key in keys for item in parts[key]]
+
+def record(changes):
+    """
+    Logs changes, a list of ('add', kind, id, label, weight) and ('remove',
+    kind, id) tuples, for every process to apply to its index.
+    """
+    if not changes:
+        return
+    start_version()
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        return
+    cache.set(CHANGE_KEY % version, changes, rebuild_seconds())
+    if version % SNAPSHOT_EVERY == 0:
+        index = current_index().trimmed(max_items())
+        with _lock:
+            _local['index'] = index
+        save_snapshot(index, version)
+
+def update_posts(posts):
+    record([('add', POST, post.pk, post.title, post.create_date.timestamp()) for post in posts])
+
+def remove_posts(post_ids):
+    record([('remove', POST, pk) for pk in post_ids])
+
+def update_categories(categories):
+    """
+    Takes (id, name, post_count) rows.
+    """
+    record([('add', CATEGORY, pk, name, count) for pk, name, count in categories])
+
+def remove_categories(category_ids):
+    record([('remove', CATEGORY, pk) for pk in category_ids])
+
+def invalidate():
+    """
+    Has the index rebuilt from the database on its next use, after writes too
+    large to log one by one.
+    """
+    cache.delete(SNAPSHOT_KEY)
+    start_version()
+    try:
+        # Nothing is logged for this change, and the gap makes every process
+        # drop its copy.
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        pass
+
+def reset():
+    """
+    Drops this process's copy of the index.
+    """
+    with _lock:
+        _local.update(index=None, version=None)
+
+def suggest(prefix, limit=5, kinds=(CATEGORY, POST)):
+    with _lock:
+        return current_index().suggest(prefix, limit, kinds)
@@ -0,0 +1,482 @@
+import asyncio
+import bisect
+import datetime
+import itertools
+import json
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from io import BytesIO, StringIO
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.backends.utils import CursorWrapper
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+
+from . import autocomplete, latest, offload, search, signals
+from .bulk import assign_ids
+from .models import Category, Post
+from .pagination import KeysetPaginator
+from .rendering import content_hash
+from .services import refresh_category_summaries
+
+SIZES = {'10k': 10000, '100k': 100000, '1m': 1000000}
+LIST_PAGE_SIZES = (10, 100, 1000)
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'bre', 'dra', 'fli', 'gor', 'ston']
+
+
+def parse_size(value):
+    """
+    Accepts one of the SIZES names or a plain number of posts.
+    """
+    value = value.lower()
+    return SIZES[value] if value in SIZES else int(value)
+
+def zipf_weights(count, skew):
+    """
+    Cumulative weights giving the item at rank n a weight of 1 / n ** skew, so a
+    few items are picked most of the time, the way real tags and authors are.
+    """
+    return list(itertools.accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+class CorpusGenerator:
+    """
+    Builds a reproducible corpus: the same seed and sizes always give the same
+    users, categories and posts. Tags and authors follow a zipf distribution;
+    about one post in a hundred is dated in the future.
+    """
+
+    def __init__(self, posts, seed=0, users=None, categories=None, skew=1.1):
+        self.posts = posts
+        self.users = users or max(10, posts // 100)
+        self.categories = categories or max(20, min(5000, posts // 20))
+        self.rng = random.Random(seed)
+        self.skew = skew
+        self.vocabulary = self.make_vocabulary(5000)
+        self.word_weights = zipf_weights(len(self.vocabulary), 1.0)
+        self.tag_weights = zipf_weights(self.categories, skew)
+        self.author_weights = zipf_weights(self.users, skew)
+
+    def make_vocabulary(self, size):
+        words = set()
+        while len(words) < size:
+            words.add(''.join(self.rng.choice(SYLLABLES) for _ in range(self.rng.randint(2, 4))))
+        return sorted(words)
+
+    def pick(self, cumulative, count=1):
+        total = cumulative[-1]
+        return [bisect.bisect(cumulative, self.rng.random() * total) for _ in range(count)]
+
+    def words(self, count):
+        return ' '.join(self.vocabulary[index] for index in self.pick(self.word_weights, count))
+
+    def content(self):
+        return ''.join('<p>%s</p>' % self.words(self.rng.randint(30, 80))
+                       for _ in range(self.rng.randint(2, 6)))
+
+    def generate(self, chunk_size=5000, stdout=None):
+        password = make_password('benchmark')
+        User.objects.bulk_create([
+            User(username='user%05d' % number, password=password) for number in range(self.users)
+        ])
+        user_ids = list(User.objects.filter(username__startswith='user').order_by('username')
+                        .values_list('id', flat=True))
+        Category.objects.bulk_create([
+            Category(name='TAG %04d' % number, slug='TAG-%04d' % number) for number in range(self.categories)
+        ])
+        category_ids = list(Category.objects.filter(name__startswith='TAG ').order_by('name')
+                            .values_list('id', flat=True))
+        now = timezone.now()
+        span = 3 * 365 * 24 * 60 * 60
+        through = Post.categories.through
+        written = 0
+        while written < self.posts:
+            count = min(chunk_size, self.posts - written)
+            posts, tags = [], []
+            for _ in range(count):
+                content = self.content()
+                offset = self.rng.randint(-span, span // 100)
+                posts.append(Post(
+                    title=self.words(self.rng.randint(3, 8)).capitalize(),
+                    content=content,
+                    rendered_content=content,
+                    content_hash=content_hash(content),
+                    create_date=now + datetime.timedelta(seconds=offset),
+                    create_by_id=user_ids[self.pick(self.author_weights)[0]],
+                ))
+                tags.append(set(self.pick(self.tag_weights, self.rng.randint(1, 4))))
+            with transaction.atomic(), signals.muted():
+                assign_ids(posts)
+                Post.objects.bulk_create(posts)
+                through.objects.bulk_create([
+                    through(post_id=post.pk, category_id=category_ids[tag])
+                    for post, post_tags in zip(posts, tags) for tag in post_tags
+                ])
+                search.index_posts(posts)
+            written += count
+            if stdout:
+                stdout.write("%d / %d posts" % (written, self.posts))
+        refresh_category_summaries(category_ids)
+        autocomplete.invalidate()
+        latest.invalidate()
+        return written
+
+
+Scenario = namedtuple('Scenario', 'name method path data login write as_json')
+
+def scenario(name, path, method='get', data=None, login=False, write=False, as_json=False):
+    return Scenario(name, method, path, data, login, write, as_json)
+
+def api_write(name, path, method, data=None):
+    return scenario(name, path, method, data, login=True, write=True, as_json=True)
+
+def build_scenarios():
+    """
+    Lists a request for every url in blog/urls.py and every PostViewSet action,
+    against rows picked from the current database. Returns the scenarios and
+    the user logged in for them, the author with the most posts.
+    """
+    now = timezone.now()
+    published = Post.objects.filter(create_date__lte=now)
+    author = User.objects.annotate(count=Count('posts')).order_by('-count', 'id').first()
+    post = published.filter(create_by=author).order_by('-create_date', '-id').first()
+    own_posts = list(Post.objects.filter(create_by=author).order_by('-id').values_list('id', flat=True)[:100])
+    category = Category.objects.order_by('-post_count', 'id').first()
+    middle = published.order_by('-create_date', '-id')[published.count() // 2]
+    deep_cursor = KeysetPaginator(published, 10).encode_cursor(middle)
+    common, rare = search_words(post)
+    api_posts = reverse('blog:post-list')
+    api_post = reverse('blog:post-detail', args=(post.pk,))
+    bulk = reverse('blog:post-bulk')
+    item = {'title': 'Benchmark post', 'content': '<p>benchmark</p>',
+            'create_date': now.isoformat(), 'categories': [category.name, 'BENCHMARK']}
+    recent = Post.objects.order_by('-modified_at').values_list('modified_at', flat=True)[
+        min(1000, Post.objects.count() - 1)]
+    return [
+        scenario('index', reverse('blog:index')),
+        scenario('index deep page', reverse('blog:index') + '?' + urlencode({'cursor': deep_cursor})),
+        scenario('categories', reverse('blog:categories')),
+        scenario('categories by popularity', reverse('blog:categories') + '?sort=popular'),
+        scenario('categories by prefix', reverse('blog:categories') + '?prefix=' + category.name[:2]),
+        scenario('category suggestions', reverse('blog:category_suggestions') + '?q=' + category.name[:2]),
+        scenario('tag cloud', reverse('blog:category_suggestions')),
+        scenario('category', reverse('blog:category', args=(category.pk,))),
+        scenario('post', reverse('blog:detail', args=(post.pk,))),
+        scenario('search listing', reverse('blog:search')),
+        scenario('search suggestions', reverse('blog:search_suggestions') + '?q=' + common[:3]),
+        scenario('search common word', reverse('blog:search') + '?search=' + common),
+        scenario('search rare word', reverse('blog:search') + '?search=' + rare),
+        scenario('login page', reverse('blog:login')),
+        scenario('account', reverse('blog:profile_view'), login=True),
+        scenario('new post form', reverse('blog:new_post'), login=True),
+        scenario('new post submit', reverse('blog:new_post'), 'post', {
+            'title': 'Benchmark post', 'content': '<p>benchmark</p>',
+            'category_csv': '%s, benchmark' % category.name}, login=True, write=True),
+        scenario('edit form', reverse('blog:edit', args=(post.pk,)), login=True),
+        scenario('edit submit', reverse('blog:edit', args=(post.pk,)), 'post', {
+            'title': 'Edited', 'content': '<p>edited</p>', 'category_csv': category.name},
+            login=True, write=True),
+        scenario('delete form', reverse('blog:delete', args=(post.pk,)), login=True),
+        scenario('delete submit', reverse('blog:delete', args=(post.pk,)), 'post', login=True, write=True),
+        scenario('api root', reverse('blog:apiroot')),
+        scenario('api schema', '/blog/schema/'),
+        scenario('api posts list', api_posts),
+        *[scenario('api posts list of %d' % size, api_posts + '?page_size=%d' % size) for size in LIST_PAGE_SIZES],
+        scenario('api posts summary', api_posts + '?view=summary&page_size=100'),
+        scenario('api posts sparse', api_posts + '?fields=id,title,create_date&page_size=100'),
+        scenario('api posts deep page', api_posts + '?' + urlencode({'cursor': deep_cursor})),
+        api_write('api posts create', api_posts, 'post', item),
+        scenario('api posts retrieve', api_post),
+        api_write('api posts update', api_post, 'put', dict(item, title='Replaced')),
+        api_write('api posts partial update', api_post, 'patch', {'title': 'Renamed'}),
+        api_write('api posts destroy', api_post, 'delete'),
+        api_write('api posts bulk create', bulk, 'post', [item] * 100),
+        api_write('api posts bulk update', bulk, 'patch',
+                  [{'id': pk, 'title': 'Bulk renamed'} for pk in own_posts]),
+        api_write('api posts bulk delete', bulk, 'delete', own_posts),
+        scenario('api posts export since',
+                 reverse('blog:post-export') + '?' + urlencode({'since': recent.isoformat()}), login=True),
+        scenario('api posts export', reverse('blog:post-export'), login=True),
+        scenario('api users list', reverse('blog:user-list')),
+        scenario('api user retrieve', reverse('blog:user-detail', args=(author.pk,))),
+    ], author
+
+def open_corpus(path, size, seed, stdout=None):
+    """
+    Points the default connection at the corpus database in path, generating
+    the corpus when the file is missing or was left incomplete.
+    """
+    connection.settings_dict['TEST']['NAME'] = path
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=True)
+    if Post.objects.count() == size:
+        return
+    if stdout:
+        stdout.write("Generating %d posts in %s" % (size, path))
+    connection.creation.destroy_test_db(path, verbosity=0)
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    CorpusGenerator(size, seed).generate(stdout=stdout)
+
+def search_words(post):
+    """
+    Picks the post's most and least repeated words, which with zipf distributed
+    words are likely to be a common and a rare one across the corpus.
+    """
+    counts = Counter(search.tokenize(post.content)).most_common()
+    return counts[0][0], counts[-1][0]
+
+
+class QueryCounter:
+    """
+    A database execute wrapper counting the queries run through it.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Benchmark:
+    """
+    Runs each scenario through the test client with the full middleware stack
+    and records its timings, query count and memory allocated. Writes are
+    rolled back after every run, so the corpus stays the same throughout.
+    """
+
+    def __init__(self, user, repeat=5, warm=False):
+        self.repeat = repeat
+        self.warm = warm
+        self.anonymous = Client()
+        self.client = Client()
+        self.client.force_login(user)
+
+    def request(self, scenario):
+        if not self.warm:
+            cache.clear()
+        client = self.client if scenario.login else self.anonymous
+        kwargs = {}
+        data = scenario.data
+        if scenario.as_json:
+            data = json.dumps(data) if data is not None else ''
+            kwargs['content_type'] = 'application/json'
+        with transaction.atomic():
+            response = getattr(client, scenario.method)(scenario.path, data, **kwargs)
+            if getattr(response, 'streaming', False):
+                for _ in response.streaming_content:
+                    pass
+            transaction.set_rollback(scenario.write)
+        return response
+
+    def measure(self, scenario):
+        try:
+            response = self.request(scenario)
+        except Exception as exc:
+            return {'status': 500, 'error': repr(exc), 'queries': 0, 'median_ms': 0.0,
+                    'p95_ms': 0.0, 'min_ms': 0.0, 'peak_kb': 0.0}
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            self.request(scenario)
+        tracemalloc.start()
+        self.request(scenario)
+        allocated, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        timings = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            self.request(scenario)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return {
+            'status': response.status_code,
+            'queries': queries.count,
+            'median_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+            'min_ms': round(timings[0], 3),
+            'peak_kb': round(peak / 1024, 1),
+        }
+
+
+def compare(baseline, current, threshold=0.2):
+    """
+    Lines up two runs' results. Returns (name, metric, before, after, change,
+    regressed) rows; a scenario regresses when its median time grows by more
+    than threshold or it makes more queries.
+    """
+    rows = []
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        for metric in ('median_ms', 'queries', 'peak_kb'):
+            old, new = before[metric], result[metric]
+            change = (new - old) / old if old else 0.0
+            if metric == 'median_ms':
+                regressed = change > threshold
+            elif metric == 'queries':
+                regressed = new > old
+            else:
+                regressed = False
+            rows.append((name, metric, old, new, change, regressed))
+    return rows
+
+
+def read_paths():
+    """
+    The urls of the views that are async under ASGI, against a post picked from
+    the current database.
+    """
+    post = Post.objects.filter(create_date__lte=timezone.now()).order_by('-create_date', '-id').first()
+    common, _ = search_words(post)
+    return [
+        reverse('blog:index'),
+        reverse('blog:detail', args=(post.pk,)),
+        reverse('blog:search') + '?search=' + common,
+        reverse('blog:post-list'),
+        reverse('blog:post-detail', args=(post.pk,)),
+    ]
+
+@contextmanager
+def slow_queries(delay):
+    """
+    Makes every query, on any thread, take delay seconds longer, as on a busy
+    database server.
+    """
+    execute, executemany = CursorWrapper._execute, CursorWrapper._executemany
+
+    def slow_execute(self, *args):
+        time.sleep(delay)
+        return execute(self, *args)
+
+    def slow_executemany(self, *args):
+        time.sleep(delay)
+        return executemany(self, *args)
+
+    CursorWrapper._execute, CursorWrapper._executemany = slow_execute, slow_executemany
+    try:
+        yield
+    finally:
+        CursorWrapper._execute, CursorWrapper._executemany = execute, executemany
+
+def split_path(path):
+    path, _, query = path.partition('?')
+    return path, query
+
+def wsgi_get(application, path):
+    path, query = split_path(path)
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'localhost', 'REMOTE_ADDR': '127.0.0.1', 'wsgi.input': BytesIO(),
+        'wsgi.url_scheme': 'http', 'wsgi.errors': StringIO(),
+    }
+    statuses = []
+    body = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    try:
+        for _ in body:
+            pass
+    finally:
+        body.close()
+    return int(statuses[0].split()[0])
+
+async def asgi_get(application, path):
+    path, query = split_path(path)
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode('utf-8'), 'query_string': query.encode('utf-8'),
+        'headers': [(b'host', b'localhost')], 'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    return messages[0]['status']
+
+
+class ConcurrencyBenchmark:
+    """
+    Sends the same GETs through the WSGI and the ASGI application in this
+    process, from concurrency clients each sending its next request as soon as
+    the last one is answered. Under WSGI at most workers requests are handled
+    at once, as by that many sync workers; under ASGI every request is taken on
+    one event loop and the views wait for the database on ASYNC_DB_THREADS
+    threads.
+    """
+
+    def __init__(self, paths, requests, concurrency):
+        self.paths = [paths[number % len(paths)] for number in range(requests)]
+        self.concurrency = concurrency
+
+    def run_wsgi(self, application, workers):
+        paths = iter(self.paths)
+        lock = threading.Lock()
+        free = threading.BoundedSemaphore(workers)
+        results = []
+
+        def client():
+            while True:
+                with lock:
+                    path = next(paths, None)
+                if path is None:
+                    return
+                started = time.perf_counter()
+                with free:
+                    status = wsgi_get(application, path)
+                results.append((status, time.perf_counter() - started))
+
+        started = time.perf_counter()
+        clients = [threading.Thread(target=client) for _ in range(self.concurrency)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        return self.summary(results, time.perf_counter() - started)
+
+    def run_asgi(self, application):
+        paths = iter(self.paths)
+        results = []
+
+        async def client():
+            for path in paths:
+                started = time.perf_counter()
+                status = await asgi_get(application, path)
+                results.append((status, time.perf_counter() - started))
+
+        async def clients():
+            await asyncio.gather(*[client() for _ in range(self.concurrency)])
+
+        started = time.perf_counter()
+        try:
+            asyncio.run(clients())
+        finally:
+            offload.shutdown()
+        return self.summary(results, time.perf_counter() - started)
+
+    def summary(self, results, seconds):
+        timings = sorted(duration * 1000 for _, duration in results)
+        return {
+            'requests': len(results),
+            'errors': sum(1 for status, _ in results if status >= 400),
+            'seconds': round(seconds, 3),
+            'per_second': round(len(results) / seconds, 1),
+            'median_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        }
@@ -0,0 +1,110 @@
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import rendering, signals, tasks
+from .models import Post
+from .sanitizer import sanitize_html
+from .services import link_categories
+
+# Bulk writes skip the per-row signal receivers, so each function below renders
+# the posts itself and queues the rest of the bookkeeping (search index, category
+# counts, autocomplete, latest posts, cached pages) once for the whole batch.
+
+
+def lock_ids():
+    """
+    Keeps other writers from inserting posts until the current transaction
+    ends, so ids read after it stay free.
+    """
+    if connection.vendor == 'sqlite':
+        # Any write takes SQLite's database lock, even one that changes no row.
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE sqlite_sequence SET seq = seq WHERE name = %s', [Post._meta.db_table])
+    else:
+        # Locks the newest post and, with InnoDB's next-key locks, the gap after
+        # it that new rows are inserted into.
+        list(Post.objects.select_for_update().order_by('-id').values_list('id', flat=True)[:1])
+
+def assign_ids(posts):
+    """
+    Gives new posts their ids up front on databases where bulk_create cannot
+    return them, so their categories and search terms can be written in bulk too.
+    Must be called in the transaction that inserts them.
+    """
+    if connection.features.can_return_rows_from_bulk_insert:
+        return
+    lock_ids()
+    last_id = Post.objects.aggregate(last=Max('id'))['last'] or 0
+    if connection.vendor == 'sqlite':
+        # AUTOINCREMENT never reuses the id of a deleted post, and neither should we.
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [Post._meta.db_table])
+            row = cursor.fetchone()
+        if row:
+            last_id = max(last_id, row[0])
+    for offset, post in enumerate(posts, 1):
+        post.id = last_id + offset
+
+def sanitize(post):
+    """
+    Sanitizes the post's content, as save_post does. Rendering is sanitizing,
+    which leaves sanitized content as it is, so that is the rendered body too.
+    """
+    post.content = post.rendered_content = sanitize_html(post.content)
+    post.content_hash = rendering.content_hash(post.content)
+
+@transaction.atomic
+def create_posts(posts, post_categories=None):
+    """
+    Inserts the unsaved posts with bulk_create. post_categories maps each
+    post's position in the list to its normalized category names.
+    """
+    for post in posts:
+        sanitize(post)
+    assign_ids(posts)
+    with signals.muted():
+        Post.objects.bulk_create(posts)
+        touched = link_categories({
+            posts[position].pk: names for position, names in (post_categories or {}).items()
+        })
+    tasks.posts_changed([post.pk for post in posts], touched)
+    return posts
+
+@transaction.atomic
+def update_posts(posts, fields, post_categories=None):
+    """
+    Saves the given fields of already loaded posts with bulk_update, and
+    replaces the categories of the posts in post_categories, a dict of post id
+    to normalized category names. A new create_date moves the posts within
+    their categories, so those are swept too.
+    """
+    fields = list(fields)
+    if 'content' in fields:
+        for post in posts:
+            sanitize(post)
+        fields += ['content_hash', 'rendered_content']
+    now = timezone.now()
+    for post in posts:
+        post.modified_at = now
+    with signals.muted():
+        Post.objects.bulk_update(posts, fields + ['modified_at'])
+        touched = link_categories(post_categories or {}, replace=True)
+    if 'create_date' in fields:
+        touched |= set(Post.categories.through.objects.filter(
+            post_id__in=[post.pk for post in posts]).values_list('category_id', flat=True))
+    tasks.posts_changed([post.pk for post in posts], touched)
+    return posts
+
+@transaction.atomic
+def delete_posts(post_ids):
+    """
+    Deletes the posts; any of their categories left without posts are deleted
+    by the worker.
+    """
+    through = Post.categories.through
+    category_ids = list(
+        through.objects.filter(post_id__in=post_ids).values_list('category_id', flat=True).distinct())
+    with signals.muted():
+        Post.objects.filter(pk__in=post_ids).delete()
+    tasks.posts_changed(post_ids, category_ids, deleted=True)
@@ -0,0 +1,134 @@
+import hashlib
+from calendar import timegm
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+GENERATION_KEY = 'page-cache:generation'
+
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+
+def timestamp(value):
+    return timegm(value.utctimetuple()) if value else None
+
+def not_modified(request, etag, last_modified):
+    """
+    Returns a 304 response when the request's validators still match, otherwise None.
+    """
+    return get_conditional_response(request, etag=etag, last_modified=timestamp(last_modified))
+
+def add_validators(response, etag, last_modified):
+    if etag and not response.has_header('ETag'):
+        response['ETag'] = etag
+    if last_modified and not response.has_header('Last-Modified'):
+        response['Last-Modified'] = http_date(timestamp(last_modified))
+    return response
+
+def page_cache_timeout():
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', 5 * 60)
+
+def page_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+def invalidate_pages():
+    """
+    Drops every cached page by moving on to a new generation of cache keys.
+    """
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, 1, None)
+
+def page_cache_key(request):
+    path = hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest()
+    return 'page-cache:%s:%s' % (page_generation(), path)
+
+def cached_page(request, key=None):
+    """
+    Returns the response for a page cached by ConditionalPageMixin, or None.
+    """
+    cached = cache.get(key or page_cache_key(request))
+    if cached is None:
+        return None
+    etag, last_modified, content, content_type = cached
+    return not_modified(request, etag, last_modified) or add_validators(
+        HttpResponse(content, content_type=content_type), etag, last_modified)
+
+
+class ConditionalPageMixin:
+    """
+    Adds ETag and Last-Modified validators to GET responses and answers a
+    matching conditional GET with a 304 before any template is rendered.
+    Pages for anonymous users are also cached whole until a post or category
+    is written.
+    """
+    def get_validators(self):
+        """
+        Returns (last_modified, state) for the page, where state is anything that
+        changes when the page content does.
+        """
+        raise NotImplementedError
+
+    def get_page_cache_timeout(self):
+        return page_cache_timeout()
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        key = None if request.user.is_authenticated else page_cache_key(request)
+        if key:
+            response = cached_page(request, key)
+            if response is not None:
+                return response
+        last_modified, state = self.get_validators()
+        etag = make_etag(request.user.pk, last_modified, state)
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        if hasattr(response, 'render'):
+            response.render()
+        if key:
+            cache.set(key, (etag, last_modified, response.content, response['Content-Type']),
+                      self.get_page_cache_timeout())
+        return add_validators(response, etag, last_modified)
+
+
+class ConditionalAPIMixin:
+    """
+    Conditional GET for the list and retrieve actions of an API viewset.
+    """
+
+    def get_list_validators(self):
+        raise NotImplementedError
+
+    def get_object_validators(self):
+        raise NotImplementedError
+
+    def conditional(self, request, validators, respond):
+        last_modified, state = validators
+        etag = make_etag(request.user.pk, request.accepted_renderer.format, request.get_full_path(),
+                         last_modified, state)
+        response = not_modified(request, etag, last_modified)
+        if response is None:
+            response = add_validators(respond(), etag, last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(request, self.get_list_validators(),
+                                lambda: super(ConditionalAPIMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(request, self.get_object_validators(),
+                                lambda: super(ConditionalAPIMixin, self).retrieve(request, *args, **kwargs))
@@ -0,0 +1,94 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Post
+
+FIELDS = ('id', 'title', 'content', 'create_date', 'modified_at', 'author', 'categories')
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class Echo:
+    """
+    A file-like object that hands back whatever is written to it, so csv.writer
+    can format one row at a time.
+    """
+
+    def write(self, value):
+        return value
+
+
+def parse_since(value):
+    """
+    Parses the timestamp of an incremental export. Returns None when the value
+    is not a valid ISO 8601 date and time.
+    """
+    try:
+        since = parse_datetime(value)
+    except ValueError:
+        return None
+    if since is not None and timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+def export_queryset(since=None):
+    """
+    The posts to export, with just the columns written out. An incremental
+    export only has the posts changed after since, oldest change first.
+    """
+    posts = Post.objects.values('id', 'title', 'content', 'create_date', 'modified_at',
+                                author=F('create_by__username'))
+    if since is None:
+        return posts.order_by('id')
+    return posts.filter(modified_at__gt=since).order_by('modified_at', 'id')
+
+def iter_records(queryset, chunk_size=2000):
+    """
+    Yields each post as a dict. Rows are read with a database cursor in chunks,
+    and the category names for each chunk are fetched with one more query, as
+    prefetch_related does not work with iterator().
+    """
+    chunk = []
+    for row in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield from with_categories(chunk)
+            chunk = []
+    if chunk:
+        yield from with_categories(chunk)
+
+def with_categories(rows):
+    names = {row['id']: [] for row in rows}
+    links = Post.categories.through.objects.filter(post_id__in=list(names)).order_by('category__name')
+    for post_id, name in links.values_list('post_id', 'category__name'):
+        names[post_id].append(name)
+    for row in rows:
+        row['categories'] = names[row['id']]
+        yield row
+
+def render_ndjson(records):
+    for record in records:
+        yield json.dumps({field: record[field] for field in FIELDS}, cls=DjangoJSONEncoder) + '\n'
+
+def render_csv(records):
+    writer = csv.writer(Echo())
+    yield writer.writerow(FIELDS)
+    for record in records:
+        record['categories'] = ','.join(record['categories'])
+        for field in ('create_date', 'modified_at'):
+            record[field] = record[field].isoformat()
+        yield writer.writerow([record[field] for field in FIELDS])
+
+def render(records, format):
+    """
+    Returns the lines of the export in the given format, one of FORMATS.
+    """
+    return {'ndjson': render_ndjson, 'csv': render_csv}[format](records)
@@ -0,0 +1,223 @@
+import hashlib
+import json
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import F
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+from django.utils.xmlutils import SimplerXMLGenerator
+
+from .export import with_categories
+from .models import Category, Post
+from .rendering import render_content
+
+FORMATS = {
+    'rss': 'application/rss+xml; charset=utf-8',
+    'atom': 'application/atom+xml; charset=utf-8',
+    'json': 'application/feed+json; charset=utf-8',
+}
+
+ITEM_KEY = 'feed-item:%s:%s'
+
+
+def feed_size():
+    return getattr(settings, 'FEED_SIZE', 50)
+
+
+class Feed:
+    """
+    What a feed is about: its title, the page it mirrors and its posts.
+    """
+
+    def __init__(self, title, link, posts):
+        self.title = title
+        self.link = link
+        self.posts = posts
+
+def get_feed(kind, key=None):
+    if kind == 'category':
+        category = get_object_or_404(Category, pk=key)
+        return Feed("Readit: %s" % category.name.title(), reverse('blog:category', args=(category.pk,)),
+                    Post.objects.filter(categories=category))
+    if kind == 'author':
+        author = get_object_or_404(User, username=key)
+        return Feed("Readit: posts by %s" % author.username, reverse('blog:index'),
+                    Post.objects.filter(create_by=author))
+    return Feed("Readit", reverse('blog:index'), Post.objects.all())
+
+def published(posts):
+    return posts.filter(create_date__lte=timezone.now()).order_by('-create_date', '-id')
+
+def item_rows(queryset):
+    """
+    The posts as dicts with everything an item needs, author being the
+    username and body the rendered content.
+    """
+    return queryset.values('id', 'title', 'create_date', 'modified_at', 'rendered_content', 'content',
+                           author=F('create_by__username'))
+
+def body(row):
+    # Rows saved before bodies were pre-rendered have no rendered content.
+    return row['rendered_content'] or render_content(row['content'])
+
+
+class RenderedItems:
+    """
+    A feedgenerator feed that writes items rendered beforehand, in place of
+    those added with add_item, and gives updated as its last change.
+    """
+    rendered_items = None
+    updated = None
+
+    def write_items(self, handler):
+        if self.rendered_items is None:
+            return super().write_items(handler)
+        for item in self.rendered_items:
+            # Written out as they are.
+            handler.ignorableWhitespace(item)
+
+    def latest_post_date(self):
+        return self.updated or timezone.now()
+
+
+class RSSFeed(RenderedItems, Rss201rev2Feed):
+    pass
+
+
+class AtomFeed(RenderedItems, Atom1Feed):
+    pass
+
+
+class XMLWriter:
+    """
+    RSS and Atom documents written by django.utils.feedgenerator. Items are
+    rendered one at a time, so they can be cached, and put together between
+    the head and the tail of a document written around a placeholder.
+    """
+    placeholder = '<!--items-->'
+    separator = ''
+
+    def __init__(self, generator_class):
+        self.generator_class = generator_class
+
+    def parts(self, feed, request, updated):
+        url = request.build_absolute_uri()
+        generator = self.generator_class(feed.title, request.build_absolute_uri(feed.link), feed.title,
+                                         feed_url=url, feed_guid=url)
+        generator.updated = updated
+        generator.rendered_items = [self.placeholder]
+        head, tail = generator.writeString('utf-8').split(self.placeholder)
+        return head, tail
+
+    def item(self, row, link):
+        generator = self.generator_class('', '', '')
+        generator.add_item(
+            row['title'], link, body(row), author_name=row['author'], pubdate=row['create_date'],
+            updateddate=row['modified_at'], unique_id=link, unique_id_is_permalink=True,
+            categories=row['categories'],
+        )
+        output = StringIO()
+        generator.write_items(SimplerXMLGenerator(output, 'utf-8'))
+        return output.getvalue()
+
+
+class JSONFeed:
+    def parts(self, feed, request, updated):
+        head = json.dumps({
+            'version': 'https://jsonfeed.org/version/1.1',
+            'title': feed.title,
+            'home_page_url': request.build_absolute_uri(feed.link),
+            'feed_url': request.build_absolute_uri(),
+        })
+        return head[:-1] + ', "items": [', ']}'
+
+    def item(self, row, link):
+        return json.dumps({
+            'id': link,
+            'url': link,
+            'title': row['title'],
+            'content_html': body(row),
+            'date_published': row['create_date'].isoformat(),
+            'date_modified': row['modified_at'].isoformat(),
+            'authors': [{'name': row['author']}],
+            'tags': row['categories'],
+        })
+
+    separator = ','
+
+
+WRITERS = {'rss': XMLWriter(RSSFeed), 'atom': XMLWriter(AtomFeed), 'json': JSONFeed()}
+
+
+def item_key(format, request, row):
+    """
+    Identifies a rendered item by everything it shows, so an item is only
+    rendered again after its post, its categories or its author's name change.
+    """
+    state = (request.get_host(), row['id'], row['modified_at'].isoformat(), row['author'],
+             tuple(row['categories']))
+    return ITEM_KEY % (format, hashlib.md5(repr(state).encode('utf-8')).hexdigest())
+
+def render_items(format, request, rows):
+    """
+    Returns the rendered items for rows of ids, modification times, authors
+    and categories. Items already rendered are taken from the cache; the bodies of
+    the others are read with one query and their items cached.
+    """
+    writer = WRITERS[format]
+    keys = [item_key(format, request, row) for row in rows]
+    items = cache.get_many(keys)
+    missing = {row['id']: (key, row) for key, row in zip(keys, rows) if key not in items}
+    if missing:
+        rendered = {}
+        for full in item_rows(Post.objects.filter(pk__in=list(missing))):
+            key, row = missing[full['id']]
+            full['categories'] = row['categories']
+            rendered[key] = writer.item(full, request.build_absolute_uri(reverse('blog:detail', args=(full['id'],))))
+        cache.set_many(rendered, getattr(settings, 'FEED_ITEM_CACHE_TIMEOUT', 24 * 60 * 60))
+        items.update(rendered)
+    return [items[key] for key in keys if key in items]
+
+def render_feed(format, request, feed, count):
+    """
+    Returns the newest count published posts of the feed as a document, with
+    its validators: (content, etag, last modified).
+    """
+    rows = list(with_categories(list(
+        published(feed.posts).values('id', 'modified_at', author=F('create_by__username'))[:count])))
+    updated = max((row['modified_at'] for row in rows), default=None)
+    writer = WRITERS[format]
+    head, tail = writer.parts(feed, request, updated)
+    content = head + writer.separator.join(render_items(format, request, rows)) + tail
+    etag = '"%s"' % hashlib.md5(content.encode('utf-8')).hexdigest()
+    return content, etag, updated
+
+def stream_feed(format, request, feed, chunk_size=500):
+    """
+    Yields the document for every published post of the feed, newest first,
+    reading and rendering the posts a chunk at a time.
+    """
+    writer = WRITERS[format]
+    head, tail = writer.parts(feed, request, None)
+    yield head
+    rows = item_rows(published(feed.posts)).iterator(chunk_size=chunk_size)
+    chunk = []
+    first = True
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield from stream_chunk(writer, request, chunk, first)
+            chunk, first = [], False
+    if chunk:
+        yield from stream_chunk(writer, request, chunk, first)
+    yield tail
+
+def stream_chunk(writer, request, rows, first):
+    for position, row in enumerate(with_categories(rows)):
+        link = request.build_absolute_uri(reverse('blog:detail', args=(row['id'],)))
+        yield ('' if first and not position else writer.separator) + writer.item(row, link)
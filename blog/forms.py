@@ -2,7 +2,8 @@ from django import forms
 from .models import Post
 
 class PostForm(forms.ModelForm):
-    category_csv = forms.CharField(required=True, label='Categories (comma serparated)')
+    category_csv = forms.CharField(required=True, label='Categories (comma serparated)', widget=forms.TextInput(
+        attrs={'list': 'category-suggestions', 'autocomplete': 'off'}))
 
     class Meta:
         model = Post
@@ -0,0 +1,189 @@
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+
+from . import autocomplete, caching, latest, search, signals
+from .bulk import assign_ids
+from .models import Category, Post
+from .rendering import content_hash
+from .sanitizer import clean_html
+from .services import normalize_categories, normalize_category_names, refresh_category_summaries
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+def read_rows(stream, format):
+    """
+    Yields the records of an NDJSON or CSV stream as dicts, in the layout
+    export_posts writes.
+    """
+    if format == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Reported as an invalid row by parse_row.
+                    yield None
+
+def parse_row(record, author_ids, default_author=None):
+    """
+    Checks one record and returns (post fields, category names). Authors are
+    looked up by username in author_ids.
+    """
+    if not isinstance(record, dict):
+        raise InvalidRow("expected an object")
+    title = record.get('title') or ''
+    if not isinstance(title, str) or not title or len(title) > Post._meta.get_field('title').max_length:
+        raise InvalidRow("title is missing or too long")
+    content = record.get('content')
+    if not isinstance(content, str):
+        raise InvalidRow("content is missing")
+    create_date = parse_datetime(record.get('create_date') or '')
+    if create_date is None:
+        raise InvalidRow("create_date is not an ISO 8601 date and time")
+    if timezone.is_naive(create_date):
+        create_date = timezone.make_aware(create_date)
+    author = record.get('author')
+    if author is not None and not isinstance(author, str):
+        raise InvalidRow("author is not a username")
+    author_id = author_ids.get(author, default_author)
+    if author_id is None:
+        raise InvalidRow("unknown author %r" % author)
+    categories = record.get('categories') or ''
+    if isinstance(categories, str):
+        categories = normalize_categories(categories)
+    elif isinstance(categories, list) and all(isinstance(name, str) for name in categories):
+        categories = normalize_category_names(categories)
+    else:
+        raise InvalidRow("categories are not a list of names")
+    if any(len(name) > Category._meta.get_field('name').max_length for name in categories):
+        raise InvalidRow("category name too long")
+    return {'title': title, 'content': content, 'create_date': create_date,
+            'create_by_id': author_id}, categories
+
+
+class PostImporter:
+    """
+    Loads posts in batches: content is sanitized across a process pool while
+    the previous batch is written, categories are resolved against a name to id
+    map kept in memory, and posts and their category links are written with
+    bulk_create, one transaction per batch.
+    """
+
+    def __init__(self, batch_size=1000, workers=None, default_author=None):
+        self.batch_size = batch_size
+        self.workers = os.cpu_count() if workers is None else workers
+        self.default_author = default_author
+        self.category_ids = dict(Category.objects.values_list('name', 'id'))
+        self.author_ids = {}
+        self.imported = 0
+        self.touched = set()
+        self.skipped = []
+
+    def run(self, rows, start=0, on_batch=None):
+        """
+        Imports the rows, skipping the first start of them. on_batch is called
+        with the number of rows read so far after every committed batch, which is
+        where a later run can pick up from.
+        """
+        rows = islice(rows, start, None)
+        position = start
+        pool = ProcessPoolExecutor(self.workers) if self.workers else None
+        pending = None
+        try:
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if batch:
+                    posts, categories = self.parse_batch(batch, position)
+                    contents = [post.content for post in posts]
+                    if pool:
+                        chunksize = max(1, len(contents) // (self.workers * 4))
+                        cleaned = pool.map(clean_html, contents, chunksize=chunksize)
+                    else:
+                        cleaned = map(clean_html, contents)
+                    position += len(batch)
+                # The pool works on this batch while the previous one is written.
+                if pending:
+                    self.write_batch(*pending[:3])
+                    if on_batch:
+                        on_batch(pending[3])
+                if not batch:
+                    break
+                pending = (posts, categories, cleaned, position)
+        finally:
+            if pool:
+                pool.shutdown()
+        # Summaries are refreshed once at the end, as each refresh reads every
+        # post in the categories it covers. A resumed run cannot tell which
+        # categories the earlier run touched, so it refreshes them all.
+        if start:
+            self.touched = set(Category.objects.values_list('id', flat=True))
+        refresh_category_summaries(self.touched)
+        autocomplete.invalidate()
+        latest.invalidate()
+        caching.invalidate_pages()
+        return self.imported
+
+    def parse_batch(self, batch, position):
+        usernames = {
+            record.get('author') for record in batch
+            if isinstance(record, dict) and isinstance(record.get('author'), str)
+        }
+        missing = usernames - set(self.author_ids)
+        if missing:
+            self.author_ids.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
+        posts, categories = [], []
+        for number, record in enumerate(batch, position + 1):
+            try:
+                fields, names = parse_row(record, self.author_ids, self.default_author)
+            except InvalidRow as exc:
+                self.skipped.append((number, str(exc)))
+                continue
+            posts.append(Post(**fields))
+            categories.append(names)
+        return posts, categories
+
+    def resolve(self, names):
+        """
+        Adds the categories in names that are not in the map yet.
+        """
+        missing = [name for name in dict.fromkeys(names) if name not in self.category_ids]
+        if missing:
+            Category.objects.bulk_create(
+                [Category(name=name, slug=name.replace(" ", "-")) for name in missing],
+                ignore_conflicts=True,
+            )
+            self.category_ids.update(Category.objects.filter(name__in=missing).values_list('name', 'id'))
+
+    @transaction.atomic
+    def write_batch(self, posts, categories, cleaned):
+        for post, content in zip(posts, cleaned):
+            # Rendering is sanitizing, which leaves sanitized content as it is,
+            # so the sanitized content is also the rendered body.
+            post.content = post.rendered_content = content
+            post.content_hash = content_hash(content)
+        assign_ids(posts)
+        self.resolve([name for names in categories for name in names])
+        through = Post.categories.through
+        with signals.muted():
+            Post.objects.bulk_create(posts)
+            links = [
+                through(post_id=post.pk, category_id=self.category_ids[name])
+                for post, names in zip(posts, categories) for name in names
+            ]
+            through.objects.bulk_create(links)
+        self.touched.update(link.category_id for link in links)
+        search.index_posts(posts)
+        self.imported += len(posts)
@@ -0,0 +1,178 @@
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Post
+
+FEED_KEY = 'latest-posts'
+LOCK_KEY = 'latest-posts:lock'
+
+
+def feed_size():
+    return getattr(settings, 'LATEST_POSTS_SIZE', 100)
+
+def feed_timeout():
+    return getattr(settings, 'LATEST_POSTS_TIMEOUT', 10 * 60)
+
+def sort_key(post):
+    return (post['create_date'], post['id'])
+
+def summaries(queryset):
+    """
+    The posts as dicts with what the index page shows, create_by being the
+    author's username.
+    """
+    posts = list(queryset.values('id', 'title', 'create_date', 'modified_at', author=F('create_by__username')))
+    for post in posts:
+        post['create_by'] = post.pop('author')
+    return posts
+
+def build():
+    """
+    Reads the newest published posts and the next posts due to be published,
+    up to LATEST_POSTS_SIZE of each. 'complete' says a list holds every such
+    post rather than only the first ones. Every build starts from a new
+    version, as pages take their ETag from it.
+    """
+    now = timezone.now()
+    size = feed_size()
+    published = summaries(Post.objects.filter(create_date__lte=now).order_by('-create_date', '-id')[:size])
+    upcoming = summaries(Post.objects.filter(create_date__gt=now).order_by('create_date', 'id')[:size])
+    return {
+        'version': uuid.uuid4().int,
+        'published': published,
+        'published_complete': len(published) < size,
+        'upcoming': upcoming,
+        'upcoming_complete': len(upcoming) < size,
+    }
+
+def publish_due(feed, now):
+    """
+    Moves the upcoming posts whose create date has passed to the published
+    ones. Returns False when posts beyond the upcoming list may be due as well,
+    and the feed has to be read again.
+    """
+    due = [post for post in feed['upcoming'] if post['create_date'] <= now]
+    if not due:
+        return True
+    if len(due) == len(feed['upcoming']) and not feed['upcoming_complete']:
+        return False
+    feed['upcoming'] = feed['upcoming'][len(due):]
+    feed['published'] = sorted(due, key=sort_key, reverse=True) + feed['published']
+    return True
+
+def load():
+    """
+    Returns the feed with every post due by now published, reading it from the
+    database when the cache does not have a usable one.
+    """
+    now = timezone.now()
+    feed = cache.get(FEED_KEY)
+    if feed is not None and publish_due(feed, now):
+        return feed
+    feed = build()
+    cache.set(FEED_KEY, feed, feed_timeout())
+    return feed
+
+def latest(count):
+    """
+    Returns the newest count published posts as dicts, whether there are more
+    after them, and the feed version, which changes with every update.
+    """
+    feed = load()
+    posts = feed['published']
+    if len(posts) < count and not feed['published_complete']:
+        # Deletes have left fewer posts than a page; start again.
+        invalidate()
+        feed = load()
+        posts = feed['published']
+    has_more = len(posts) > count or not feed['published_complete']
+    return posts[:count], has_more, (feed['version'], len(feed['upcoming']))
+
+def next_due():
+    """
+    The create date of the next post due to be published, or None.
+    """
+    upcoming = load()['upcoming']
+    return upcoming[0]['create_date'] if upcoming else None
+
+def insert(posts, post, complete, newest_first):
+    """
+    Adds post to a sorted list holding either every post (complete) or only
+    the first ones, in which case a post sorting after the last of them is
+    left out.
+    """
+    if not complete and posts:
+        last = sort_key(posts[-1])
+        if (sort_key(post) < last) if newest_first else (sort_key(post) > last):
+            return
+    posts.append(post)
+    posts.sort(key=sort_key, reverse=newest_first)
+
+def change(apply):
+    """
+    Applies a change to the cached feed. Writers take a short lock; one that
+    cannot drops the feed instead, which is always safe as the next read
+    rebuilds it.
+    """
+    if not cache.add(LOCK_KEY, 1, 10):
+        invalidate()
+        return
+    try:
+        feed = cache.get(FEED_KEY)
+        if feed is None:
+            return
+        if not publish_due(feed, timezone.now()):
+            invalidate()
+            return
+        apply(feed)
+        size = feed_size()
+        for name in ('published', 'upcoming'):
+            if len(feed[name]) > size:
+                del feed[name][size:]
+                feed[name + '_complete'] = False
+        feed['version'] += 1
+        cache.set(FEED_KEY, feed, feed_timeout())
+    finally:
+        cache.delete(LOCK_KEY)
+
+def update_posts(posts):
+    """
+    Puts new and edited posts in the feed.
+    """
+    missing = {post.create_by_id for post in posts if not Post.create_by.is_cached(post)}
+    usernames = dict(User.objects.filter(pk__in=missing).values_list('id', 'username')) if missing else {}
+    now = timezone.now()
+    changed = [{
+        'id': post.pk,
+        'title': post.title,
+        'create_date': post.create_date,
+        'modified_at': post.modified_at,
+        'create_by': post.create_by.username if Post.create_by.is_cached(post) else usernames[post.create_by_id],
+    } for post in posts]
+
+    def apply(feed):
+        ids = {post['id'] for post in changed}
+        feed['published'] = [post for post in feed['published'] if post['id'] not in ids]
+        feed['upcoming'] = [post for post in feed['upcoming'] if post['id'] not in ids]
+        for post in changed:
+            if post['create_date'] <= now:
+                insert(feed['published'], post, feed['published_complete'], True)
+            else:
+                insert(feed['upcoming'], post, feed['upcoming_complete'], False)
+    change(apply)
+
+def remove_posts(post_ids):
+    ids = set(post_ids)
+
+    def apply(feed):
+        feed['published'] = [post for post in feed['published'] if post['id'] not in ids]
+        feed['upcoming'] = [post for post in feed['upcoming'] if post['id'] not in ids]
+    change(apply)
+
+def invalidate():
+    cache.delete(FEED_KEY)
@@ -0,0 +1,63 @@
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import get_internal_wsgi_application
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils.module_loading import import_string
+
+from blog.benchmarks import ConcurrencyBenchmark, open_corpus, parse_size, read_paths, slow_queries
+
+
+class Command(BaseCommand):
+    help = ('Compares the throughput of the WSGI and ASGI applications for the read views under '
+            'many concurrent requests, with every query slowed down as on a busy database server.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', default='10k', help='10k, 100k, 1m or a number of posts.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--db', help='SQLite file for the corpus, shared with bench_views.')
+        parser.add_argument('--delay', type=float, default=20, help='Milliseconds added to every query.')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=100, help='Requests in flight at once.')
+        parser.add_argument('--workers', type=int, default=4, help='WSGI requests handled at once.')
+        parser.add_argument('--threads', type=int, default=getattr(settings, 'ASYNC_DB_THREADS', 20),
+                            help='Database threads of the ASGI application.')
+        parser.add_argument('--warm', action='store_true',
+                            help='Use the configured cache instead of none, so cached pages are served.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("The benchmarks run on SQLite; set DATABASE_URL=sqlite://... to run them.")
+        size = parse_size(options['size'])
+        path = options['db'] or os.path.join(
+            tempfile.gettempdir(), 'readit-bench-%d-%d.sqlite3' % (size, options['seed']))
+        open_corpus(path, size, options['seed'], self.stdout)
+
+        test_settings = {'ALLOWED_HOSTS': ['localhost'], 'ASYNC_DB_THREADS': options['threads'],
+                         'THROTTLE_RATES': {}}
+        if not options['warm']:
+            test_settings['CACHES'] = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        results = {}
+        with override_settings(**test_settings):
+            benchmark = ConcurrencyBenchmark(read_paths(), options['requests'], options['concurrency'])
+            with slow_queries(options['delay'] / 1000):
+                results['wsgi'] = benchmark.run_wsgi(get_internal_wsgi_application(), options['workers'])
+                results['asgi'] = benchmark.run_asgi(import_string(settings.ASGI_APPLICATION))
+
+        self.stdout.write('%-6s %9s %7s %10s %10s %10s' % ('server', 'requests', 'errors', 'req/s', 'median',
+                                                           'p95'))
+        for name, result in results.items():
+            self.stdout.write('%-6s %9d %7d %10.1f %8.2fms %8.2fms' % (
+                name, result['requests'], result['errors'], result['per_second'], result['median_ms'],
+                result['p95_ms']))
+        if options['output']:
+            run = {'meta': {key: options[key] for key in ('size', 'seed', 'delay', 'requests', 'concurrency',
+                                                          'workers', 'threads', 'warm')},
+                   'results': results}
+            with open(options['output'], 'w') as output:
+                json.dump(run, output, indent=2, sort_keys=True)
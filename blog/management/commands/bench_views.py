@@ -0,0 +1,79 @@
+import json
+import os
+import platform
+import re
+import sqlite3
+import tempfile
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from blog.benchmarks import Benchmark, build_scenarios, compare, open_corpus, parse_size
+
+
+class Command(BaseCommand):
+    help = ('Times every page and API action against a generated corpus in a separate SQLite '
+            'database, and optionally compares the results with a saved run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', default='10k', help='10k, 100k, 1m or a number of posts.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--db', help='SQLite file for the corpus. It is kept and reused by later '
+                                         'runs of the same size and seed.')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per scenario.')
+        parser.add_argument('--warm', action='store_true',
+                            help='Keep the cache between runs instead of clearing it before each.')
+        parser.add_argument('--only', help='Only run scenarios whose name matches this regular expression.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--compare', help='A JSON file from an earlier run to compare with.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Slow down, as a fraction, counted as a regression.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("The benchmarks run on SQLite; set DATABASE_URL=sqlite://... to run them.")
+        size = parse_size(options['size'])
+        path = options['db'] or os.path.join(
+            tempfile.gettempdir(), 'readit-bench-%d-%d.sqlite3' % (size, options['seed']))
+        open_corpus(path, size, options['seed'], self.stdout)
+
+        scenarios, user = build_scenarios()
+        if options['only']:
+            scenarios = [scenario for scenario in scenarios if re.search(options['only'], scenario.name)]
+        benchmark = Benchmark(user, options['repeat'], options['warm'])
+        results = {}
+        self.stdout.write('%-28s %6s %8s %10s %10s %10s' % ('scenario', 'status', 'queries', 'median',
+                                                          'p95', 'peak'))
+        with override_settings(ALLOWED_HOSTS=['testserver'], THROTTLE_RATES={}):
+            for scenario in scenarios:
+                result = results[scenario.name] = benchmark.measure(scenario)
+                self.stdout.write('%-28s %6d %8d %8.2fms %8.2fms %8.1fkB' % (
+                    scenario.name, result['status'], result['queries'], result['median_ms'],
+                    result['p95_ms'], result['peak_kb']))
+
+        run = {
+            'meta': {
+                'posts': size, 'seed': options['seed'], 'repeat': options['repeat'],
+                'cache': 'warm' if options['warm'] else 'cold', 'python': platform.python_version(),
+                'django': django.get_version(), 'sqlite': sqlite3.sqlite_version,
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(run, output, indent=2, sort_keys=True)
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                self.report(compare(json.load(baseline), run, options['threshold']))
+
+    def report(self, rows):
+        regressions = [row for row in rows if row[5]]
+        self.stdout.write('\n%-28s %-10s %10s %10s %8s' % ('scenario', 'metric', 'baseline', 'now', 'change'))
+        for name, metric, old, new, change, regressed in rows:
+            self.stdout.write('%-28s %-10s %10s %10s %+7.1f%%%s' % (
+                name, metric, old, new, change * 100, '  REGRESSED' if regressed else ''))
+        if regressions:
+            raise CommandError("%d regressions against the baseline." % len(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
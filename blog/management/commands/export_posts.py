@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.export import FORMATS, export_queryset, iter_records, parse_since, render
+
+
+class Command(BaseCommand):
+    help = 'Writes every post, or those changed since a given time, as NDJSON or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), default='ndjson')
+        parser.add_argument('--since', help='Only export posts changed after this ISO 8601 time.')
+        parser.add_argument('--output', help='File to write to instead of stdout.')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Rows read from the database at a time.')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_since(options['since'])
+            if since is None:
+                raise CommandError("--since must be an ISO 8601 date and time.")
+        records = iter_records(export_queryset(since), options['chunk_size'])
+        lines = render(records, options['format'])
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
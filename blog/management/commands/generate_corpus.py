@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from blog.benchmarks import CorpusGenerator, parse_size
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with a reproducible corpus of generated users, categories and posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', default='10k', help='10k, 100k, 1m or a number of posts.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Zipf exponent of the tag and author distributions.')
+
+    def handle(self, *args, **options):
+        generator = CorpusGenerator(parse_size(options['posts']), options['seed'], skew=options['skew'])
+        written = generator.generate(stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS("Generated %d posts, %d categories and %d users." % (
+            written, generator.categories, generator.users)))
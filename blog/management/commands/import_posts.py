@@ -0,0 +1,82 @@
+import json
+import os
+import sys
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.importing import PostImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = ('Imports posts from an NDJSON or CSV file in the layout export_posts writes. '
+            'With --checkpoint, a failed import can be run again and carries on where it stopped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin.")
+        parser.add_argument('--format', choices=['ndjson', 'csv'],
+                            help='Defaults to csv for .csv files and ndjson otherwise.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Posts written per transaction.')
+        parser.add_argument('--workers', type=int,
+                            help='Processes sanitizing content, 0 to sanitize in this one. '
+                                 'Defaults to the number of CPUs.')
+        parser.add_argument('--author', help='Username to use for rows whose author does not exist.')
+        parser.add_argument('--checkpoint',
+                            help='File recording how many rows have been imported.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        default_author = None
+        if options['author']:
+            default_author = User.objects.filter(username=options['author']).values_list('id', flat=True).first()
+            if default_author is None:
+                raise CommandError("No user named %s." % options['author'])
+        checkpoint = options['checkpoint']
+        start = self.read_checkpoint(checkpoint, path)
+        if start:
+            self.stdout.write("Resuming after row %d." % start)
+
+        importer = PostImporter(options['batch_size'], options['workers'], default_author)
+        started = time.monotonic()
+
+        def on_batch(position):
+            if checkpoint:
+                self.write_checkpoint(checkpoint, path, position)
+            elapsed = time.monotonic() - started
+            self.stdout.write("%d rows read, %d imported, %.0f rows/s" % (
+                position, importer.imported, importer.imported / elapsed if elapsed else 0))
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            importer.run(read_rows(stream, format), start, on_batch)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for number, reason in importer.skipped:
+            self.stderr.write("Skipped row %d: %s" % (number, reason))
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS("Imported %d posts in %.1fs (%.0f rows/s), skipped %d rows." % (
+            importer.imported, elapsed, importer.imported / elapsed if elapsed else 0,
+            len(importer.skipped))))
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+    def read_checkpoint(self, checkpoint, path):
+        if not checkpoint or not os.path.exists(checkpoint):
+            return 0
+        with open(checkpoint) as handle:
+            state = json.load(handle)
+        if state['source'] != os.path.abspath(path):
+            raise CommandError("The checkpoint %s is for %s." % (checkpoint, state['source']))
+        return state['rows']
+
+    def write_checkpoint(self, checkpoint, path, rows):
+        # Written to a temporary file and renamed, so a crash cannot leave half a checkpoint.
+        temporary = checkpoint + '.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump({'source': os.path.abspath(path), 'rows': rows}, handle)
+        os.replace(temporary, checkpoint)
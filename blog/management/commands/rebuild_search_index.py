@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from blog import search
+
+
+class Command(BaseCommand):
+    help = 'Clears the search index and rebuilds it from every post.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of posts loaded from the database at a time.')
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        count = search.rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Indexed %d posts with %s.' % (count, type(backend).__name__)))
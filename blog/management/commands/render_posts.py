@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import Post
+from blog.rendering import refresh_rendered_content
+
+
+class Command(BaseCommand):
+    help = ('Renders the stored body of the posts saved before bodies were pre-rendered, '
+            'or whose content changed since.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of posts loaded from the database at a time.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        count = 0
+        batch = []
+        posts = Post.objects.only('id', 'content', 'content_hash', 'rendered_content')
+        for post in posts.iterator(chunk_size=batch_size):
+            if refresh_rendered_content(post):
+                batch.append(post)
+            if len(batch) == batch_size:
+                Post.objects.bulk_update(batch, ['content_hash', 'rendered_content'])
+                count += len(batch)
+                batch = []
+        Post.objects.bulk_update(batch, ['content_hash', 'rendered_content'])
+        count += len(batch)
+        self.stdout.write(self.style.SUCCESS('Rendered %d posts.' % count))
@@ -0,0 +1,53 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from blog import tasks
+
+
+class Command(BaseCommand):
+    help = ('Runs the tasks queued by post writes: search indexing, the latest posts feed, category '
+            'summaries and orphans, and cached pages. Stops after the current task on SIGINT or SIGTERM.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the tasks that are due, then exit.')
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help='Seconds to wait before looking again when the queue is empty.')
+        parser.add_argument('--stats', action='store_true',
+                            help='Print how many tasks of each kind ran, failed or wait, and their run times.')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            return self.report(tasks.stats())
+        self.stopping = False
+        if not options['once']:
+            signal.signal(signal.SIGINT, self.stop)
+            signal.signal(signal.SIGTERM, self.stop)
+        ran = 0
+        requeued = tasks.requeue_stale()
+        if requeued:
+            self.stdout.write("Queued %d tasks left running by a stopped worker again." % requeued)
+        while not self.stopping:
+            close_old_connections()
+            if tasks.run_pending(limit=1):
+                ran += 1
+                continue
+            if options['once']:
+                break
+            tasks.requeue_stale()
+            tasks.purge_done()
+            time.sleep(options['sleep'])
+        self.stdout.write("Ran %d tasks." % ran)
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def report(self, rows):
+        self.stdout.write('%-20s %8s %8s %8s %8s %8s %10s %10s' % (
+            'task', 'pending', 'running', 'done', 'failed', 'retried', 'avg', 'max'))
+        for name, row in rows.items():
+            self.stdout.write('%-20s %8d %8d %8d %8d %8d %8.1fms %8.1fms' % (
+                name, row['pending'], row['running'], row['done'], row['failed'], row['retried'],
+                (row['avg_seconds'] or 0) * 1000, (row['max_seconds'] or 0) * 1000))
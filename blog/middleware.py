@@ -0,0 +1,303 @@
+import asyncio
+import cProfile
+import itertools
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+from asgiref.local import Local
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template
+
+from . import routers
+
+logger = logging.getLogger('blog.profiling')
+
+# The profile of the request being handled, for the query and template hooks.
+# An asgiref Local, so it follows async requests onto the database threads.
+_current = Local()
+
+# Frames from these paths are skipped when looking for where a query came from.
+LIBRARY_PATHS = tuple(
+    os.path.dirname(os.path.dirname(module.__file__))
+    for module in (sys.modules['django'], sys.modules['json'])
+)
+
+
+class RequestProfile:
+    """
+    What one request spent its time on: the queries it ran, with where in the
+    project each came from, and the time spent rendering templates. Queries run
+    while a template renders count as SQL time, not template time.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = []
+        self.rendering = 0
+        self.render_time = 0.0
+        self.render_sql_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        """
+        Times a query; called by profile_query.
+        """
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            if self.rendering:
+                self.render_sql_time += duration
+            self.queries.append((sql, repr(params), duration, query_origin()))
+
+    @property
+    def template_time(self):
+        return self.render_time - self.render_sql_time
+
+    @property
+    def sql_time(self):
+        return sum(duration for _, _, duration, _ in self.queries)
+
+    def duplicates(self):
+        """
+        Returns how many queries repeated an earlier one exactly, and the
+        statements run more than once with different parameters, which usually
+        means a query in a loop.
+        """
+        exact = Counter((sql, params) for sql, params, _, _ in self.queries)
+        similar = Counter(sql for sql, _, _, _ in self.queries)
+        return (sum(count - 1 for count in exact.values()),
+                {sql: count for sql, count in similar.items() if count > 1})
+
+    def slowest(self, count):
+        return sorted(self.queries, key=lambda query: query[2], reverse=True)[:count]
+
+
+def query_origin():
+    """
+    Returns 'file:line in function' for the innermost frame of project code
+    that led to the current query.
+    """
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not filename.startswith(LIBRARY_PATHS) and filename != __file__:
+            return '%s:%d in %s' % (os.path.relpath(filename, settings.BASE_DIR), frame.f_lineno,
+                                    frame.f_code.co_name)
+        frame = frame.f_back
+    return None
+
+def profile_query(execute, sql, params, many, context):
+    """
+    The execute wrapper of every connection while profiling is on, which
+    hands the query to the profile of the current request, if any.
+    """
+    profile = getattr(_current, 'profile', None)
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+def watch_connection(connection, **kwargs):
+    if profile_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(profile_query)
+
+def timed_render(render):
+    def wrapper(self, *args, **kwargs):
+        profile = getattr(_current, 'profile', None)
+        if profile is None:
+            return render(self, *args, **kwargs)
+        started = time.perf_counter()
+        profile.rendering += 1
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            profile.rendering -= 1
+            if not profile.rendering:
+                profile.render_time += time.perf_counter() - started
+    wrapper.profiled = True
+    return wrapper
+
+def mark_async(middleware, get_response):
+    """
+    Returns whether the middleware is being set up in an async chain, where it
+    has to look like a coroutine function to Django, as MiddlewareMixin does.
+    """
+    if asyncio.iscoroutinefunction(get_response):
+        middleware._is_coroutine = asyncio.coroutines._is_coroutine
+        return True
+    return False
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 3)
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in request profiling, turned on with the PROFILING setting; when it is
+    off Django drops the middleware at startup. Every request gets a
+    Server-Timing header and a JSON line on the blog.profiling logger with its
+    total, SQL and template time, duplicate queries and slowest queries. With
+    PROFILING_SAMPLE_RATE set to N, one request in N is also run under cProfile
+    and the stats dumped into PROFILING_DIR; only under WSGI, as a profile of
+    the event loop would take in every other request in flight.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = mark_async(self, get_response)
+        self.top_queries = getattr(settings, 'PROFILING_TOP_QUERIES', 5)
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+        self.profile_dir = getattr(settings, 'PROFILING_DIR', None)
+        self.requests = itertools.count(1)
+        if not getattr(Template.render, 'profiled', False):
+            Template.render = timed_render(Template.render)
+        # Queries run on whichever thread has the connection, which under ASGI
+        # is not the one running this middleware, so every connection reports
+        # to the current request's profile.
+        connection_created.connect(watch_connection, dispatch_uid='blog.profiling')
+        for alias in connections:
+            watch_connection(connections[alias])
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        profile = _current.profile = RequestProfile()
+        profiler = None
+        number = next(self.requests)
+        if self.sample_rate and number % self.sample_rate == 0:
+            profiler = cProfile.Profile()
+        try:
+            for alias in connections:
+                watch_connection(connections[alias])
+            if profiler:
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler:
+                    profiler.disable()
+        finally:
+            _current.profile = None
+        total = time.perf_counter() - profile.started
+        dump = self.dump_profile(profiler, request, number) if profiler else None
+        self.report(request, response, profile, total, dump)
+        return response
+
+    async def __acall__(self, request):
+        profile = _current.profile = RequestProfile()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.profile = None
+        self.report(request, response, profile, time.perf_counter() - profile.started, None)
+        return response
+
+    def dump_profile(self, profiler, request, number):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = '%s-%s-%d-%d.prof' % (time.strftime('%Y%m%d-%H%M%S'),
+                                     re.sub(r'[^\w]+', '-', request.path).strip('-') or 'root',
+                                     os.getpid(), number)
+        path = os.path.join(self.profile_dir, name)
+        profiler.dump_stats(path)
+        return path
+
+    def report(self, request, response, profile, total, dump):
+        duplicates, similar = profile.duplicates()
+        sql_time = profile.sql_time
+        response['Server-Timing'] = ', '.join([
+            'total;dur=%.3f' % milliseconds(total),
+            'sql;dur=%.3f;desc="%d queries"' % (milliseconds(sql_time), len(profile.queries)),
+            'template;dur=%.3f' % milliseconds(profile.template_time),
+            'app;dur=%.3f' % milliseconds(total - sql_time - profile.template_time),
+        ])
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'total_ms': milliseconds(total),
+            'sql_count': len(profile.queries),
+            'sql_ms': milliseconds(sql_time),
+            'duplicate_queries': duplicates,
+            'repeated_statements': [
+                {'sql': sql[:200], 'count': count}
+                for sql, count in sorted(similar.items(), key=lambda item: -item[1])[:self.top_queries]
+            ],
+            'template_ms': milliseconds(profile.template_time),
+            'slowest_queries': [
+                {'sql': sql[:200], 'ms': milliseconds(duration), 'origin': origin}
+                for sql, _, duration, origin in profile.slowest(self.top_queries)
+            ],
+            'profile': dump,
+        }))
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Lets blog.routers.ReplicaRouter send the reads of GET and HEAD requests to
+    the replicas in REPLICA_DATABASES. After a request writes, a cookie pins
+    that client to the primary for REPLICA_PIN_SECONDS so it reads its own
+    writes. A request whose replica fails part way is run again on the primary.
+    Not used when no replicas are configured.
+    """
+    sync_capable = True
+    async_capable = True
+    pin_cookie = 'primary_pin'
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REPLICA_DATABASES', None):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = mark_async(self, get_response)
+        self.pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = routers.end_request()
+        return self.pin(request, response, wrote)
+
+    async def __acall__(self, request):
+        self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            wrote = routers.end_request()
+        return self.pin(request, response, wrote)
+
+    def start(self, request):
+        routers.start_request(request.method in ('GET', 'HEAD', 'OPTIONS')
+                              and self.pin_cookie not in request.COOKIES)
+
+    def pin(self, request, response, wrote):
+        if wrote or request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            response.set_cookie(self.pin_cookie, '1', max_age=self.pin_seconds, httponly=True)
+        return response
+
+    def process_exception(self, request, exception):
+        replica = routers.current_replica()
+        if replica is None or not isinstance(exception, DatabaseError):
+            return None
+        routers.mark_unavailable(replica)
+        match = request.resolver_match
+        view = match.func
+        if asyncio.iscoroutinefunction(view):
+            # Django calls this from a sync thread under ASGI as well; run the
+            # sync view the async one wraps (see blog.offload.offloaded).
+            view = view.__wrapped__
+        return view(request, *match.args, **match.kwargs)
@@ -0,0 +1,50 @@
+# Generated by Django 2.0.6 on 2026-10-18 06:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_fts_table(apps, schema_editor):
+    """
+    Creates the FTS5 table used for search on SQLite, when SQLite was built with it.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not cursor.fetchone()[0]:
+            return
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS blog_post_fts "
+            "USING fts5(title, content, tokenize='unicode61')"
+        )
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS blog_post_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0004_auto_20180803_0443'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('title_frequency', models.PositiveIntegerField(default=0)),
+                ('content_frequency', models.PositiveIntegerField(default=0)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='blog.Post')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchterm',
+            unique_together={('term', 'post')},
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
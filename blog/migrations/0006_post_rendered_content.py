@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 06:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rendered_content',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_post_rendered_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='modified_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='modified_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
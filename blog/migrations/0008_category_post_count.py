@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-18 06:21
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_posts(apps, schema_editor):
+    Category = apps.get_model('blog', 'Category')
+    for category in Category.objects.annotate(posts=Count('post')).iterator():
+        if category.posts:
+            Category.objects.filter(pk=category.pk).update(post_count=category.posts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0007_modified_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_posts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 2.2.28 on 2026-10-18 06:22
+
+from django.db import migrations, models
+
+
+def merge_duplicate_categories(apps, schema_editor):
+    """
+    Upper cases category names and merges categories that then share a name into
+    the oldest of them, so the unique index can be added.
+    """
+    Category = apps.get_model('blog', 'Category')
+    Through = apps.get_model('blog', 'Post').categories.through
+    keep = {}
+    for category in Category.objects.order_by('id'):
+        name = category.name.strip().upper()
+        if name not in keep:
+            keep[name] = category
+            continue
+        kept = keep[name]
+        linked = Through.objects.filter(category_id=kept.id).values_list('post_id', flat=True)
+        Through.objects.filter(category_id=category.id).exclude(post_id__in=list(linked)).update(
+            category_id=kept.id)
+        category.delete()
+    for name, category in keep.items():
+        Category.objects.filter(pk=category.pk).update(
+            name=name, post_count=Through.objects.filter(category_id=category.pk).count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_category_post_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_categories, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='category',
+            name='name',
+            field=models.CharField(max_length=200, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['-post_count', 'id'], name='category_popularity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['modified_at'], name='category_modified_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['create_date', 'id'], name='post_create_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['create_by', 'create_date', 'id'], name='post_author_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['modified_at'], name='post_modified_at_idx'),
+        ),
+    ]
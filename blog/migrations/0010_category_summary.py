@@ -0,0 +1,45 @@
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def summarize_categories(apps, schema_editor):
+    Category = apps.get_model('blog', 'Category')
+    Post = apps.get_model('blog', 'Post')
+    Link = Post.categories.through
+    latest = dict(
+        Link.objects.values_list('category_id').annotate(latest=Max('post__create_date'))
+    )
+    authors = {}
+    rows = (
+        Link.objects.values_list('category_id', 'post__create_by__username')
+        .annotate(count=Count('*'))
+        .order_by('category_id', '-count', 'post__create_by__username')
+    )
+    for category_id, username, _ in rows:
+        authors.setdefault(category_id, [])
+        if len(authors[category_id]) < 3:
+            authors[category_id].append(username)
+    for category_id, date in latest.items():
+        Category.objects.filter(pk=category_id).update(
+            latest_post_date=date, top_authors=','.join(authors.get(category_id, [])))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0009_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='latest_post_date',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='top_authors',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(summarize_categories, migrations.RunPython.noop),
+    ]
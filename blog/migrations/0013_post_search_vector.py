@@ -0,0 +1,35 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:12
+
+from django.db import migrations
+
+# The expression PostgresBackend searches, as Django writes it, so the planner
+# uses the index for it. The text search config is given, as to_tsvector
+# without one cannot be indexed.
+SEARCH_VECTOR = (
+    "(setweight(to_tsvector('english'::regconfig, COALESCE(title, '')), 'A') || "
+    "setweight(to_tsvector('english'::regconfig, COALESCE(content, '')), 'B'))"
+)
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Creates the GIN index used for search on PostgreSQL.
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS blog_post_search ON blog_post USING gin (%s)' % SEARCH_VECTOR)
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS blog_post_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_task_heartbeat'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,19 +1,84 @@
 from django.db import models
+from django.utils import timezone
+
+from . import rendering
 
 
 class Category(models.Model):
-    name = models.CharField(max_length=200)
+    name = models.CharField(max_length=200, unique=True)
     slug = models.SlugField(max_length=50)
+    modified_at = models.DateTimeField(auto_now=True)
+    post_count = models.PositiveIntegerField(default=0, editable=False)
+    # Kept up to date by services.refresh_category_summaries.
+    latest_post_date = models.DateTimeField(null=True, blank=True, editable=False)
+    top_authors = models.CharField(max_length=255, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-post_count', 'id'], name='category_popularity_idx'),
+            models.Index(fields=['modified_at'], name='category_modified_at_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Names are stored upper cased, so the unique index is case insensitive.
+        """
+        self.name = self.name.strip().upper()
+        super().save(*args, **kwargs)
+
+    def top_authors_list(self):
+        return self.top_authors.split(',') if self.top_authors else []
 
     def __str__(self):
         return self.name
 
+class PostQuerySet(models.QuerySet):
+    def with_related(self):
+        """
+        Loads the author and categories alongside the posts, so listing them costs
+        a fixed number of queries however many rows there are.
+        """
+        return self.select_related('create_by').prefetch_related('categories')
+
+class ListedPostManager(models.Manager.from_queryset(PostQuerySet)):
+    """
+    Manager for pages that display posts with their author and categories.
+    """
+    def get_queryset(self):
+        return super().get_queryset().with_related()
+
 class Post(models.Model):
     title = models.CharField(max_length=200)
     content = models.TextField()
     create_date = models.DateTimeField('Date created')
     create_by = models.ForeignKey('auth.User', related_name='posts', on_delete=models.CASCADE)
     categories = models.ManyToManyField(Category)
+    content_hash = models.CharField(max_length=40, blank=True, editable=False)
+    rendered_content = models.TextField(blank=True, editable=False)
+    modified_at = models.DateTimeField(auto_now=True)
+
+    objects = PostQuerySet.as_manager()
+    listed = ListedPostManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['create_date', 'id'], name='post_create_date_idx'),
+            models.Index(fields=['create_by', 'create_date', 'id'], name='post_author_date_idx'),
+            models.Index(fields=['modified_at'], name='post_modified_at_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Re-renders the body when the content changed, so the post page never has to.
+        """
+        changed = 'content' not in self.get_deferred_fields() and rendering.refresh_rendered_content(self)
+        super().save(*args, **kwargs)
+        if changed:
+            rendering.cache_rendered_content(self)
+
+    @property
+    def body(self):
+        return rendering.rendered_body(self)
 
     def categories_as_string(self):
         cats_string = ""
@@ -24,3 +89,54 @@ class Post(models.Model):
 
     def __str__(self):
         return self.title
+
+class SearchTerm(models.Model):
+    """
+    One entry of the inverted search index: how often a term appears in a post.
+    """
+    term = models.CharField(max_length=64)
+    post = models.ForeignKey(Post, related_name='search_terms', on_delete=models.CASCADE)
+    title_frequency = models.PositiveIntegerField(default=0)
+    content_frequency = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('term', 'post')
+
+    def __str__(self):
+        return self.term
+
+class Task(models.Model):
+    """
+    A queued call of one of the functions in blog.tasks, run by manage.py
+    run_worker. Pending tasks sharing a key are all covered by a run of the
+    newest of them.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict)
+    key = models.CharField(max_length=100, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # The worker running the task, and when it last said it still was.
+    worker = models.CharField(max_length=100, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    run_seconds = models.FloatField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after', 'id'], name='task_queue_idx'),
+            models.Index(fields=['key', 'status'], name='task_key_idx'),
+        ]
+
+    def __str__(self):
+        return '%s #%d' % (self.name, self.pk)
@@ -0,0 +1,71 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .caching import cached_page
+
+# The threads async views run their database work on. Each keeps its own
+# connection, so there are never more than ASYNC_DB_THREADS of those either.
+_lock = threading.Lock()
+_pool = {'executor': None}
+
+
+def threads():
+    return getattr(settings, 'ASYNC_DB_THREADS', 20)
+
+def executor():
+    with _lock:
+        if _pool['executor'] is None:
+            _pool['executor'] = ThreadPoolExecutor(threads(), thread_name_prefix='blog-db')
+        return _pool['executor']
+
+def shutdown():
+    """
+    Stops the threads once their work is done; the next call starts new ones.
+    """
+    with _lock:
+        pool, _pool['executor'] = _pool['executor'], None
+    if pool is not None:
+        pool.shutdown()
+
+def call(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # Requests only clean up the connections of the thread they ran on.
+        close_old_connections()
+
+async def run(func, *args, **kwargs):
+    """
+    Runs func on one of the database threads and waits for it without holding
+    up the event loop. When all threads are busy it waits for one to be free.
+    """
+    return await sync_to_async(call, thread_sensitive=False, executor=executor())(func, args, kwargs)
+
+def render(view, request, *args, **kwargs):
+    response = view(request, *args, **kwargs)
+    if callable(getattr(response, 'render', None)):
+        # Templates can read from the database as they render.
+        response = response.render()
+    return response
+
+def offloaded(view, page_cache=False):
+    """
+    Makes an async view of a sync one, which runs it and renders its response
+    on the database threads. With page_cache, GETs from clients without a
+    session are first looked up in the page cache of ConditionalPageMixin and,
+    when found, answered without taking a thread.
+    """
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        if (page_cache and request.method in ('GET', 'HEAD')
+                and settings.SESSION_COOKIE_NAME not in request.COOKIES):
+            response = cached_page(request)
+            if response is not None:
+                return response
+        return await run(render, view, request, *args, **kwargs)
+    return async_view
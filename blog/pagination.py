@@ -0,0 +1,209 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+POST_ORDERING = ('-create_date', '-id')
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPage:
+    """
+    One page of a keyset paginated queryset, with the cursors for its neighbours.
+    """
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Seek pagination: each page is found with a WHERE on the ordering columns of the
+    row it starts after, rather than an OFFSET, so a deep page costs the same as
+    the first one. The ordering has to end in a unique column.
+    """
+
+    def __init__(self, queryset, per_page, ordering=POST_ORDERING):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = ordering
+        self.fields = [name.lstrip('-') for name in ordering]
+
+    def encode_cursor(self, obj, reverse=False):
+        """
+        obj is a model instance or, for a .values() queryset, a dict.
+        """
+        values = [
+            cursor_value(obj, queryset_field(self.queryset, name))
+            for name in self.fields
+        ]
+        data = json.dumps({'v': values, 'r': reverse}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            values = [
+                queryset_field(self.queryset, name).to_python(value)
+                for name, value in zip(self.fields, data['v'])
+            ]
+        except (TypeError, ValueError, KeyError, UnicodeError, binascii.Error, ValidationError):
+            raise InvalidCursor(cursor)
+        if len(values) != len(self.fields):
+            raise InvalidCursor(cursor)
+        return values, bool(data.get('r'))
+
+    def seek(self, values, reverse):
+        """
+        Returns the filter for the rows that come after the given ordering values,
+        or before them when reverse is set.
+        """
+        condition = Q()
+        for position, name in enumerate(self.ordering):
+            descending = name.startswith('-')
+            lookup = 'lt' if descending != reverse else 'gt'
+            step = Q(**{'%s__%s' % (self.fields[position], lookup): values[position]})
+            for earlier in range(position):
+                step &= Q(**{self.fields[earlier]: values[earlier]})
+            condition |= step
+        return condition
+
+    def page(self, cursor=None):
+        reverse = False
+        queryset = self.queryset
+        if cursor:
+            values, reverse = self.decode_cursor(cursor)
+            queryset = queryset.filter(self.seek(values, reverse))
+        if reverse:
+            queryset = queryset.order_by(*[flip(name) for name in self.ordering])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+        if not rows:
+            return KeysetPage(rows, None, None)
+        if reverse:
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, bool(cursor)
+        return KeysetPage(
+            rows,
+            self.encode_cursor(rows[-1]) if has_next else None,
+            self.encode_cursor(rows[0], reverse=True) if has_previous else None,
+        )
+
+
+def flip(name):
+    return name[1:] if name.startswith('-') else '-' + name
+
+def queryset_field(queryset, name):
+    return queryset.model._meta.get_field(name)
+
+def cursor_value(obj, field):
+    if not isinstance(obj, dict):
+        return field.value_to_string(obj)
+    value = obj[field.attname]
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+class KeysetPaginationMixin:
+    """
+    Pages a ListView with KeysetPaginator. The page is picked with the 'cursor'
+    query parameter and page_obj carries links to the pages either side.
+    """
+    paginate_by = 10
+    keyset_ordering = POST_ORDERING
+    cursor_query_param = 'cursor'
+
+    def get_keyset_ordering(self):
+        return self.keyset_ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, page_size, self.get_keyset_ordering())
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_query_param))
+        except InvalidCursor:
+            raise Http404('Invalid cursor.')
+        url = self.request.get_full_path()
+        page.next_url = self.cursor_url(url, page.next_cursor)
+        page.previous_url = self.cursor_url(url, page.previous_cursor)
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    def cursor_url(self, url, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    API pagination over (create_date, id) with opaque next and previous cursors.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = POST_ORDERING
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        paginator = KeysetPaginator(queryset, self.get_page_size(request), self.ordering)
+        try:
+            self.page = paginator.page(request.query_params.get(self.cursor_query_param))
+        except InvalidCursor:
+            raise NotFound('Invalid cursor.')
+        return list(self.page.object_list)
+
+    def get_page_size(self, request):
+        """
+        Clients can ask for up to max_page_size posts a page with ?page_size=.
+        """
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_link(self.page.next_cursor),
+            'previous': self.get_link(self.page.previous_cursor),
+            'results': data,
+        })
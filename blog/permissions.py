@@ -9,4 +9,4 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
         
-        return obj.create_by == request.user
\ No newline at end of file
+        return obj.create_by_id == request.user.pk
\ No newline at end of file
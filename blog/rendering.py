@@ -0,0 +1,52 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .sanitizer import sanitize_html
+
+
+def content_hash(content):
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+def render_content(content):
+    """
+    Turns stored post content into the html shown on the post page.
+    """
+    return sanitize_html(content)
+
+def cache_key(post_id, digest):
+    return 'post-body:%s:%s' % (post_id, digest)
+
+def refresh_rendered_content(post):
+    """
+    Re-renders the post body when its content has changed since it was last
+    rendered. Returns whether it did.
+    """
+    digest = content_hash(post.content)
+    if digest == post.content_hash and post.rendered_content:
+        return False
+    post.content_hash = digest
+    post.rendered_content = render_content(post.content)
+    return True
+
+def cache_rendered_content(post):
+    cache.set(cache_key(post.pk, post.content_hash), post.rendered_content,
+              getattr(settings, 'RENDERED_CONTENT_CACHE_TIMEOUT', None))
+
+def rendered_body(post):
+    """
+    Returns the rendered body of a post, from the cache when it is there. Views
+    can defer the content and rendered_content columns, which are then only
+    loaded on a cache miss.
+    """
+    body = cache.get(cache_key(post.pk, post.content_hash))
+    if body is None:
+        if not post.rendered_content:
+            # Rows saved before bodies were pre-rendered.
+            refresh_rendered_content(post)
+            type(post).objects.filter(pk=post.pk).update(
+                content_hash=post.content_hash, rendered_content=post.rendered_content)
+        body = post.rendered_content
+        cache_rendered_content(post)
+    return body
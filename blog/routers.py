@@ -0,0 +1,89 @@
+import random
+import time
+
+from asgiref.local import Local
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+# Routing state for the request being handled on this thread, set by
+# ReplicaRoutingMiddleware. Outside of requests everything uses the primary.
+# An asgiref Local rather than a thread local, so it follows the request onto
+# the database threads of the async views (see blog.offload).
+_state = Local()
+
+# Replica alias -> time until which it is not used, after it failed.
+_unavailable = {}
+
+
+def start_request(use_replicas):
+    _state.use_replicas = use_replicas
+    _state.replica = None
+    _state.wrote = False
+
+def end_request():
+    wrote = getattr(_state, 'wrote', False)
+    start_request(False)
+    return wrote
+
+def current_replica():
+    return getattr(_state, 'replica', None)
+
+def mark_unavailable(alias):
+    """
+    Takes a replica out of rotation for REPLICA_RETRY_SECONDS and stops the
+    current request from reading from replicas.
+    """
+    _unavailable[alias] = time.monotonic() + getattr(settings, 'REPLICA_RETRY_SECONDS', 30)
+    connections[alias].close()
+    _state.use_replicas = False
+    _state.replica = None
+
+def available(alias):
+    if _unavailable.get(alias, 0) > time.monotonic():
+        return False
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError:
+        mark_unavailable(alias)
+        return False
+    return True
+
+def choose_replica():
+    """
+    Picks one of the replicas that is up, or None when none are.
+    """
+    replicas = list(getattr(settings, 'REPLICA_DATABASES', []))
+    random.shuffle(replicas)
+    for alias in replicas:
+        if available(alias):
+            return alias
+    return None
+
+
+class ReplicaRouter:
+    """
+    Sends reads to a replica while a GET or HEAD request is being handled, and
+    everything else to the primary. A request sticks to the replica it first
+    picked, and once it writes, its remaining reads go to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not getattr(_state, 'use_replicas', False):
+            return None
+        if _state.replica is None:
+            _state.replica = choose_replica()
+            if _state.replica is None:
+                _state.use_replicas = False
+        return _state.replica
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        _state.use_replicas = False
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in getattr(settings, 'REPLICA_DATABASES', [])
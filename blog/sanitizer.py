@@ -0,0 +1,104 @@
+import hashlib
+from html import escape
+from html.parser import HTMLParser
+
+from django.conf import settings
+from django.core.cache import cache
+
+VALID_TAGS = ['strong','em','p','ul','li','br','b','h1','h2','h3','h4','h5','h6','ol','i','a','dl','s','hr','sup','sub']
+
+# Elements that never have content or an end tag.
+VOID_TAGS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+    'param', 'source', 'track', 'wbr',
+}
+
+CACHE_KEY_VERSION = hashlib.sha1(','.join(sorted(VALID_TAGS)).encode('utf-8')).hexdigest()[:8]
+
+
+class AllowListSanitizer(HTMLParser):
+    """
+    Single pass sanitizer. Tags in VALID_TAGS are written out as they are read;
+    any other tag is dropped along with everything inside it. Comments, doctypes
+    and processing instructions are dropped, text is re-escaped and elements left
+    open are closed at the end.
+    """
+
+    def __init__(self, valid_tags=VALID_TAGS):
+        super().__init__(convert_charrefs=True)
+        self.valid_tags = frozenset(valid_tags)
+        self.output = []
+        self.open_tags = []
+        self.suppressed = 0
+
+    def handle_starttag(self, tag, attrs):
+        allowed = tag in self.valid_tags
+        if tag in VOID_TAGS:
+            if allowed and not self.suppressed:
+                self.output.append('<%s%s/>' % (tag, format_attrs(attrs)))
+            return
+        if allowed and not self.suppressed:
+            self.output.append('<%s%s>' % (tag, format_attrs(attrs)))
+        elif not allowed:
+            self.suppressed += 1
+        self.open_tags.append((tag, allowed))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        for position in range(len(self.open_tags) - 1, -1, -1):
+            if self.open_tags[position][0] == tag:
+                break
+        else:
+            # An end tag with nothing to close is ignored.
+            return
+        while len(self.open_tags) > position:
+            self.close_tag()
+
+    def close_tag(self):
+        tag, allowed = self.open_tags.pop()
+        if not allowed:
+            self.suppressed -= 1
+        elif not self.suppressed:
+            self.output.append('</%s>' % tag)
+
+    def handle_data(self, data):
+        if not self.suppressed:
+            self.output.append(escape(data, quote=False))
+
+    def close(self):
+        super().close()
+        while self.open_tags:
+            self.close_tag()
+        return ''.join(self.output)
+
+
+def format_attrs(attrs):
+    return ''.join(
+        ' %s="%s"' % (name, escape(value or '', quote=True)) for name, value in attrs
+    )
+
+def clean_html(value):
+    """
+    Sanitizes the value without going through the cache.
+    """
+    parser = AllowListSanitizer()
+    parser.feed(value)
+    return parser.close()
+
+def sanitize_html(value):
+    """
+    Removes 'dangerous' html and only allows content within tags that are
+    pre-approved above in variable VALID_TAGS. Results are cached by a hash of the
+    content, so saving a post again without changing it skips the parsing.
+    """
+    digest = hashlib.sha1(value.encode('utf-8')).hexdigest()
+    key = 'sanitized:%s:%s' % (CACHE_KEY_VERSION, digest)
+    cleaned = cache.get(key)
+    if cleaned is None:
+        cleaned = clean_html(value)
+        cache.set(key, cleaned, getattr(settings, 'SANITIZER_CACHE_TIMEOUT', 24 * 60 * 60))
+    return cleaned
@@ -0,0 +1,260 @@
+import html
+import math
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, Count, F, FloatField, Sum, Value, When
+from django.utils.module_loading import import_string
+
+from .models import Post, SearchTerm
+
+TAG_RE = re.compile(r'<[^>]+>')
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+MAX_TERM_LENGTH = 64
+TITLE_WEIGHT = 3
+FTS_TABLE = 'blog_post_fts'
+# Must match the GIN index of the search vector migration.
+POSTGRES_CONFIG = 'english'
+
+
+def strip_tags(value):
+    """
+    Returns the plain text of a post body, with tags removed and entities decoded.
+    """
+    return html.unescape(TAG_RE.sub(' ', value or ''))
+
+def tokenize(value):
+    """
+    Splits text into lower cased search terms.
+    """
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(strip_tags(value).lower())]
+
+
+class InvertedIndexBackend:
+    """
+    Portable search backend. Keeps a term -> post posting list with title and
+    content frequencies in the SearchTerm table, which works on any database.
+    """
+
+    def index(self, post):
+        self.index_many([post])
+
+    def index_many(self, posts):
+        SearchTerm.objects.filter(post_id__in=[post.pk for post in posts]).delete()
+        SearchTerm.objects.bulk_create([
+            term for post in posts for term in self.postings(post)
+        ])
+
+    def postings(self, post):
+        title_terms = Counter(tokenize(post.title))
+        content_terms = Counter(tokenize(post.content))
+        return [
+            SearchTerm(
+                term=term,
+                post_id=post.pk,
+                title_frequency=title_terms.get(term, 0),
+                content_frequency=content_terms.get(term, 0),
+            )
+            for term in set(title_terms) | set(content_terms)
+        ]
+
+    def remove(self, post_id):
+        self.remove_many([post_id])
+
+    def remove_many(self, post_ids):
+        SearchTerm.objects.filter(post_id__in=post_ids).delete()
+
+    def clear(self):
+        SearchTerm.objects.all().delete()
+
+    def search(self, query, limit):
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        total = Post.objects.count() or 1
+        frequencies = dict(
+            SearchTerm.objects.filter(term__in=terms)
+            .values_list('term')
+            .annotate(documents=Count('post'))
+        )
+        if len(frequencies) < len(terms):
+            # Every term has to match, so a term nobody uses means no results.
+            return []
+        score = Sum(Case(
+            *[When(term=term, then=(F('title_frequency') * TITLE_WEIGHT + F('content_frequency'))
+                   * Value(math.log(1 + total / documents)))
+              for term, documents in frequencies.items()],
+            output_field=FloatField(),
+        ))
+        results = (
+            SearchTerm.objects.filter(term__in=terms)
+            .values('post')
+            .annotate(matched=Count('term'), score=score)
+            .filter(matched=len(terms))
+            .order_by('-score', '-post')
+        )
+        return [row['post'] for row in results[:limit]]
+
+
+class SQLiteFTSBackend:
+    """
+    Uses the FTS5 virtual table created by the search migration, ranked with bm25.
+    """
+
+    def index(self, post):
+        self.index_many([post])
+
+    def index_many(self, posts):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT OR REPLACE INTO %s (rowid, title, content) VALUES (%%s, %%s, %%s)' % FTS_TABLE,
+                [(post.pk, strip_tags(post.title), strip_tags(post.content)) for post in posts],
+            )
+
+    def remove(self, post_id):
+        self.remove_many([post_id])
+
+    def remove_many(self, post_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE,
+                               [(post_id,) for post_id in post_ids])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % FTS_TABLE)
+
+    def search(self, query, limit):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        match = ' '.join('"%s"' % term for term in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid FROM {table} WHERE {table} MATCH %s '
+                'ORDER BY bm25({table}, {weight}, 1.0), rowid DESC LIMIT %s'.format(
+                    table=FTS_TABLE, weight=float(TITLE_WEIGHT)),
+                [match, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresBackend:
+    """
+    Ranks posts with a tsvector built from the title and content columns, so
+    there is nothing to keep in sync. The search vector migration puts a GIN
+    index on the same expression, so only the matching posts are read.
+    """
+
+    def index(self, post):
+        pass
+
+    def index_many(self, posts):
+        pass
+
+    def remove(self, post_id):
+        pass
+
+    def remove_many(self, post_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def search(self, query, limit):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+        if not tokenize(query):
+            return []
+        vector = (SearchVector('title', config=POSTGRES_CONFIG, weight='A')
+                  + SearchVector('content', config=POSTGRES_CONFIG, weight='B'))
+        search_query = SearchQuery(query, config=POSTGRES_CONFIG)
+        results = (
+            Post.objects.annotate(document=vector, rank=SearchRank(vector, search_query))
+            .filter(document=search_query)
+            .order_by('-rank', '-id')
+            .values_list('id', flat=True)
+        )
+        return list(results[:limit])
+
+
+def fts5_table_exists():
+    if connection.vendor != 'sqlite':
+        return False
+    return FTS_TABLE in connection.introspection.table_names()
+
+def get_backend():
+    """
+    Returns the configured search backend. With SEARCH_BACKEND left as 'auto' the
+    database's own full text search is used where there is one.
+    """
+    backend = getattr(settings, 'SEARCH_BACKEND', 'auto')
+    if backend != 'auto':
+        return import_string(backend)()
+    if connection.vendor == 'postgresql':
+        return PostgresBackend()
+    if fts5_table_exists():
+        return SQLiteFTSBackend()
+    return InvertedIndexBackend()
+
+def index_post(post):
+    get_backend().index(post)
+
+def index_posts(posts):
+    if posts:
+        get_backend().index_many(posts)
+
+def remove_post(post_id):
+    get_backend().remove(post_id)
+
+def remove_posts(post_ids):
+    if post_ids:
+        get_backend().remove_many(post_ids)
+
+def rebuild_index(batch_size=500):
+    """
+    Clears the index and re-adds every post. Returns the number of posts indexed.
+    """
+    backend = get_backend()
+    backend.clear()
+    count = 0
+    batch = []
+    for post in Post.objects.only('id', 'title', 'content').iterator(chunk_size=batch_size):
+        batch.append(post)
+        if len(batch) == batch_size:
+            backend.index_many(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        backend.index_many(batch)
+    return count + len(batch)
+
+def search(query):
+    """
+    Returns the ids of posts matching every word in the query, best match first.
+    """
+    return get_backend().search(query, getattr(settings, 'SEARCH_MAX_RESULTS', 1000))
+
+
+class SearchResults:
+    """
+    A ranked list of post ids that only loads the posts for the slice asked for,
+    so it can be handed straight to a Paginator.
+    """
+
+    def __init__(self, post_ids):
+        self.post_ids = post_ids
+
+    def __len__(self):
+        return len(self.post_ids)
+
+    def count(self):
+        return len(self.post_ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            ids = self.post_ids[index]
+            posts = Post.listed.in_bulk(ids)
+            return [posts[post_id] for post_id in ids if post_id in posts]
+        return Post.listed.get(pk=self.post_ids[index])
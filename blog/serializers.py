@@ -1,28 +1,119 @@
 
 from rest_framework import serializers
+from rest_framework.reverse import reverse
+from rest_framework.utils.urls import replace_query_param
 from django.contrib.auth.models import User
+from django.db.models import F
+from .export import with_categories
 from .models import Post, Category
+from .services import normalize_categories, normalize_category_names, save_post
 
+FIELDS_QUERY_PARAM = 'fields'
 
-class UserSerializer(serializers.HyperlinkedModelSerializer):
-    posts = serializers.HyperlinkedRelatedField(many=True, view_name='blog:post-detail',read_only=True)
+# The .values() column behind each PostSerializer field read by post_rows.
+POST_COLUMNS = {
+    'id': 'id',
+    'title': 'title',
+    'content': 'content',
+    'create_date': 'create_date',
+    'create_by': 'author',
+}
+
+
+def requested_fields(request):
+    """
+    Returns the set of field names a GET request asked for with ?fields=, or
+    None when it wants them all.
+    """
+    if request is None or request.method not in ('GET', 'HEAD'):
+        return None
+    value = request.query_params.get(FIELDS_QUERY_PARAM)
+    if not value:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class SparseFieldsetMixin:
+    """
+    Leaves out the fields a GET request did not ask for with ?fields=.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        wanted = requested_fields(self.context.get('request'))
+        if wanted is None:
+            return
+        readable = {name for name, field in self.fields.items() if not field.write_only}
+        unknown = wanted - readable
+        if unknown:
+            raise serializers.ValidationError(
+                {FIELDS_QUERY_PARAM: "Unknown fields: %s." % ', '.join(sorted(unknown))})
+        for name in readable - wanted:
+            self.fields.pop(name)
+
+
+class UserSerializer(SparseFieldsetMixin, serializers.HyperlinkedModelSerializer):
+    """
+    A user with the number of posts they wrote and a link to the paginated list
+    of those posts, rather than every post inline.
+    """
+    post_count = serializers.IntegerField(read_only=True)
+    posts_url = serializers.SerializerMethodField()
 
     class Meta:
         model = User
-        fields = ('id', 'username', 'posts')
+        fields = ('id', 'username', 'post_count', 'posts_url')
+
+    def get_posts_url(self, user):
+        url = reverse('blog:post-list', request=self.context.get('request'))
+        return replace_query_param(url, 'author', user.username)
+
+class CategoryNamesField(serializers.ListField):
+    """
+    A post's categories as a list of names, which are normalized on the way in.
+    """
+    child = serializers.CharField(max_length=200)
+
+    def to_representation(self, value):
+        return sorted(category.name for category in value.all())
 
-class PostSerializer(serializers.HyperlinkedModelSerializer):
+    def to_internal_value(self, data):
+        names = normalize_category_names(super().to_internal_value(data))
+        if not names:
+            raise serializers.ValidationError("Categories cannot be empty, please add at least 1.")
+        return names
+
+class PostSerializer(SparseFieldsetMixin, serializers.HyperlinkedModelSerializer):
     create_by = serializers.ReadOnlyField(source='create_by.username')
+    categories = CategoryNamesField(required=False)
+    category_csv = serializers.CharField(write_only=True, required=False)
 
     class Meta:
         model = Post
-        fields = ('title', 'content', 'create_date', 'create_by')
+        fields = ('id', 'title', 'content', 'create_date', 'create_by', 'categories', 'category_csv')
+
+    def validate_category_csv(self, value):
+        categories = normalize_categories(value)
+        if not categories:
+            raise serializers.ValidationError("Categories cannot be empty, please add at least 1.")
+        return categories
+
+    @staticmethod
+    def pop_categories(validated_data):
+        """
+        Removes the category names from the validated data, whichever of the two
+        fields they came in. Returns None when neither was given.
+        """
+        categories = validated_data.pop('categories', None)
+        category_csv = validated_data.pop('category_csv', None)
+        return categories if categories is not None else category_csv
 
     def create(self, validated_data):
         """
         Create and return a new Post instance, given the validated data.
         """
-        return Post.objects.create(**validated_data)
+        categories = self.pop_categories(validated_data)
+        return save_post(Post(**validated_data), categories or None)
 
     def update(self, instance, validated_data):
         """
@@ -30,5 +121,41 @@ class PostSerializer(serializers.HyperlinkedModelSerializer):
         """
         instance.title = validated_data.get('title', instance.title)
         instance.content = validated_data.get('content', instance.content)
-        instance.save()
-        return instance
\ No newline at end of file
+        instance.create_date = validated_data.get('create_date', instance.create_date)
+        return save_post(instance, self.pop_categories(validated_data))
+
+class PostSummarySerializer(PostSerializer):
+    """
+    A post without its content, for listings.
+    """
+
+    class Meta(PostSerializer.Meta):
+        fields = ('id', 'title', 'create_date', 'create_by', 'categories')
+
+
+def post_rows(queryset, fields):
+    """
+    The queryset as .values() rows with the columns the given PostSerializer
+    fields need, and the id and create_date the cursor pagination needs.
+    """
+    columns = ['id', 'create_date'] + [
+        POST_COLUMNS[name] for name in fields if name in POST_COLUMNS and name not in ('id', 'create_date')
+    ]
+    expressions = {'author': F('create_by__username')} if 'author' in columns else {}
+    return queryset.values(*[column for column in columns if column not in expressions], **expressions)
+
+def serialize_post_rows(rows, fields):
+    """
+    Builds the data PostSerializer gives for the given fields from post_rows
+    rows, without a model or serializer instance per post. The category names
+    of every row are read with one query.
+    """
+    if 'categories' in fields:
+        rows = with_categories(rows)
+    date = serializers.DateTimeField().to_representation
+    convert = {'create_date': date}
+    columns = [(name, POST_COLUMNS.get(name, name), convert.get(name)) for name in fields]
+    return [
+        {name: convert(row[column]) if convert else row[column] for name, column, convert in columns}
+        for row in rows
+    ]
@@ -0,0 +1,170 @@
+from django.db import transaction
+from django.db.models import Count, Max, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import autocomplete, signals, tasks
+from .sanitizer import sanitize_html
+from .models import Category, Post
+
+TOP_AUTHORS = 3
+
+
+def normalize_categories(category_csv):
+    """
+    Turns the user entered, comma separated categories into the distinct names
+    they are stored under, keeping the order they were entered in.
+    """
+    return normalize_category_names(category_csv.split(','))
+
+def normalize_category_names(values):
+    names = []
+    for name in values:
+        name = name.strip().upper()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+def resolve_categories(names):
+    """
+    Returns the categories for the given normalized names, creating the missing
+    ones. Costs one query when they all exist and three when some do not.
+
+    The rows are locked until the transaction ends, so the worker cannot purge
+    a category that is about to get a post; if it just did, the category is
+    created again.
+    """
+    locked = Category.objects.select_for_update().order_by('pk')
+    existing = {category.name: category for category in locked.filter(name__in=names)}
+    missing = [name for name in names if name not in existing]
+    if missing:
+        # Another request may create the same category between the two queries,
+        # so conflicts are ignored and the rows read back afterwards.
+        Category.objects.bulk_create(
+            [Category(name=name, slug=name.replace(" ", "-")) for name in missing],
+            ignore_conflicts=True,
+        )
+        for category in locked.filter(name__in=missing):
+            existing.setdefault(category.name, category)
+    return [existing[name] for name in names]
+
+def link_categories(post_categories, replace=False):
+    """
+    Takes a dict of post id to normalized category names and links every post
+    to its categories, creating the missing ones, in a handful of queries for
+    the whole batch. With replace set, other categories are unlinked from those
+    posts. Returns the ids of the categories whose counts changed.
+    """
+    if not post_categories:
+        return set()
+    names = list(dict.fromkeys(name for names in post_categories.values() for name in names))
+    category_ids = {category.name: category.pk for category in resolve_categories(names)}
+    wanted = {
+        (post_id, category_ids[name])
+        for post_id, names in post_categories.items() for name in names
+    }
+    through = Post.categories.through
+    existing = {
+        (post_id, category_id): link_id
+        for link_id, post_id, category_id in through.objects.filter(
+            post_id__in=list(post_categories)).values_list('id', 'post_id', 'category_id')
+    }
+    added = wanted - set(existing)
+    removed = set(existing) - wanted if replace else set()
+    if removed:
+        through.objects.filter(id__in=[existing[link] for link in removed]).delete()
+    through.objects.bulk_create(
+        [through(post_id=post_id, category_id=category_id) for post_id, category_id in added]
+    )
+    return {category_id for _, category_id in added | removed}
+
+@transaction.atomic
+def save_post(post, categories=None):
+    """
+    Creates or updates a post, with its content sanitized, and when categories
+    is given makes the post's categories exactly those normalized names. Only
+    the links that change are written, so the whole save takes the same few
+    queries however many categories the post has. Everything else that follows
+    from the write is queued for the worker.
+    """
+    created = post.pk is None
+    post.content = sanitize_html(post.content)
+    with signals.muted():
+        post.save()
+    touched = set()
+    if categories is not None:
+        # Written through the link table, so no m2m_changed receivers run.
+        touched = link_categories({post.pk: categories}, replace=not created)
+    tasks.posts_changed([post.pk], touched)
+    return post
+
+def refresh_category_summaries(category_ids):
+    """
+    Recomputes the post count, latest post date and top authors of the given
+    categories. Counts and dates are set by a single UPDATE, so they cannot
+    drift whatever order concurrent writes land in; the top authors take one
+    grouped query and a bulk update. Categories with scheduled posts are
+    refreshed again when the next of them is published.
+    """
+    if not category_ids:
+        return
+    category_ids = list(category_ids)
+    now = timezone.now()
+    links = Post.categories.through.objects.filter(category_id=OuterRef('pk')).values('category_id')
+    counts = links.annotate(count=Count('*')).values('count')
+    latest = links.filter(post__create_date__lte=now).annotate(latest=Max('post__create_date')).values('latest')
+    Category.objects.filter(pk__in=category_ids).update(
+        post_count=Coalesce(Subquery(counts), 0), latest_post_date=Subquery(latest), modified_at=now)
+    tasks.refresh_when_due(dict(
+        Post.categories.through.objects.filter(category_id__in=category_ids, post__create_date__gt=now)
+        .values_list('category_id').annotate(due=Min('post__create_date')).order_by()
+    ))
+
+    authors = {category_id: [] for category_id in category_ids}
+    rows = (
+        Post.categories.through.objects.filter(category_id__in=category_ids)
+        .values_list('category_id', 'post__create_by__username')
+        .annotate(count=Count('*'))
+        .order_by('category_id', '-count', 'post__create_by__username')
+    )
+    for category_id, username, _ in rows:
+        if len(authors[category_id]) < TOP_AUTHORS:
+            authors[category_id].append(username)
+    Category.objects.bulk_update(
+        [Category(pk=category_id, top_authors=','.join(names)) for category_id, names in authors.items()],
+        ['top_authors'],
+    )
+    autocomplete.update_categories(
+        Category.objects.filter(pk__in=category_ids).values_list('id', 'name', 'post_count'))
+
+def purge_orphan_categories(category_ids):
+    """
+    Deletes whichever of the given categories no longer have any posts. The rows
+    are locked before the links are read, and resolve_categories locks those it
+    links to, so a post being added to one of them concurrently is either seen
+    here or waits until the category is gone and creates it again. The stored
+    post_count is not used, as it may have been computed before that post.
+    """
+    locked = list(
+        Category.objects.select_for_update().filter(pk__in=category_ids)
+        .order_by('pk').values_list('pk', flat=True)
+    )
+    linked = set(
+        Post.categories.through.objects.filter(category_id__in=locked).values_list('category_id', flat=True)
+    )
+    orphans = [category_id for category_id in locked if category_id not in linked]
+    if orphans:
+        Category.objects.filter(pk__in=orphans).delete()
+        autocomplete.remove_categories(orphans)
+
+@transaction.atomic
+def delete_post(post):
+    """
+    Deletes a post. Its categories are swept by the worker, which deletes any
+    that were only linked to that 1 post, just as a bit of db maintenance.
+    """
+    post_id = post.pk
+    category_ids = list(post.categories.values_list('id', flat=True))
+    with signals.muted():
+        post.delete()
+    tasks.posts_changed([post_id], category_ids, deleted=True)
@@ -0,0 +1,88 @@
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import autocomplete, tasks
+from .models import Category, Post
+
+_state = threading.local()
+
+
+@contextmanager
+def muted():
+    """
+    Turns the receivers below off for the current thread, for bulk writes that
+    do the same bookkeeping once for a whole batch.
+    """
+    previous = getattr(_state, 'muted', False)
+    _state.muted = True
+    try:
+        yield
+    finally:
+        _state.muted = previous
+
+def mutable(handler):
+    @wraps(handler)
+    def wrapper(*args, **kwargs):
+        if not getattr(_state, 'muted', False):
+            handler(*args, **kwargs)
+    return wrapper
+
+
+@receiver(post_save, sender=Post)
+@mutable
+def index_saved_post(sender, instance, **kwargs):
+    """
+    Queues the search index, latest posts and cached pages updates for post
+    creates and edits.
+    """
+    tasks.posts_changed([instance.pk])
+
+@receiver(post_delete, sender=Post)
+@mutable
+def unindex_deleted_post(sender, instance, **kwargs):
+    # The links go with the post without any m2m_changed signal.
+    tasks.posts_changed([instance.pk], getattr(instance, '_deleted_categories', []), deleted=True)
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(m2m_changed, sender=Post.categories.through)
+@mutable
+def invalidate_cached_pages(sender, action='post_', **kwargs):
+    """
+    Any category write can show up on every cached page.
+    """
+    if action.startswith('post_'):
+        tasks.pages_changed()
+
+@receiver(post_save, sender=Category)
+@mutable
+def complete_saved_category(sender, instance, **kwargs):
+    autocomplete.update_categories([(instance.pk, instance.name, instance.post_count)])
+
+@receiver(post_delete, sender=Category)
+@mutable
+def uncomplete_deleted_category(sender, instance, **kwargs):
+    autocomplete.remove_categories([instance.pk])
+
+@receiver(m2m_changed, sender=Post.categories.through)
+@mutable
+def count_category_posts(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Queues the summaries of categories whose posts are linked or unlinked.
+    """
+    if action == 'pre_clear':
+        instance._cleared_categories = (
+            [instance.pk] if reverse else list(instance.categories.values_list('id', flat=True)))
+    elif action == 'post_clear':
+        tasks.categories_changed(instance._cleared_categories)
+    elif action in ('post_add', 'post_remove'):
+        tasks.categories_changed([instance.pk] if reverse else pk_set)
+
+@receiver(pre_delete, sender=Post)
+@mutable
+def remember_deleted_post_categories(sender, instance, **kwargs):
+    instance._deleted_categories = list(instance.categories.values_list('id', flat=True))
@@ -0,0 +1,303 @@
+import datetime
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Avg, Count, F, Max, Q
+from django.http import HttpRequest
+from django.urls import reverse
+from django.utils import timezone
+
+from . import autocomplete, caching, latest, search, services
+from .models import Post, Task
+
+logger = logging.getLogger('blog.tasks')
+
+# Task name -> function, filled in by @task.
+TASKS = {}
+
+# Recorded on the tasks this process runs.
+WORKER_ID = '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def max_attempts():
+    return getattr(settings, 'TASK_MAX_ATTEMPTS', 5)
+
+def timeout():
+    return getattr(settings, 'TASK_TIMEOUT', 2 * 60)
+
+def retry_delay(attempts):
+    """
+    Seconds to wait before trying again after attempts failed runs, doubling
+    every time.
+    """
+    return getattr(settings, 'TASK_RETRY_DELAY', 10) * 2 ** (attempts - 1)
+
+def task(key=''):
+    """
+    Registers a function as a task. Pending tasks with a key are all covered
+    by a run of the newest of them.
+    """
+    def register(func):
+        func.key = key
+        TASKS[func.__name__] = func
+        return func
+    return register
+
+
+@task()
+def reindex_posts(post_ids):
+    """
+    Brings the search and autocomplete indexes in line with the posts as they
+    are now, removing those that no longer exist.
+    """
+    posts = list(Post.objects.filter(pk__in=post_ids))
+    search.index_posts(posts)
+    autocomplete.update_posts(posts)
+    gone = set(post_ids) - {post.pk for post in posts}
+    if gone:
+        search.remove_posts(list(gone))
+        autocomplete.remove_posts(list(gone))
+
+@task()
+def refresh_feed(post_ids):
+    """
+    Updates the latest posts feed with the posts as they are now.
+    """
+    posts = list(Post.objects.filter(pk__in=post_ids).select_related('create_by'))
+    latest.update_posts(posts)
+    gone = set(post_ids) - {post.pk for post in posts}
+    if gone:
+        latest.remove_posts(list(gone))
+
+@task()
+def sweep_categories(category_ids, purge=False):
+    """
+    Recomputes the summaries of categories whose posts changed and, with purge,
+    deletes those left without any.
+    """
+    services.refresh_category_summaries(category_ids)
+    if purge:
+        services.purge_orphan_categories(category_ids)
+
+@task(key='invalidate-pages')
+def invalidate_pages():
+    """
+    Drops the cached pages, then reads the latest posts feed and renders the
+    home page again, so the next visitor does not have to.
+    """
+    from .views import IndexView
+
+    caching.invalidate_pages()
+    latest.load()
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = reverse('blog:index')
+    request.user = AnonymousUser()
+    IndexView.as_view()(request)
+
+
+def enqueue(calls):
+    """
+    Queues (name, kwargs) calls to be run by the worker, with one insert, in the
+    current transaction, so they are only queued if the write that needs them
+    is saved. With TASKS_EAGER they are run right away instead.
+    """
+    if getattr(settings, 'TASKS_EAGER', False):
+        for name, kwargs in calls:
+            TASKS[name](**kwargs)
+        return
+    Task.objects.bulk_create([Task(name=name, kwargs=kwargs, key=TASKS[name].key) for name, kwargs in calls])
+
+def posts_changed(post_ids, category_ids=(), deleted=False):
+    """
+    Queues the work that follows posts being created, edited or deleted:
+    category_ids are those whose links changed.
+    """
+    post_ids = list(post_ids)
+    calls = [('reindex_posts', {'post_ids': post_ids}), ('refresh_feed', {'post_ids': post_ids})]
+    if category_ids:
+        calls.append(('sweep_categories', {'category_ids': sorted(category_ids), 'purge': deleted}))
+    calls.append(('invalidate_pages', {}))
+    enqueue(calls)
+
+def categories_changed(category_ids):
+    """
+    Queues the summaries of categories whose posts were linked or unlinked.
+    """
+    if category_ids:
+        enqueue([('sweep_categories', {'category_ids': sorted(category_ids)})])
+
+def pages_changed():
+    enqueue([('invalidate_pages', {})])
+
+def refresh_when_due(due):
+    """
+    Queues a refresh of each category's summary for when its next scheduled
+    post is published; due maps category ids to that time. One already queued
+    for the same time is not queued again. Nothing is queued with TASKS_EAGER,
+    as there is no worker to run it later.
+    """
+    if not due or getattr(settings, 'TASKS_EAGER', False):
+        return
+    keys = {'category-due:%d:%s' % (pk, when.isoformat()): (pk, when) for pk, when in due.items()}
+    queued = set(Task.objects.filter(key__in=keys, status=Task.PENDING).values_list('key', flat=True))
+    Task.objects.bulk_create([
+        Task(name='sweep_categories', kwargs={'category_ids': [pk]}, key=key, run_after=when)
+        for key, (pk, when) in keys.items() if key not in queued
+    ])
+
+
+def claim():
+    """
+    Marks the oldest task that is due as running by this worker and returns
+    it, or None when none is. Claiming is a conditional update, so two workers
+    never run the same task.
+    """
+    now = timezone.now()
+    due = Task.objects.filter(status=Task.PENDING, run_after__lte=now).order_by('id')
+    for pk in due.values_list('id', flat=True)[:10]:
+        claimed = Task.objects.filter(pk=pk, status=Task.PENDING).update(
+            status=Task.RUNNING, attempts=F('attempts') + 1, started_at=now, worker=WORKER_ID,
+            heartbeat_at=now)
+        if claimed:
+            return Task.objects.get(pk=pk)
+    return None
+
+def owned(task):
+    """
+    The task's row while it is still running by the worker that claimed it.
+    """
+    return Task.objects.filter(pk=task.pk, status=Task.RUNNING, worker=task.worker)
+
+def beat(task):
+    """
+    Tells requeue_stale the task is still being worked on. Returns False once
+    it has been given up on and queued again.
+    """
+    try:
+        return bool(owned(task).update(heartbeat_at=timezone.now()))
+    except DatabaseError:
+        # Held up by the task's own writes, as on SQLite; the next beat will do.
+        return True
+
+@contextmanager
+def heartbeat(task):
+    """
+    Beats for the task from another thread, with a connection of its own, every
+    quarter of TASK_TIMEOUT while it runs.
+    """
+    stop = threading.Event()
+
+    def run():
+        try:
+            while not stop.wait(timeout() / 4) and beat(task):
+                pass
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=run, name='blog-task-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+def run_task(task):
+    """
+    Runs a claimed task in a transaction. A failed run is tried again later,
+    up to TASK_MAX_ATTEMPTS times in all. A keyed task is only run by the
+    newest pending task with its key, which covers the older ones. The result
+    is only saved while the task is still this worker's.
+    """
+    if task.key:
+        pending = Task.objects.filter(key=task.key, status=Task.PENDING)
+        if pending.filter(pk__gt=task.pk).exists():
+            # A task queued after this one covers it, and the writes that came in between.
+            task.status = Task.DONE
+            task.finished_at = timezone.now()
+            owned(task).update(status=task.status, finished_at=task.finished_at)
+            return task
+        pending.filter(pk__lt=task.pk).delete()
+    started = time.perf_counter()
+    try:
+        func = TASKS[task.name]
+        with heartbeat(task), transaction.atomic():
+            func(**task.kwargs)
+    except Exception:
+        task.last_error = traceback.format_exc()
+        if task.attempts >= max_attempts() or task.name not in TASKS:
+            task.status = Task.FAILED
+        else:
+            task.status = Task.PENDING
+            task.run_after = timezone.now() + datetime.timedelta(seconds=retry_delay(task.attempts))
+    else:
+        task.status = Task.DONE
+    task.run_seconds = time.perf_counter() - started
+    task.finished_at = timezone.now()
+    owned(task).update(status=task.status, run_after=task.run_after, finished_at=task.finished_at,
+                       run_seconds=task.run_seconds, last_error=task.last_error)
+    logger.info(json.dumps({
+        'task': task.name, 'id': task.pk, 'status': task.status, 'attempt': task.attempts,
+        'run_ms': round(task.run_seconds * 1000, 3),
+        'queued_ms': round((task.started_at - task.created_at).total_seconds() * 1000, 3),
+    }))
+    return task
+
+def run_pending(limit=None):
+    """
+    Runs due tasks until there are none left, or limit have run. Returns how
+    many ran.
+    """
+    count = 0
+    while limit is None or count < limit:
+        task = claim()
+        if task is None:
+            break
+        run_task(task)
+        count += 1
+    return count
+
+def requeue_stale():
+    """
+    Puts back tasks whose worker has not beaten for TASK_TIMEOUT, having died
+    part way, or fails them when they are out of attempts. Returns how many
+    were put back.
+    """
+    now = timezone.now()
+    stale = Task.objects.filter(status=Task.RUNNING, heartbeat_at__lt=now - datetime.timedelta(seconds=timeout()))
+    stale.filter(attempts__gte=max_attempts()).update(
+        status=Task.FAILED, finished_at=now, last_error="The worker running it stopped.")
+    return stale.update(status=Task.PENDING)
+
+def purge_done():
+    """
+    Deletes tasks that finished more than TASK_KEEP_SECONDS ago. Failed ones
+    are kept until dealt with.
+    """
+    cutoff = timezone.now() - datetime.timedelta(seconds=getattr(settings, 'TASK_KEEP_SECONDS', 24 * 60 * 60))
+    return Task.objects.filter(status=Task.DONE, finished_at__lt=cutoff).delete()[0]
+
+def stats():
+    """
+    Returns {name: counts by status and run times} for the tasks in the table.
+    """
+    rows = Task.objects.values('name').order_by('name').annotate(
+        pending=Count('id', filter=Q(status=Task.PENDING)),
+        running=Count('id', filter=Q(status=Task.RUNNING)),
+        done=Count('id', filter=Q(status=Task.DONE)),
+        failed=Count('id', filter=Q(status=Task.FAILED)),
+        retried=Count('id', filter=Q(attempts__gt=1)),
+        avg_seconds=Avg('run_seconds', filter=Q(status=Task.DONE)),
+        max_seconds=Max('run_seconds', filter=Q(status=Task.DONE)),
+    )
+    return {row.pop('name'): row for row in rows}
@@ -1,10 +1,43 @@
+import asyncio
+import csv
 import datetime
-from django.test import TestCase
-from django.urls import reverse
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock, skipUnless
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.db import OperationalError, connection
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
 from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
 
-from .models import Post, Category
+from Blog.asgi import AsyncViewsHandler
+from . import autocomplete, caching, feeds, latest, offload, routers, search, tasks, throttling
+from .middleware import ReplicaRoutingMiddleware
+from .models import Post, Category, SearchTerm, Task
 from .forms import PostForm
+from .benchmarks import (Benchmark, ConcurrencyBenchmark, CorpusGenerator, build_scenarios, compare, read_paths,
+                         slow_queries)
+from .bulk import create_posts
+from .management.commands.bench_sanitize import beautifulsoup_sanitize, make_document
+from .pagination import KeysetPaginator
+from .rendering import content_hash
+from .sanitizer import clean_html, sanitize_html
+from .serializers import PostSerializer, PostSummarySerializer
+from .services import (delete_post, link_categories, normalize_categories, purge_orphan_categories,
+                       refresh_category_summaries, save_post)
+from .views import IndexView
 
 def create_post(title, content, days, create_by, categories):
     """
@@ -16,6 +49,12 @@ def create_post(title, content, days, create_by, categories):
         post.categories.add(create_category(category))
     return post
 
+def add_categories(post, names):
+    """
+    Links the post to the categories in names as well as those it has.
+    """
+    return save_post(post, list(post.categories.values_list('name', flat=True)) + names)
+
 def create_category(name):
     """
     Creates a dummy category with test data.
@@ -24,7 +63,18 @@ def create_category(name):
     return Category.objects.create(name=name, slug=slug)
 
 
-class  PageTests(TestCase):
+@override_settings(TASKS_EAGER=True)
+class BlogTestCase(TestCase):
+    """
+    Cached pages and fragments outlive the test database, so every test starts
+    with an empty cache and no autocomplete index. Queued tasks run right away.
+    """
+    def setUp(self):
+        cache.clear()
+        autocomplete.reset()
+
+
+class  PageTests(BlogTestCase):
     def test_login_render(self):
         """Tests that the login page works.
         """
@@ -116,7 +166,7 @@ class  PageTests(TestCase):
         self.assertTemplateUsed(response, 'blogs/delete.html')
 
 
-class FormTests(TestCase):
+class FormTests(BlogTestCase):
     def test_post_form_correct_data(self):
         """Tests that the createpost form works.
         """
@@ -145,7 +195,7 @@ class FormTests(TestCase):
         form = PostForm(data=form_data)
         self.assertFalse(form.is_valid())
 
-class HtmlTests(TestCase):
+class HtmlTests(BlogTestCase):
     def test_content_html_valid_data(self):
         """Tests that valid html, using allowed tags is saved correctly.
         """
@@ -172,4 +222,1486 @@ class HtmlTests(TestCase):
         response2 = self.client.get(url2)
         self.assertTrue(response2.status_code, 200)
         self.assertContains(response2, content)
-        self.assertNotContains(response2, content_bad)
\ No newline at end of file
+        self.assertNotContains(response2, content_bad)
+
+class SearchTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='searcher', password='usertesting')
+        self.ranked = create_post("django tips", "plain text", 0, self.user, "one")
+        self.other = create_post("other", "<p>a note about django</p>", 0, self.user, "two")
+
+    def assertSearchFinds(self, query, expected):
+        url = reverse('blog:search')
+        response = self.client.get(url, {'search': query})
+        self.assertEqual(list(response.context['results']), expected)
+
+    def test_search_ranks_title_matches_first(self):
+        """Tests that a title match ranks above a content match.
+        """
+        self.assertSearchFinds('django', [self.ranked, self.other])
+
+    def test_search_requires_every_term(self):
+        """Tests that every word of the search has to match.
+        """
+        self.assertSearchFinds('django note', [self.other])
+
+    def test_search_ignores_markup(self):
+        """Tests that html tags in the content are not indexed.
+        """
+        self.assertSearchFinds('p', [])
+
+    def test_search_follows_edits_and_deletes(self):
+        """Tests that the index is updated when a post is edited or deleted.
+        """
+        self.ranked.title = "flask tips"
+        self.ranked.save()
+        self.assertSearchFinds('flask', [self.ranked])
+        self.other.delete()
+        self.assertSearchFinds('django', [])
+
+    @override_settings(SEARCH_BACKEND='blog.search.InvertedIndexBackend')
+    def test_inverted_index_backend(self):
+        """Tests the portable backend once it has been rebuilt.
+        """
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(SearchTerm.objects.filter(term='django').count(), 2)
+        self.assertSearchFinds('django', [self.ranked, self.other])
+        self.assertSearchFinds('django note', [self.other])
+        self.assertSearchFinds('missing', [])
+
+
+class QueryCountTests(BlogTestCase):
+    """
+    List pages have to cost the same number of queries however many rows they show.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='lister', password='usertesting')
+        self.category = create_category("LISTED")
+        self.rows = 0
+
+    def add_rows(self, count):
+        for i in range(count):
+            self.rows += 1
+            post = create_post("listed post %d" % self.rows, "listed content", -1, self.user,
+                               "tag%d,other%d" % (self.rows, self.rows))
+            post.categories.add(self.category)
+
+    def assertQueriesConstant(self, url, data=None):
+        """
+        Fails when the number of queries for the url grows with the number of rows.
+        """
+        self.add_rows(2)
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.client.get(url, data).status_code, 200)
+        self.add_rows(5)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(self.client.get(url, data).status_code, 200)
+        self.assertEqual(len(few), len(many), "query count grew with the number of rows:\n%s" %
+                         "\n".join(query['sql'] for query in many.captured_queries))
+
+    def test_index_queries(self):
+        # The first page comes from the latest posts feed; rebuild it every time.
+        with mock.patch.object(latest, 'load', latest.build):
+            self.assertQueriesConstant(reverse('blog:index'))
+
+    def test_profile_queries(self):
+        self.client.login(username='lister', password='usertesting')
+        self.assertQueriesConstant(reverse('blog:profile_view'))
+
+    def test_category_queries(self):
+        self.assertQueriesConstant(reverse('blog:category', args=(self.category.id,)))
+
+    def test_search_queries(self):
+        self.assertQueriesConstant(reverse('blog:search'), {'search': 'listed'})
+        self.assertQueriesConstant(reverse('blog:search'), {'search': ''})
+
+    def test_api_queries(self):
+        self.assertQueriesConstant('/blog/apiposts/')
+        self.assertQueriesConstant('/blog/apiusers/')
+
+
+class PaginationTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='pager', password='usertesting')
+        same_time = timezone.now() - datetime.timedelta(days=1)
+        self.category = create_category("PAGED")
+        self.posts = []
+        for i in range(25):
+            post = create_post("paged %d" % i, "paged content", -i, self.user, "tag%d" % i)
+            post.categories.add(self.category)
+            if i < 5:
+                # Posts sharing a create_date must still page in a stable order.
+                Post.objects.filter(pk=post.pk).update(create_date=same_time)
+            self.posts.append(post)
+        self.expected = list(Post.objects.order_by('-create_date', '-id'))
+
+    def walk(self, url):
+        """
+        Follows the next links from the first page and then the previous links
+        back, returning the posts seen each way.
+        """
+        forward, backward, pages = [], [], []
+        response = self.client.get(url)
+        while True:
+            page = response.context['page_obj']
+            forward.extend(page.object_list)
+            pages.append(list(page.object_list))
+            if not page.has_next():
+                break
+            response = self.client.get(page.next_url)
+        while page.has_previous():
+            response = self.client.get(page.previous_url)
+            page = response.context['page_obj']
+            backward.insert(0, list(page.object_list))
+        return forward, backward, pages
+
+    def test_keyset_pages_cover_every_post(self):
+        """Tests that walking the pages both ways sees every post once, in order.
+        """
+        forward, backward, pages = self.walk(reverse('blog:search'))
+        self.assertEqual(forward, self.expected)
+        self.assertEqual(backward, pages[:-1])
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+
+    def test_category_pages(self):
+        forward, backward, pages = self.walk(reverse('blog:category', args=(self.category.id,)))
+        self.assertEqual(forward, self.expected)
+
+    def test_invalid_cursor(self):
+        """Tests that a tampered cursor is a 404 rather than an error.
+        """
+        response = self.client.get(reverse('blog:index'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_api_cursor_pagination(self):
+        """Tests that the posts API pages with cursors in the same order.
+        """
+        titles = []
+        url = '/blog/apiposts/'
+        while url:
+            data = self.client.get(url).json()
+            titles.extend(post['title'] for post in data['results'])
+            url = data['next']
+        self.assertEqual(titles, [post.title for post in self.expected])
+
+
+class APIRepresentationTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='mobile', password='usertesting')
+        self.other = User.objects.create_user(username='desktop', password='usertesting')
+        for i in range(3):
+            create_post("mobile %d" % i, "<p>long content</p>", -i, self.user, "M%d" % i)
+        create_post("desktop", "<p>desktop content</p>", 0, self.other, "D")
+
+    def test_api_root_links(self):
+        """Tests that the API root links to the router's post and user lists.
+        """
+        response = self.client.get(reverse('blog:apiroot'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'users': 'http://testserver' + reverse('blog:user-list'),
+            'posts': 'http://testserver' + reverse('blog:post-list'),
+        })
+
+    def test_sparse_fieldsets(self):
+        data = self.client.get('/blog/apiposts/', {'fields': 'title,create_by'}).json()
+        self.assertEqual(data['results'][0], {'title': "desktop", 'create_by': 'desktop'})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/blog/apiposts/', {'fields': 'id,title'})
+        self.assertFalse([query for query in queries.captured_queries if '"blog_post"."content"' in query['sql']])
+        response = self.client.get('/blog/apiposts/', {'fields': 'title,secret'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_summary(self):
+        data = self.client.get('/blog/apiposts/', {'view': 'summary'}).json()
+        self.assertEqual(set(data['results'][0]), {'id', 'title', 'create_date', 'create_by', 'categories'})
+
+    def test_page_size_and_author(self):
+        data = self.client.get('/blog/apiposts/', {'author': 'mobile', 'page_size': 2}).json()
+        self.assertEqual([post['title'] for post in data['results']], ["mobile 0", "mobile 1"])
+        self.assertIn('page_size=2', data['next'])
+        data = self.client.get(data['next']).json()
+        self.assertEqual([post['title'] for post in data['results']], ["mobile 2"])
+
+    def test_list_matches_serializer(self):
+        """Tests that the .values() list path gives exactly what PostSerializer
+        gives, whichever fields are asked for.
+        """
+        add_categories(Post.objects.get(title="mobile 1"), ["ZED", "ALPHA"])
+        posts = Post.listed.order_by('-create_date', '-id')
+        for params in ({}, {'view': 'summary'}, {'fields': 'categories,title'}, {'fields': 'create_date'}):
+            request = Request(RequestFactory().get('/blog/apiposts/', params))
+            serializer = PostSummarySerializer if params.get('view') else PostSerializer
+            expected = json.loads(JSONRenderer().render(
+                serializer(posts, many=True, context={'request': request}).data).decode('utf-8'))
+            results = self.client.get('/blog/apiposts/', params).json()['results']
+            self.assertEqual([list(post.items()) for post in results],
+                             [list(post.items()) for post in expected])
+
+    def test_users_link_to_their_posts(self):
+        user = self.client.get('/blog/apiusers/%d/' % self.user.pk).json()
+        self.assertEqual(user['post_count'], 3)
+        posts = self.client.get(user['posts_url']).json()['results']
+        self.assertEqual({post['create_by'] for post in posts}, {'mobile'})
+
+
+class CategoryTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='tagger', password='usertesting')
+        self.post = create_post("tagged", "tagged content", 0, self.user, "existing")
+
+    def test_normalize_categories(self):
+        """Tests that the csv is cleaned up and de-duplicated once.
+        """
+        self.assertEqual(normalize_categories(" one, Two ,,one, ,two words"), ["ONE", "TWO", "TWO WORDS"])
+
+    def test_link_categories_queries_do_not_grow(self):
+        """Tests that linking 15 tags costs the same queries as linking 2.
+        """
+        other = create_post("other", "other content", 0, self.user, "other")
+        with CaptureQueriesContext(connection) as few:
+            link_categories({self.post.pk: ["EXISTING", "NEW"]})
+        many_names = ["EXISTING"] + ["TAG %d" % i for i in range(14)]
+        with CaptureQueriesContext(connection) as many:
+            link_categories({other.pk: many_names})
+        self.assertEqual(len(few), len(many))
+        self.assertTrue(set(many_names) <= set(other.categories.values_list('name', flat=True)))
+        self.assertEqual(Category.objects.filter(name="TAG 3").get().slug, "TAG-3")
+
+    def test_save_post_replaces_categories(self):
+        """Tests that replacing drops the categories that are no longer listed.
+        """
+        save_post(self.post, ["ONE", "TWO"])
+        self.assertEqual(sorted(self.post.categories.values_list('name', flat=True)), ["ONE", "TWO"])
+
+    def test_api_create_with_categories(self):
+        """Tests that the API shares the same category handling.
+        """
+        self.client.login(username='tagger', password='usertesting')
+        response = self.client.post('/blog/apiposts/', {
+            'title': 'api post', 'content': 'api content',
+            'create_date': timezone.now().isoformat(), 'category_csv': 'api, Api, second'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['categories'], ['API', 'SECOND'])
+        response = self.client.post('/blog/apiposts/', {
+            'title': 'api post', 'content': 'api content',
+            'create_date': timezone.now().isoformat(), 'category_csv': ' , '})
+        self.assertEqual(response.status_code, 400)
+
+    def test_create_and_edit_views_share_categories(self):
+        """Tests that the create and edit pages link the normalized categories.
+        """
+        self.client.login(username='tagger', password='usertesting')
+        response = self.client.post(reverse('blog:new_post'), {
+            'title': 'form post', 'content': 'form content', 'category_csv': 'Existing, new, NEW'})
+        self.assertEqual(response.status_code, 302)
+        post = Post.objects.get(title='form post')
+        self.assertEqual(sorted(post.categories.values_list('name', flat=True)), ['EXISTING', 'NEW'])
+        response = self.client.post(reverse('blog:edit', args=(post.id,)), {
+            'title': 'form post', 'content': 'form content', 'category_csv': 'new, third'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(sorted(post.categories.values_list('name', flat=True)), ['NEW', 'THIRD'])
+
+
+    def test_save_post_writes_only_the_delta(self):
+        """Tests that saving a post costs the same queries however many tags it
+        has, and that unchanged categories are left alone.
+        """
+        with CaptureQueriesContext(connection) as few:
+            save_post(Post(title="few", content="c", create_date=timezone.now(), create_by=self.user),
+                      ["EXISTING", "NEW"])
+        with CaptureQueriesContext(connection) as many:
+            save_post(Post(title="many", content="c", create_date=timezone.now(), create_by=self.user),
+                      ["EXISTING"] + ["TAG %d" % i for i in range(14)])
+        self.assertEqual(len(few), len(many))
+        post = Post.objects.get(title="many")
+        with CaptureQueriesContext(connection) as unchanged:
+            save_post(post, ["TAG %d" % i for i in range(14)][::-1] + ["EXISTING"])
+        link_table = Post.categories.through._meta.db_table
+        self.assertFalse([query for query in unchanged.captured_queries
+                          if '"%s"' % link_table in query['sql'] and not query['sql'].startswith('SELECT')])
+        self.assertEqual(Category.objects.get(name="EXISTING").post_count, 3)
+
+    def test_save_post_is_atomic(self):
+        post = Post(title="atomic", content="c", create_date=timezone.now(), create_by=self.user)
+        with mock.patch('blog.services.link_categories', side_effect=OperationalError):
+            with self.assertRaises(OperationalError):
+                save_post(post, ["ATOMIC"])
+        self.assertFalse(Post.objects.filter(title="atomic").exists())
+
+    def test_api_content_is_sanitized(self):
+        self.client.login(username='tagger', password='usertesting')
+        response = self.client.post('/blog/apiposts/', {
+            'title': 'api post', 'content': '<p>fine</p><script>alert(1)</script>',
+            'create_date': timezone.now().isoformat(), 'category_csv': 'api'})
+        self.assertEqual(response.json()['content'], '<p>fine</p>')
+
+
+class SanitizerTests(BlogTestCase):
+    def test_allowed_tags_kept(self):
+        content = '<h1>heading tag</h1><p>paragraph <a href="/x?a=1&amp;b=2">tag</a></p><b>bold tag</b>'
+        self.assertEqual(clean_html(content), content)
+
+    def test_banned_tags_removed_with_content(self):
+        content = '<p>keep</p><script>bad()</script><div><p>inside</p></div><p>after<img src=x></p>'
+        self.assertEqual(clean_html(content), '<p>keep</p><p>after</p>')
+
+    def test_unbalanced_markup(self):
+        """Tests that stray end tags are dropped and open tags are closed.
+        """
+        self.assertEqual(clean_html('</p><p><b>open<br>text'), '<p><b>open<br/>text</b></p>')
+        self.assertEqual(clean_html('<div>never closed <p>gone'), '')
+
+    def test_text_is_escaped(self):
+        self.assertEqual(clean_html('1 &lt; 2 & <em>caf&eacute;</em>'), '1 &lt; 2 &amp; <em>caf\xe9</em>')
+
+    def test_matches_beautifulsoup(self):
+        """Tests that the output matches the BeautifulSoup implementation it replaced.
+        """
+        for seed in range(5):
+            document = make_document(5000, seed=seed)
+            self.assertEqual(clean_html(document), beautifulsoup_sanitize(document))
+
+    def test_sanitized_html_is_left_alone(self):
+        """Tests that sanitizing is idempotent, which the importer relies on.
+        """
+        for seed in range(20):
+            cleaned = clean_html(make_document(2000, seed))
+            self.assertEqual(clean_html(cleaned), cleaned)
+
+    def test_sanitize_html_is_memoized(self):
+        """Tests that sanitizing the same content twice only parses it once.
+        """
+        content = '<p>memo</p><script>x</script>'
+        self.assertEqual(sanitize_html(content), '<p>memo</p>')
+        with mock.patch('blog.sanitizer.clean_html') as clean:
+            self.assertEqual(sanitize_html(content), '<p>memo</p>')
+        clean.assert_not_called()
+
+
+class RenderedContentTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='renderer', password='usertesting')
+        self.post = create_post("rendered", "<p>body</p><script>x()</script>", 0, self.user, "one")
+
+    def test_body_rendered_on_save(self):
+        """Tests that saving a post stores its rendered, sanitized body.
+        """
+        self.assertEqual(self.post.rendered_content, "<p>body</p>")
+        self.assertEqual(self.post.content_hash, content_hash(self.post.content))
+
+    def test_post_page_does_not_render(self):
+        """Tests that the post page is served from the pre-rendered body.
+        """
+        url = reverse('blog:detail', args=(self.post.id,))
+        with mock.patch('blog.rendering.render_content') as render:
+            response = self.client.get(url)
+        render.assert_not_called()
+        self.assertContains(response, "<p>body</p>")
+        self.assertNotContains(response, "x()")
+
+    def test_unchanged_content_is_not_rendered_again(self):
+        with mock.patch('blog.rendering.render_content') as render:
+            self.post.title = "renamed"
+            self.post.save()
+        render.assert_not_called()
+
+    def test_edit_renders_new_body(self):
+        """Tests that editing through the site and the API re-renders the body.
+        """
+        self.client.login(username='renderer', password='usertesting')
+        url = reverse('blog:detail', args=(self.post.id,))
+        self.client.get(url)
+        self.client.post(reverse('blog:edit', args=(self.post.id,)), {
+            'title': 'rendered', 'content': '<p>edited</p>', 'category_csv': 'one'})
+        self.assertContains(self.client.get(url), "<p>edited</p>")
+        self.client.patch('/blog/apiposts/%d/' % self.post.id, {'content': '<h2>api</h2><form>'},
+                          content_type='application/json')
+        response = self.client.get(url)
+        self.assertContains(response, "<h2>api</h2>")
+        self.assertNotContains(response, "<form>")
+
+    def test_rows_without_rendered_body(self):
+        """Tests that posts saved before bodies were rendered are filled in on view.
+        """
+        Post.objects.filter(pk=self.post.pk).update(content_hash='', rendered_content='')
+        response = self.client.get(reverse('blog:detail', args=(self.post.id,)))
+        self.assertContains(response, "<p>body</p>")
+        self.assertEqual(Post.objects.get(pk=self.post.pk).rendered_content, "<p>body</p>")
+
+    def test_render_posts_command(self):
+        """Tests that the command fills in the bodies of posts that were never rendered.
+        """
+        Post.objects.filter(pk=self.post.pk).update(content_hash='', rendered_content='')
+        out = StringIO()
+        call_command('render_posts', stdout=out)
+        self.assertIn("Rendered 1 posts.", out.getvalue())
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual((post.rendered_content, post.content_hash),
+                         ("<p>body</p>", content_hash(post.content)))
+        call_command('render_posts', stdout=out)
+        self.assertIn("Rendered 0 posts.", out.getvalue())
+
+
+class ConditionalGetTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='cacher', password='usertesting')
+        self.post = create_post("cached", "cached content", -1, self.user, "one")
+        self.category = self.post.categories.get()
+        self.urls = [reverse('blog:index'), reverse('blog:categories'),
+                     reverse('blog:category', args=(self.category.id,)),
+                     reverse('blog:detail', args=(self.post.id,))]
+
+    def test_validators_and_not_modified(self):
+        """Tests that pages send validators and a matching request gets a 304.
+        """
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertTrue(response.has_header('ETag'), url)
+            self.assertTrue(response.has_header('Last-Modified'), url)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304, url)
+
+    def test_anonymous_pages_cached_until_a_write(self):
+        """Tests that cached anonymous pages cost no queries and are dropped on a write.
+        """
+        url = reverse('blog:detail', args=(self.post.id,))
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.post.title = "changed title"
+        self.post.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Changed Title")
+
+    def test_deleted_post_changes_index_etag(self):
+        url = reverse('blog:index')
+        newer = create_post("newer", "newer content", 0, self.user, "two")
+        self.client.login(username='cacher', password='usertesting')
+        etag = self.client.get(url)['ETag']
+        newer.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @override_settings(PAGE_CACHE_TIMEOUT=7 * 24 * 60 * 60)
+    def test_index_cache_expires_with_future_post(self):
+        """Tests that the cached index expires when a future post is published.
+        """
+        view = IndexView()
+        self.assertEqual(view.get_page_cache_timeout(), 7 * 24 * 60 * 60)
+        create_post("future", "future content", 1, self.user, "two")
+        self.assertLessEqual(view.get_page_cache_timeout(), 24 * 60 * 60)
+
+    def test_api_not_modified(self):
+        for url in ['/blog/apiposts/', '/blog/apiposts/%d/' % self.post.id]:
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.client.login(username='cacher', password='usertesting')
+        self.client.patch('/blog/apiposts/%d/' % self.post.id, {'title': 'renamed'},
+                          content_type='application/json')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class PostCountTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='counter', password='usertesting')
+        self.first = create_post("first", "first content", 0, self.user, "A")
+        self.second = create_post("second", "second content", 0, self.user, "B")
+        add_categories(self.first, ["SHARED"])
+        add_categories(self.second, ["SHARED"])
+
+    def counts(self):
+        return dict(Category.objects.values_list('name', 'post_count'))
+
+    def test_counts_follow_links(self):
+        """Tests that adding, replacing and clearing categories keeps counts right.
+        """
+        self.assertEqual(self.counts(), {'A': 1, 'B': 1, 'SHARED': 2})
+        save_post(self.first, ["B"])
+        self.assertEqual(self.counts(), {'A': 0, 'B': 2, 'SHARED': 1})
+        self.second.categories.clear()
+        self.assertEqual(self.counts(), {'A': 0, 'B': 1, 'SHARED': 0})
+        Category.objects.get(name='A').post_set.add(self.first, self.second)
+        self.assertEqual(self.counts(), {'A': 2, 'B': 1, 'SHARED': 0})
+
+    def test_delete_purges_orphans(self):
+        """Tests that deleting a post removes only the categories left empty.
+        """
+        self.client.login(username='counter', password='usertesting')
+        response = self.client.post(reverse('blog:delete', args=(self.first.id,)))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.counts(), {'B': 1, 'SHARED': 1})
+        response = self.client.delete('/blog/apiposts/%d/' % self.second.id)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.counts(), {})
+
+    def test_purge_spares_categories_linked_after_refresh(self):
+        """Tests that a post linked between the refresh and the purge keeps its category.
+        """
+        category = create_category("LATE")
+        refresh_category_summaries([category.pk])
+        link_categories({self.first.pk: ["LATE"]})
+        purge_orphan_categories([category.pk])
+        self.assertTrue(self.first.categories.filter(name="LATE").exists())
+
+    def test_categories_sorted_by_popularity(self):
+        response = self.client.get(reverse('blog:categories'), {'sort': 'popular'})
+        self.assertEqual([category.name for category in response.context['all_categories_list']],
+                         ['SHARED', 'A', 'B'])
+        self.assertContains(response, "<td>2</td>")
+
+    def test_summaries_follow_writes(self):
+        """Tests that the latest post date and top authors are kept up to date.
+        """
+        other = User.objects.create_user(username='other', password='usertesting')
+        third = create_post("third", "third content", 0, other, "C")
+        add_categories(create_post("future", "future content", 5, other, "D"), ["C"])
+        add_categories(third, ["SHARED"])
+        add_categories(create_post("fourth", "fourth content", -1, other, "E"), ["SHARED", "C"])
+        shared = Category.objects.get(name='SHARED')
+        self.assertEqual(shared.top_authors_list(), ['counter', 'other'])
+        self.assertEqual(shared.latest_post_date, third.create_date)
+        # Posts dated in the future do not count as the latest post.
+        self.assertEqual(Category.objects.get(name='C').latest_post_date, third.create_date)
+        third.delete()
+        shared.refresh_from_db()
+        self.assertEqual(shared.latest_post_date, max(self.first.create_date, self.second.create_date))
+
+    def test_categories_prefix(self):
+        create_category("SHAPES")
+        create_category("SHB")
+        response = self.client.get(reverse('blog:categories'), {'prefix': 'sha'})
+        self.assertEqual([category.name for category in response.context['all_categories_list']],
+                         ['SHAPES', 'SHARED'])
+        self.assertContains(response, "Top authors")
+
+    def test_category_suggestions(self):
+        create_category("SHAPES")
+        response = self.client.get(reverse('blog:category_suggestions'), {'q': 'sh'})
+        # Categories without posts are not suggested.
+        self.assertEqual(response.json(), [{'name': 'SHARED', 'post_count': 2}])
+        cloud = self.client.get(reverse('blog:category_suggestions')).json()
+        self.assertEqual([(tag['name'], tag['weight']) for tag in cloud],
+                         [('A', 4), ('B', 4), ('SHARED', 5)])
+
+
+class LatestPostsTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='reader', password='usertesting')
+        self.posts = [create_post("latest %d" % i, "content", -i, self.user, "L%d" % i) for i in range(3)]
+
+    def titles(self):
+        return [post['title'] for post in latest.latest(10)[0]]
+
+    def test_index_served_without_queries(self):
+        """Tests that after a write the index page is rendered again from the
+        cached feed, without going to the database.
+        """
+        self.client.get(reverse('blog:index'))
+        create_post("brand new", "content", 0, self.user, "NEW")
+        # The write's tasks have already put the page back in the page cache.
+        caching.invalidate_pages()
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('blog:index'))
+        self.assertContains(response, "Brand New")
+        self.assertEqual(response.context['latest_posts_list'][0]['create_by'], 'reader')
+
+    def test_follows_edits_and_deletes(self):
+        self.titles()
+        self.posts[1].title = "edited"
+        self.posts[1].save()
+        self.posts[0].delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titles(), ["edited", "latest 2"])
+
+    def test_rebuilt_feed_has_new_etag(self):
+        """Tests that a page read from a feed rebuilt after a delete does not get
+        the ETag of one read from an earlier build.
+        """
+        latest.invalidate()
+        caching.invalidate_pages()
+        etag = self.client.get(reverse('blog:index'))['ETag']
+        self.posts[0].delete()
+        latest.invalidate()
+        caching.invalidate_pages()
+        response = self.client.get(reverse('blog:index'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "Latest 0")
+
+    def test_future_posts_appear_when_due(self):
+        create_post("scheduled", "content", 1, self.user, "LATER")
+        self.assertEqual(self.titles(), ["latest 0", "latest 1", "latest 2"])
+        later = timezone.now() + datetime.timedelta(days=2)
+        with mock.patch('django.utils.timezone.now', return_value=later), self.assertNumQueries(0):
+            self.assertEqual(self.titles(), ["scheduled", "latest 0", "latest 1", "latest 2"])
+
+    @override_settings(LATEST_POSTS_SIZE=2)
+    def test_bounded(self):
+        # Built at the default size by the writes in setUp.
+        latest.invalidate()
+        self.assertEqual(self.titles()[:2], ["latest 0", "latest 1"])
+        feed = cache.get(latest.FEED_KEY)
+        self.assertEqual(len(feed['published']), 2)
+        self.assertFalse(feed['published_complete'])
+        # Older than anything in the feed, so it is left out rather than misplaced.
+        create_post("old", "content", -10, self.user, "OLD")
+        self.assertEqual([post['title'] for post in cache.get(latest.FEED_KEY)['published']],
+                         ["latest 0", "latest 1"])
+
+
+class FeedTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='writer', password='usertesting')
+        self.post = create_post("first & best", "<p>body</p>", -1, self.user, "NEWS")
+        create_post("second", "<p>second body</p>", 0, self.user, "OTHER")
+        scheduled = create_post("scheduled", "<p>later</p>", 1, self.user, "LATER")
+        scheduled.categories.set(self.post.categories.all())
+
+    def test_formats(self):
+        """Tests that the three formats list the published posts newest first.
+        """
+        rss = self.client.get(reverse('blog:feed', args=('rss',)))
+        self.assertEqual(rss['Content-Type'], 'application/rss+xml; charset=utf-8')
+        self.assertEqual(re.findall(r'<item><title>(.*?)</title>', rss.content.decode()),
+                         ["second", "first &amp; best"])
+        atom = self.client.get(reverse('blog:feed', args=('atom',))).content.decode()
+        self.assertIn('<summary type="html">&lt;p&gt;body&lt;/p&gt;</summary>', atom)
+        self.assertIn('<author><name>writer</name></author>', atom)
+        data = self.client.get(reverse('blog:feed', args=('json',))).json()
+        self.assertEqual([item['title'] for item in data['items']], ["second", "first & best"])
+        self.assertEqual(data['items'][1]['tags'], ['NEWS'])
+        self.assertEqual(self.client.get('/blog/feeds/posts.txt').status_code, 404)
+
+    @override_settings(FEED_SIZE=1)
+    def test_size(self):
+        data = self.client.get(reverse('blog:feed', args=('json',))).json()
+        self.assertEqual([item['title'] for item in data['items']], ["second"])
+
+    def test_category_and_author_feeds(self):
+        category = Category.objects.get(name='NEWS')
+        data = self.client.get(reverse('blog:category_feed', args=(category.pk, 'json'))).json()
+        self.assertEqual([item['title'] for item in data['items']], ["first & best"])
+        data = self.client.get(reverse('blog:author_feed', args=('writer', 'json'))).json()
+        self.assertEqual(len(data['items']), 2)
+        self.assertEqual(self.client.get(reverse('blog:author_feed', args=('nobody', 'json'))).status_code, 404)
+
+    def test_polling_is_a_cheap_304(self):
+        """Tests that a poll with the ETag is answered without a query, and that
+        after a write only the changed item is rendered again.
+        """
+        url = reverse('blog:feed', args=('rss',))
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.post.title = "edited"
+        self.post.save()
+        with mock.patch.object(feeds.WRITERS['rss'], 'item', wraps=feeds.WRITERS['rss'].item) as item:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(item.call_count, 1)
+        self.assertContains(response, "edited")
+
+    def test_renamed_author_is_rendered_again(self):
+        url = reverse('blog:feed', args=('rss',))
+        self.assertContains(self.client.get(url), '<dc:creator xmlns:dc="http://purl.org/dc/elements/1.1/">writer')
+        User.objects.filter(pk=self.user.pk).update(username='renamed')
+        caching.invalidate_pages()
+        response = self.client.get(url)
+        self.assertContains(response, '>renamed</dc:creator>', count=2)
+        self.assertNotContains(response, '>writer</dc:creator>')
+
+    def test_archive_streams(self):
+        url = reverse('blog:feed', args=('json',))
+        response = self.client.get(url, {'archive': 1})
+        self.assertTrue(response.streaming)
+        data = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+        self.assertEqual([item['title'] for item in data['items']], ["second", "first & best"])
+        response = self.client.get(url, {'archive': 1}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class AutocompleteTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='typist', password='usertesting')
+        self.post = create_post("Django tips and tricks", "content", -1, self.user, "DJANGO")
+        create_post("Djangology", "content", 0, self.user, "MUSIC")
+        create_post("Django next week", "content", 7, self.user, "DJANGO NEWS")
+
+    def suggest(self, query):
+        return self.client.get(reverse('blog:search_suggestions'), {'q': query}).json()
+
+    def test_suggestions(self):
+        """Tests that titles and categories match on the start of any word, and
+        that posts dated in the future are left out.
+        """
+        result = self.suggest('djan')
+        self.assertEqual([post['title'] for post in result['posts']], ["Djangology", "Django tips and tricks"])
+        self.assertEqual([category['name'] for category in result['categories']], ['DJANGO', 'DJANGO NEWS'])
+        self.assertEqual(result['posts'][1]['url'], reverse('blog:detail', args=(self.post.pk,)))
+        self.assertEqual([post['title'] for post in self.suggest('TRI')['posts']], ["Django tips and tricks"])
+        self.assertEqual(self.suggest(' '), {'categories': [], 'posts': []})
+
+    def test_served_without_queries(self):
+        self.suggest('dj')
+        with self.assertNumQueries(0):
+            self.suggest('tips')
+
+    def test_follows_writes_from_other_processes(self):
+        """Tests that a process picks up the changes logged by others, and
+        rebuilds its copy when part of the log is gone.
+        """
+        # Keeps the writes below clear of the changes that save a snapshot.
+        cache.set(autocomplete.VERSION_KEY, autocomplete.SNAPSHOT_EVERY + 1, None)
+        self.suggest('dj')
+        self.post.title = "Flask tips"
+        self.post.save()
+        create_post("Djangonaut", "content", 0, self.user, "PEOPLE")
+        with self.assertNumQueries(0):
+            self.assertEqual([post['title'] for post in self.suggest('djan')['posts']],
+                             ["Djangonaut", "Djangology"])
+        Post.objects.get(title="Djangology").delete()
+        autocomplete.reset()
+        cache.delete(autocomplete.SNAPSHOT_KEY)
+        self.assertEqual([post['title'] for post in self.suggest('djan')['posts']], ["Djangonaut"])
+        Post.objects.get(title="Djangonaut").delete()
+        cache.delete(autocomplete.CHANGE_KEY % cache.get(autocomplete.VERSION_KEY))
+        with mock.patch.object(autocomplete, 'build', wraps=autocomplete.build) as build:
+            self.assertEqual(self.suggest('djan')['posts'], [])
+        build.assert_called_once_with()
+
+    def test_snapshot_saved_in_parts(self):
+        """Tests that the shared snapshot is split into parts, and only used when
+        every part is still in the cache.
+        """
+        with mock.patch.object(autocomplete, 'SNAPSHOT_PART_ITEMS', 2):
+            self.suggest('dj')
+        _, _, keys = cache.get(autocomplete.SNAPSHOT_KEY)
+        self.assertEqual(len(keys), 3)
+        autocomplete.reset()
+        with mock.patch.object(autocomplete, 'build') as build:
+            self.assertEqual(len(self.suggest('djan')['posts']), 2)
+        build.assert_not_called()
+        cache.delete(keys[1])
+        autocomplete.reset()
+        with mock.patch.object(autocomplete, 'build', wraps=autocomplete.build) as build:
+            self.assertEqual(len(self.suggest('djan')['posts']), 2)
+        build.assert_called_once_with()
+
+    def test_bounded(self):
+        index = autocomplete.build()
+        self.assertEqual(len(index.trimmed(4).items), 4)
+        # The oldest posts go first.
+        self.assertNotIn((autocomplete.POST, self.post.pk), index.trimmed(4).items)
+        with self.settings(AUTOCOMPLETE_MAX_ITEMS=3):
+            self.assertEqual(len(autocomplete.build().items), 3)
+
+
+@override_settings(TASKS_EAGER=False, TASK_MAX_ATTEMPTS=2, TASK_RETRY_DELAY=0)
+class TaskQueueTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='queued', password='usertesting')
+
+    def run_worker(self):
+        out = StringIO()
+        with self.assertLogs('blog.tasks', 'INFO') as logs:
+            call_command('run_worker', '--once', stdout=out)
+        return out.getvalue(), [json.loads(line.split(':', 2)[2]) for line in logs.output]
+
+    def test_write_queues_the_rest(self):
+        """Tests that a save writes the post and its links, leaving indexing,
+        counts and cached pages to the worker.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            post = save_post(Post(title="queued post", content="<p>later</p>", create_date=timezone.now(),
+                                  create_by=self.user), ["QUEUED"])
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'fts' in query['sql'] or 'searchterm' in query['sql']])
+        self.assertEqual(list(Task.objects.values_list('name', flat=True)),
+                         ['reindex_posts', 'refresh_feed', 'sweep_categories', 'invalidate_pages'])
+        self.assertEqual(Category.objects.get(name="QUEUED").post_count, 0)
+        self.assertEqual(search.search("queued"), [])
+        out, logs = self.run_worker()
+        self.assertIn("Ran 4 tasks.", out)
+        self.assertEqual({log['status'] for log in logs}, {'done'})
+        self.assertEqual(search.search("queued"), [post.pk])
+        self.assertEqual(Category.objects.get(name="QUEUED").post_count, 1)
+        # The home page was rendered again by the worker.
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(reverse('blog:index')), "Queued Post")
+
+    def test_model_writes_queue_category_summaries(self):
+        post = Post.objects.create(title="linked", content="c", create_date=timezone.now(), create_by=self.user)
+        category = create_category("LINKED")
+        post.categories.add(category)
+        self.assertEqual(Category.objects.get(pk=category.pk).post_count, 0)
+        self.run_worker()
+        self.assertEqual(Category.objects.get(pk=category.pk).post_count, 1)
+        post.delete()
+        self.assertEqual(Category.objects.get(pk=category.pk).post_count, 1)
+        self.run_worker()
+        # Left without posts, it is purged as after any other delete.
+        self.assertFalse(Category.objects.filter(pk=category.pk).exists())
+
+    def test_delete_sweeps_orphans(self):
+        post = save_post(Post(title="doomed", content="c", create_date=timezone.now(), create_by=self.user),
+                         ["ONLY"])
+        delete_post(post)
+        self.run_worker()
+        self.assertFalse(Category.objects.filter(name="ONLY").exists())
+        self.assertEqual(search.search("doomed"), [])
+
+    def test_scheduled_post_refreshes_its_category_when_due(self):
+        published = save_post(Post(title="now", content="c", create_date=timezone.now(), create_by=self.user),
+                              ["DUE"])
+        due = timezone.now() + datetime.timedelta(days=1)
+        save_post(Post(title="later", content="c", create_date=due, create_by=self.user), ["DUE"])
+        self.run_worker()
+        category = Category.objects.get(name="DUE")
+        self.assertEqual(category.latest_post_date, published.create_date)
+        self.assertEqual(list(Task.objects.filter(status=Task.PENDING).values_list('name', 'run_after')),
+                         [('sweep_categories', due)])
+        with mock.patch('django.utils.timezone.now', return_value=due + datetime.timedelta(seconds=1)):
+            self.run_worker()
+        category.refresh_from_db()
+        self.assertEqual(category.latest_post_date, due)
+
+    def test_failing_task_is_retried_then_failed(self):
+        failing = mock.Mock(side_effect=OperationalError("down"), key='')
+        with mock.patch.dict(tasks.TASKS, reindex_posts=failing):
+            tasks.enqueue([('reindex_posts', {'post_ids': [1]})])
+            self.run_worker()
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts, failing.call_count), (Task.FAILED, 2, 2))
+        self.assertIn("OperationalError: down", task.last_error)
+        self.assertEqual(tasks.stats()['reindex_posts']['failed'], 1)
+
+    def test_pending_invalidations_run_once(self):
+        for _ in range(3):
+            tasks.pages_changed()
+        _, logs = self.run_worker()
+        self.assertEqual([log['task'] for log in logs], ['invalidate_pages'])
+        self.assertEqual(set(Task.objects.values_list('status', flat=True)), {Task.DONE})
+
+    def test_invalidation_waits_for_later_writes(self):
+        """Tests that an invalidation does not cover one queued by a later write
+        whose feed update has not run yet.
+        """
+        latest.load()
+        save_post(Post(title="first post", content="c", create_date=timezone.now(), create_by=self.user), [])
+        with self.assertLogs('blog.tasks', 'INFO'):
+            tasks.run_pending(limit=2)
+        save_post(Post(title="second post", content="c", create_date=timezone.now(), create_by=self.user), [])
+        self.run_worker()
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(reverse('blog:index')), "Second Post")
+
+    @override_settings(TASK_TIMEOUT=60)
+    def test_stale_tasks_are_queued_again(self):
+        tasks.pages_changed()
+        tasks.pages_changed()
+        tasks.posts_changed([0])
+        ago = timezone.now() - datetime.timedelta(minutes=5)
+        Task.objects.update(status=Task.RUNNING, attempts=1, started_at=ago, heartbeat_at=ago)
+        # Slow, but its worker is still beating.
+        Task.objects.filter(name='reindex_posts').update(heartbeat_at=timezone.now())
+        # Out of attempts.
+        Task.objects.filter(name='refresh_feed').update(attempts=2)
+        out, _ = self.run_worker()
+        self.assertIn("Queued 3 tasks", out)
+        self.assertEqual(dict(Task.objects.values_list('name', 'status').order_by('name', 'status')), {
+            'invalidate_pages': Task.DONE, 'refresh_feed': Task.FAILED, 'reindex_posts': Task.RUNNING,
+        })
+        out = StringIO()
+        call_command('run_worker', '--stats', stdout=out)
+        self.assertRegex(out.getvalue(), r'invalidate_pages +0 +0 +3 +0 +3')
+
+    def test_results_are_only_saved_by_the_owning_worker(self):
+        tasks.pages_changed()
+        task = tasks.claim()
+        self.assertEqual(task.worker, tasks.WORKER_ID)
+        self.assertTrue(tasks.beat(task))
+        # Given up on and claimed by another worker meanwhile.
+        Task.objects.update(worker='elsewhere:1')
+        self.assertFalse(tasks.beat(task))
+        with self.assertLogs('blog.tasks', 'INFO'):
+            tasks.run_task(task)
+        self.assertEqual(Task.objects.get().status, Task.RUNNING)
+
+
+@override_settings(THROTTLE_RATES={'search': {'anon': '2/min'}, 'suggest': {'anon': '1/min', 'user': '5/min'},
+                                   'api': {'anon': '1/min'}})
+class ThrottleTests(BlogTestCase):
+    def test_bucket_refills(self):
+        with mock.patch('time.time', return_value=1000.0) as clock:
+            self.assertEqual([throttling.take('bucket', 2, 60) for _ in range(3)], [0, 0, 30])
+            clock.return_value = 1031.0
+            self.assertEqual([throttling.take('bucket', 2, 60) for _ in range(2)], [0, 29])
+
+    def test_search_is_throttled_per_client(self):
+        url = reverse('blog:search')
+        self.assertEqual([self.client.get(url, {'search': 'x'}).status_code for _ in range(2)], [200, 200])
+        response = self.client.get(url, {'search': 'x'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.2').status_code, 200)
+        # No limit is set for logged in users.
+        User.objects.create_user(username='reader', password='usertesting')
+        self.client.login(username='reader', password='usertesting')
+        self.assertEqual(self.client.get(url, {'search': 'x'}).status_code, 200)
+
+    def test_forwarded_for_is_only_trusted_behind_proxies(self):
+        url = reverse('blog:search')
+        statuses = [self.client.get(url, HTTP_X_FORWARDED_FOR='10.0.1.%d' % number).status_code
+                    for number in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        with override_settings(REST_FRAMEWORK={'NUM_PROXIES': 1}):
+            self.assertEqual(self.client.get(url, HTTP_X_FORWARDED_FOR='10.0.1.9').status_code, 200)
+            self.assertEqual(self.client.get(url, HTTP_X_FORWARDED_FOR='10.0.1.9, 127.0.0.1').status_code, 429)
+
+    def test_scopes_have_their_own_buckets(self):
+        url = reverse('blog:search_suggestions')
+        self.assertEqual(self.client.get(url, {'q': 'a'}).status_code, 200)
+        self.assertEqual(self.client.get(url, {'q': 'a'}).status_code, 429)
+        self.assertEqual(self.client.get(reverse('blog:search')).status_code, 200)
+
+    def test_api_is_throttled(self):
+        self.assertEqual(self.client.get('/blog/apiposts/').status_code, 200)
+        response = self.client.get('/blog/apiposts/')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+
+
+@skipUnless(connection.vendor == 'sqlite', "reads SQLite query plans")
+class IndexUsageTests(BlogTestCase):
+    """
+    Runs EXPLAIN QUERY PLAN over every query a page makes and fails when one of
+    the blog tables is read with a full table scan.
+    """
+    SCAN_RE = re.compile(r'\bSCAN (TABLE )?(blog_\w+)\b(?! USING (COVERING )?INDEX)(?! VIRTUAL TABLE)')
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='explainer', password='usertesting')
+        for i in range(20):
+            self.post = create_post("explained %d" % i, "explained content", -i, self.user, "tag%d" % i)
+        self.category = self.post.categories.get()
+
+    def full_scans(self, queries):
+        scans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                if not query['sql'].startswith('SELECT'):
+                    continue
+                # On SQLite the captured sql has its parameters already quoted in.
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plan = ' / '.join(row[-1] for row in cursor.fetchall())
+                if self.SCAN_RE.search(plan):
+                    scans.append('%s\n  -> %s' % (query['sql'], plan))
+        return scans
+
+    def assertUsesIndexes(self, url, data=None):
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(url, data).status_code, 200)
+        scans = self.full_scans(context.captured_queries)
+        self.assertFalse(scans, "full table scans for %s:\n%s" % (url, "\n".join(scans)))
+
+    def test_index_uses_indexes(self):
+        self.assertUsesIndexes(reverse('blog:index'))
+
+    def test_profile_uses_indexes(self):
+        self.client.login(username='explainer', password='usertesting')
+        self.assertUsesIndexes(reverse('blog:profile_view'))
+
+    def test_category_pages_use_indexes(self):
+        self.assertUsesIndexes(reverse('blog:categories'))
+        self.assertUsesIndexes(reverse('blog:categories'), {'sort': 'popular'})
+        self.assertUsesIndexes(reverse('blog:category', args=(self.category.id,)))
+
+    def test_post_and_search_use_indexes(self):
+        self.assertUsesIndexes(reverse('blog:detail', args=(self.post.id,)))
+        self.assertUsesIndexes(reverse('blog:search'), {'search': 'explained'})
+        self.assertUsesIndexes(reverse('blog:search'))
+
+    def test_api_uses_indexes(self):
+        self.assertUsesIndexes('/blog/apiposts/')
+        self.assertUsesIndexes('/blog/apiposts/%d/' % self.post.id)
+
+
+@override_settings(BULK_BATCH_SIZE=2)
+class BulkAPITests(BlogTestCase):
+    url = '/blog/apiposts/bulk/'
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='bulker', password='usertesting')
+        self.other = User.objects.create_user(username='other', password='usertesting')
+        self.client.login(username='bulker', password='usertesting')
+
+    def send(self, method, payload):
+        return getattr(self.client, method)(self.url, payload, content_type='application/json')
+
+    def counts(self):
+        return dict(Category.objects.values_list('name', 'post_count'))
+
+    def test_bulk_create(self):
+        """Tests that valid items are created with their categories and bad ones reported.
+        """
+        date = timezone.now().isoformat()
+        items = [{'title': 'post %d' % n, 'content': '<p>bulk %d</p><script>x</script>' % n,
+                  'create_date': date, 'categories': ['news', 'Post %d' % n]} for n in range(3)]
+        items.insert(1, {'content': 'no title', 'create_date': date})
+        response = self.send('post', items)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], [201, 400, 201, 201])
+        self.assertIn('title', results[1]['errors'])
+        post = Post.objects.get(pk=results[2]['id'])
+        self.assertEqual(post.title, 'post 1')
+        self.assertEqual(post.create_by, self.user)
+        self.assertEqual((post.content, post.body), ('<p>bulk 1</p>', '<p>bulk 1</p>'))
+        self.assertEqual(self.counts(), {'NEWS': 3, 'POST 0': 1, 'POST 1': 1, 'POST 2': 1})
+        data = self.client.get('/blog/apiposts/%d/' % post.pk).json()
+        self.assertEqual((data['content'], data['categories']), ('<p>bulk 1</p>', ['NEWS', 'POST 1']))
+        search_response = self.client.get(reverse('blog:search'), {'search': 'bulk'})
+        self.assertEqual(len(search_response.context['results']), 3)
+
+    def test_bulk_update(self):
+        """Tests partial updates, category replacement and per item permission checks.
+        """
+        mine = create_post("mine", "old", 0, self.user, "OLD")
+        theirs = create_post("theirs", "old", 0, self.other, "THEIRS")
+        response = self.send('patch', [
+            {'id': mine.pk, 'content': 'fresh words<script>x</script>', 'categories': ['new']},
+            {'id': theirs.pk, 'title': 'taken'},
+            {'id': 0, 'title': 'missing'},
+            {'title': 'no id'},
+        ])
+        self.assertEqual([result['status'] for result in response.json()['results']],
+                         [200, 403, 404, 400])
+        mine.refresh_from_db()
+        self.assertEqual((mine.title, mine.content, mine.body), ("mine", "fresh words", "fresh words"))
+        self.assertEqual(Post.objects.get(pk=theirs.pk).title, "theirs")
+        self.assertEqual(self.counts(), {'OLD': 0, 'NEW': 1, 'THEIRS': 1})
+        search_response = self.client.get(reverse('blog:search'), {'search': 'fresh'})
+        self.assertEqual(list(search_response.context['results']), [mine])
+
+    def test_bulk_update_create_date(self):
+        """Tests that a new create_date is saved, as it is by a single PATCH.
+        """
+        mine = create_post("mine", "old", 0, self.user, "OLD")
+        moved = timezone.now() - datetime.timedelta(days=3)
+        response = self.send('patch', [{'id': mine.pk, 'create_date': moved.isoformat()}])
+        self.assertEqual(response.json()['results'][0]['status'], 200)
+        self.assertEqual(Post.objects.get(pk=mine.pk).create_date, moved)
+        self.assertEqual(Category.objects.get(name="OLD").latest_post_date, moved)
+        moved -= datetime.timedelta(days=1)
+        single = self.client.patch('/blog/apiposts/%d/' % mine.pk, {'create_date': moved.isoformat()},
+                                   content_type='application/json')
+        self.assertEqual(single.status_code, 200)
+        self.assertEqual(Post.objects.get(pk=mine.pk).create_date, moved)
+
+    @skipUnless(connection.vendor == 'sqlite', "takes SQLite's write lock")
+    def test_ids_are_read_under_write_lock(self):
+        with CaptureQueriesContext(connection) as queries:
+            create_posts([Post(title="locked", content="c", create_date=timezone.now(), create_by=self.user)])
+        statements = [query['sql'] for query in queries.captured_queries]
+        lock = next(n for n, sql in enumerate(statements) if sql.startswith('UPDATE sqlite_sequence'))
+        self.assertLess(lock, next(n for n, sql in enumerate(statements) if 'MAX(' in sql))
+
+    def test_bulk_delete(self):
+        """Tests that owned posts are deleted and their orphaned categories purged.
+        """
+        first = create_post("first", "first", 0, self.user, "ONLY")
+        second = create_post("second", "second", 0, self.user, "SHARED")
+        theirs = create_post("theirs", "theirs", 0, self.other, "OTHER")
+        add_categories(theirs, ["SHARED"])
+        response = self.send('delete', [first.pk, second.pk, theirs.pk, 'x'])
+        self.assertEqual([result['status'] for result in response.json()['results']],
+                         [204, 204, 403, 400])
+        self.assertEqual(list(Post.objects.values_list('pk', flat=True)), [theirs.pk])
+        self.assertEqual(self.counts(), {'OTHER': 1, 'SHARED': 1})
+
+    def test_bulk_requires_a_list(self):
+        self.assertEqual(self.send('post', {'title': 'single'}).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.send('delete', [1]).status_code, 403)
+
+
+class ExportTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='exporter', password='usertesting')
+        self.first = create_post("first", "<p>one</p>", 0, self.user, "A")
+        self.second = create_post("second", "two", 0, self.user, "B")
+        add_categories(self.second, ["A"])
+
+    def test_command_ndjson(self):
+        """Tests that every post is written with its author and categories.
+        """
+        out = StringIO()
+        # One query for the posts and one for the categories of each chunk.
+        with self.assertNumQueries(3):
+            call_command('export_posts', '--chunk-size', '1', stdout=out)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([(record['title'], record['author'], record['categories']) for record in records],
+                         [("first", "exporter", ["A"]), ("second", "exporter", ["A", "B"])])
+        self.assertEqual(records[0]['content'], "<p>one</p>")
+
+    def test_command_incremental_csv(self):
+        since = timezone.now()
+        Post.objects.filter(pk=self.second.pk).update(modified_at=since + datetime.timedelta(seconds=1))
+        out = StringIO()
+        call_command('export_posts', '--format', 'csv', '--since', since.isoformat(), stdout=out)
+        rows = list(csv.DictReader(StringIO(out.getvalue())))
+        self.assertEqual([(row['title'], row['categories']) for row in rows], [("second", "A,B")])
+
+    def test_api_export(self):
+        url = '/blog/apiposts/export/'
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.login(username='exporter', password='usertesting')
+        response = self.client.get(url, {'type': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode('utf-8'))))
+        self.assertEqual([row['title'] for row in rows], ["first", "second"])
+        response = self.client.get(url, {'since': timezone.now().isoformat()})
+        self.assertEqual(b''.join(response.streaming_content), b'')
+        self.assertEqual(self.client.get(url, {'since': 'yesterday'}).status_code, 400)
+
+
+class ImportTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='importer', password='usertesting')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as handle:
+            handle.write(text)
+        return path
+
+    def ndjson(self, count):
+        date = timezone.now().isoformat()
+        return ''.join(json.dumps({
+            'title': 'imported %d' % n, 'content': '<p>body %d</p><script>x</script>' % n,
+            'create_date': date, 'author': 'importer', 'categories': ['archive', 'Part %d' % (n % 2)],
+        }) + '\n' for n in range(count))
+
+    def test_import_ndjson(self):
+        """Tests that posts are sanitized, rendered, categorized and indexed, and bad rows skipped.
+        """
+        path = self.write('posts.ndjson', self.ndjson(5) + '{"title": "no content"}\nnot json\n')
+        out, err = StringIO(), StringIO()
+        call_command('import_posts', path, '--batch-size', '2', '--workers', '2', stdout=out, stderr=err)
+        self.assertIn("Imported 5 posts", out.getvalue())
+        self.assertIn("Skipped row 6: content is missing", err.getvalue())
+        self.assertIn("Skipped row 7: expected an object", err.getvalue())
+        post = Post.objects.get(title='imported 3')
+        self.assertEqual((post.content, post.body, post.create_by), ('<p>body 3</p>', '<p>body 3</p>', self.user))
+        self.assertEqual(post.categories_as_string(), 'Archive, Part 1, ')
+        self.assertEqual(dict(Category.objects.values_list('name', 'post_count')),
+                         {'ARCHIVE': 5, 'PART 0': 3, 'PART 1': 2})
+        response = self.client.get(reverse('blog:search'), {'search': 'body'})
+        self.assertEqual(len(response.context['results']), 5)
+
+    def test_rows_of_the_wrong_types_are_skipped(self):
+        date = timezone.now().isoformat()
+        rows = [
+            {'title': 'listed author', 'content': 'c', 'create_date': date, 'author': ['importer']},
+            {'title': 'object author', 'content': 'c', 'create_date': date, 'author': {'name': 'importer'}},
+            {'title': 'bad categories', 'content': 'c', 'create_date': date, 'author': 'importer',
+             'categories': [1, 2]},
+            {'title': ['listed title'], 'content': 'c', 'create_date': date, 'author': 'importer'},
+        ]
+        path = self.write('posts.ndjson', ''.join(json.dumps(row) + '\n' for row in rows) + self.ndjson(1))
+        out, err = StringIO(), StringIO()
+        call_command('import_posts', path, '--workers', '0', stdout=out, stderr=err)
+        self.assertIn("Imported 1 posts", out.getvalue())
+        self.assertIn("Skipped row 1: author is not a username", err.getvalue())
+        self.assertIn("Skipped row 2: author is not a username", err.getvalue())
+        self.assertIn("Skipped row 3: categories are not a list of names", err.getvalue())
+        self.assertIn("Skipped row 4: title is missing or too long", err.getvalue())
+
+    def test_import_csv_resumes_from_checkpoint(self):
+        export = StringIO()
+        create_post("exported", "first", 0, self.user, "A")
+        create_post("exported again", "second", 0, self.user, "B")
+        call_command('export_posts', '--format', 'csv', stdout=export)
+        Post.objects.all().delete()
+        path = self.write('posts.csv', export.getvalue())
+        checkpoint = os.path.join(self.directory.name, 'checkpoint')
+        with open(checkpoint, 'w') as handle:
+            json.dump({'source': path, 'rows': 1}, handle)
+        call_command('import_posts', path, '--workers', '0', '--checkpoint', checkpoint, stdout=StringIO())
+        self.assertEqual(list(Post.objects.values_list('title', 'categories__name')),
+                         [("exported again", "B")])
+        self.assertFalse(os.path.exists(checkpoint))
+
+
+class BenchmarkTests(BlogTestCase):
+    def test_corpus_is_reproducible_and_skewed(self):
+        generator = CorpusGenerator(300, seed=3)
+        generator.generate()
+        counts = list(Category.objects.order_by('name').values_list('post_count', flat=True))
+        self.assertEqual(Post.objects.count(), 300)
+        self.assertGreater(counts[0], 5 * counts[-1] + 1)
+        self.assertTrue(Post.objects.filter(create_date__gt=timezone.now()).exists())
+        first, second = CorpusGenerator(300, seed=3), CorpusGenerator(300, seed=3)
+        self.assertEqual([first.content() for _ in range(3)], [second.content() for _ in range(3)])
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def test_every_scenario_runs(self):
+        CorpusGenerator(200, seed=1).generate()
+        scenarios, user = build_scenarios()
+        benchmark = Benchmark(user, repeat=1)
+        for scenario in scenarios:
+            if scenario.name == 'api schema':
+                # Needs pyyaml, which the requirements do not pull in.
+                continue
+            with self.subTest(scenario.name):
+                result = benchmark.measure(scenario)
+                self.assertLess(result['status'], 400)
+                self.assertGreater(result['queries'], 0)
+
+    def test_compare_flags_regressions(self):
+        baseline = {'results': {'index': {'median_ms': 10.0, 'queries': 3, 'peak_kb': 100.0}}}
+        current = {'results': {'index': {'median_ms': 11.0, 'queries': 4, 'peak_kb': 100.0},
+                               'new': {'median_ms': 1.0, 'queries': 1, 'peak_kb': 1.0}}}
+        self.assertEqual([(metric, regressed) for _, metric, _, _, _, regressed in compare(baseline, current)],
+                         [('median_ms', False), ('queries', True), ('peak_kb', False)])
+
+
+class ProfilingTests(BlogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='profiled', password='usertesting')
+        self.post = create_post("profiled", "content", 0, self.user, "A")
+
+    def test_off_by_default(self):
+        self.assertFalse(self.client.get(reverse('blog:index')).has_header('Server-Timing'))
+
+    @override_settings(PROFILING=True)
+    def test_server_timing_and_log(self):
+        with self.assertLogs('blog.profiling', 'INFO') as logs:
+            response = self.client.get(reverse('blog:detail', args=(self.post.id,)))
+        timing = response['Server-Timing']
+        for metric in ('total;dur=', 'sql;dur=', 'template;dur=', 'app;dur='):
+            self.assertIn(metric, timing)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['path'], reverse('blog:detail', args=(self.post.id,)))
+        self.assertEqual(record['sql_count'], int(re.search(r'"(\d+) queries"', timing).group(1)))
+        self.assertGreater(record['template_ms'], 0)
+        self.assertTrue(any(query['origin'] and query['origin'].startswith('blog')
+                            for query in record['slowest_queries']))
+
+    @override_settings(PROFILING=True)
+    def test_repeated_statements_reported(self):
+        for number in range(3):
+            create_post("more %d" % number, "content", -1 - number, self.user, "B%d" % number)
+        # Past the first page, which comes from the cached latest posts feed.
+        cursor = KeysetPaginator(Post.objects.all(), 10).encode_cursor(self.post)
+        with self.assertLogs('blog.profiling', 'INFO') as logs, \
+                mock.patch.object(Post.listed, 'get_queryset', Post.objects.all):
+            self.client.get(reverse('blog:index'), {'cursor': cursor})
+        record = json.loads(logs.records[0].getMessage())
+        self.assertTrue(record['repeated_statements'])
+
+    def test_sampled_requests_are_profiled(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+                PROFILING=True, PROFILING_SAMPLE_RATE=2, PROFILING_DIR=directory), \
+                self.assertLogs('blog.profiling', 'INFO'):
+            for _ in range(4):
+                self.client.get(reverse('blog:login'))
+            self.assertEqual(len(os.listdir(directory)), 2)
+
+
+@override_settings(REPLICA_DATABASES=['replica1'])
+class ReplicaRoutingTests(BlogTestCase):
+    """
+    The routing decisions are checked with QuerySet.db, which asks the router
+    without running a query, as the test database has no replica behind it.
+    """
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+        routers._unavailable.clear()
+        self.addCleanup(routers._unavailable.clear)
+        patcher = mock.patch.object(routers, 'connections')
+        self.ensure_connection = patcher.start()['replica1'].ensure_connection
+        self.addCleanup(patcher.stop)
+
+    def route(self, request, view=None):
+        seen = []
+
+        def get_response(request):
+            seen.append(Post.objects.all().db)
+            if view:
+                view()
+            seen.append(Post.objects.all().db)
+            return HttpResponse()
+
+        response = ReplicaRoutingMiddleware(get_response)(request)
+        return seen, response
+
+    def test_reads_of_safe_requests_go_to_replica(self):
+        seen, response = self.route(self.factory.get('/'))
+        self.assertEqual(seen, ['replica1', 'replica1'])
+        self.assertNotIn('primary_pin', response.cookies)
+        self.assertEqual(Post.objects.all().db, 'default')
+
+    def test_writes_pin_to_primary(self):
+        seen, response = self.route(self.factory.post('/'))
+        self.assertEqual(seen, ['default', 'default'])
+        self.assertIn('primary_pin', response.cookies)
+        request = self.factory.get('/')
+        request.COOKIES['primary_pin'] = '1'
+        self.assertEqual(self.route(request)[0], ['default', 'default'])
+        seen, response = self.route(self.factory.get('/'), view=lambda: Post.objects.update(title='x'))
+        self.assertEqual(seen, ['replica1', 'default'])
+        self.assertIn('primary_pin', response.cookies)
+
+    def test_failed_replica_falls_back_to_primary(self):
+        self.ensure_connection.side_effect = OperationalError
+        self.assertEqual(self.route(self.factory.get('/'))[0], ['default', 'default'])
+        self.ensure_connection.side_effect = None
+        # Left alone until the retry period has passed.
+        self.assertEqual(self.route(self.factory.get('/'))[0], ['default', 'default'])
+
+    def test_view_rerun_on_primary_after_replica_error(self):
+        request = self.factory.get('/')
+        request.resolver_match = mock.Mock(args=(), kwargs={},
+                                           func=lambda request: HttpResponse(Post.objects.all().db))
+        middleware = ReplicaRoutingMiddleware(lambda request: middleware.process_exception(
+            request, OperationalError()) if Post.objects.all().db == 'replica1' else None)
+        self.assertEqual(middleware(request).content, b'default')
+        self.assertIn('replica1', routers._unavailable)
+
+
+@override_settings(TASKS_EAGER=True)
+class AsyncViewTests(TransactionTestCase):
+    """
+    The async views run on the database threads, which have connections of
+    their own and only see committed rows.
+    """
+    def setUp(self):
+        cache.clear()
+        autocomplete.reset()
+        self.user = User.objects.create_user(username='async', password='usertesting')
+        self.post = create_post("Async post", "<p>served from a thread</p>", -1, self.user, "ASYNC")
+
+    def tearDown(self):
+        offload.shutdown()
+
+    def test_read_views_are_async(self):
+        for path in ('/blog/', '/blog/Posts/%d/' % self.post.pk, '/blog/Search/', '/blog/apiposts/',
+                     '/blog/apiposts/%d/' % self.post.pk):
+            with self.subTest(path):
+                self.assertTrue(asyncio.iscoroutinefunction(resolve(path, 'Blog.urls_async').func))
+                self.assertFalse(asyncio.iscoroutinefunction(resolve(path).func))
+        self.assertFalse(asyncio.iscoroutinefunction(resolve('/blog/Categories', 'Blog.urls_async').func))
+        self.assertEqual(AsyncViewsHandler.request_class.urlconf, 'Blog.urls_async')
+
+    @override_settings(ROOT_URLCONF='Blog.urls_async')
+    async def test_async_views_respond(self):
+        client = AsyncClient()
+        response = await client.get('/blog/Posts/%d/' % self.post.pk)
+        self.assertContains(response, "served from a thread")
+        response = await client.get('/blog/Search/', {'search': 'async'})
+        self.assertContains(response, "Async post")
+        response = await client.get('/blog/apiposts/%d/' % self.post.pk)
+        self.assertEqual(response.json()['title'], "Async post")
+        self.assertEqual((await client.get('/blog/apiposts/%d/' % (self.post.pk + 1))).status_code, 404)
+
+    @override_settings(ROOT_URLCONF='Blog.urls_async')
+    async def test_cached_page_needs_no_thread(self):
+        client = AsyncClient()
+        first = await client.get('/blog/')
+        self.assertContains(first, "Async Post")
+        with mock.patch.object(offload, 'run') as run:
+            response = await client.get('/blog/')
+        run.assert_not_called()
+        self.assertEqual(response.content, first.content)
+        self.assertEqual(response['ETag'], first['ETag'])
+
+    @override_settings(ROOT_URLCONF='Blog.urls_async', REPLICA_DATABASES=['default'])
+    async def test_replica_routing_keeps_requests_concurrent(self):
+        """Tests that with replicas the middleware stays async, so two requests
+        can wait on the database threads at once, each reading from a replica.
+        """
+        barrier = threading.Barrier(2, timeout=5)
+        replicas = []
+        render = offload.render
+
+        def waiting_render(view, request, *args, **kwargs):
+            response = render(view, request, *args, **kwargs)
+            replicas.append(routers.current_replica())
+            barrier.wait()
+            return response
+
+        client = AsyncClient()
+        with mock.patch.object(offload, 'render', waiting_render):
+            responses = await asyncio.gather(client.get('/blog/Search/', {'search': 'async'}),
+                                             client.get('/blog/Search/', {'search': 'async'}))
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        self.assertEqual(replicas, ['default', 'default'])
+
+    @override_settings(ROOT_URLCONF='Blog.urls_async', REPLICA_DATABASES=['default'])
+    async def test_replica_error_reruns_sync_view(self):
+        def failing_render(view, request, *args, **kwargs):
+            Post.objects.count()
+            raise OperationalError("replica down")
+
+        routers._unavailable.clear()
+        try:
+            with mock.patch.object(offload, 'render', failing_render):
+                response = await AsyncClient().get('/blog/Search/', {'search': 'async'})
+            self.assertContains(response, "Async post")
+            self.assertIn('default', routers._unavailable)
+        finally:
+            routers._unavailable.clear()
+
+    @override_settings(ROOT_URLCONF='Blog.urls_async', PROFILING=True)
+    async def test_profiling_sees_queries_on_database_threads(self):
+        with self.assertLogs('blog.profiling', 'INFO') as logs:
+            response = await AsyncClient().get('/blog/Search/', {'search': 'async'})
+        self.assertTrue(response.has_header('Server-Timing'))
+        self.assertGreater(json.loads(logs.records[0].getMessage())['sql_count'], 0)
+
+    @override_settings(ASYNC_DB_THREADS=2)
+    def test_threads_are_bounded(self):
+        running = []
+        peak = []
+
+        def work(number):
+            running.append(number)
+            peak.append(len(running))
+            time.sleep(0.02)
+            running.remove(number)
+            return number
+
+        async def run_all():
+            return await asyncio.gather(*[offload.run(work, number) for number in range(8)])
+
+        self.assertEqual(asyncio.run(run_all()), list(range(8)))
+        self.assertEqual(max(peak), 2)
+
+    @override_settings(ALLOWED_HOSTS=['localhost'])
+    def test_concurrency_benchmark_runs(self):
+        benchmark = ConcurrencyBenchmark(read_paths(), requests=10, concurrency=4)
+        with slow_queries(0.001):
+            results = [benchmark.run_wsgi(WSGIHandler(), workers=2), benchmark.run_asgi(AsyncViewsHandler())]
+        for result in results:
+            self.assertEqual((result['requests'], result['errors']), (10, 0))
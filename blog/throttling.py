@@ -0,0 +1,137 @@
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def parse_rate(rate):
+    """
+    Returns (requests, seconds) for a rate like '30/min'.
+    """
+    count, period = rate.split('/')
+    return int(count), DURATIONS[period[0]]
+
+def get_rate(request, scope):
+    """
+    Returns the (requests, seconds) allowed for scope to the request's client,
+    going by THROTTLE_RATES[scope]['user'] or ['anon'], or None for no limit.
+    """
+    user = getattr(request, 'user', None)
+    state = 'user' if user is not None and user.is_authenticated else 'anon'
+    rate = getattr(settings, 'THROTTLE_RATES', {}).get(scope, {}).get(state)
+    return parse_rate(rate) if rate else None
+
+def client_address(request):
+    """
+    The client's address: REMOTE_ADDR, or with NUM_PROXIES set, the address
+    that many hops from the end of X-Forwarded-For, which the proxies added.
+    Without proxies the header is whatever the client sent, so it is ignored.
+    """
+    num_proxies = api_settings.NUM_PROXIES
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    if num_proxies and forwarded:
+        addresses = forwarded.split(',')
+        return addresses[-min(num_proxies, len(addresses))].strip()
+    return request.META.get('REMOTE_ADDR')
+
+def client_id(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return 'user-%s' % user.pk
+    return 'ip-%s' % client_address(request)
+
+def take(key, requests, seconds):
+    """
+    Takes a token from the bucket under key, which holds up to requests tokens
+    and gets them back at requests per seconds. Returns 0 when there was one,
+    otherwise how many seconds until there is.
+
+    The bucket is kept as one number in the cache, the time in milliseconds at
+    which it will be full again, and moved on with incr, so it stays right
+    with many processes sharing the cache and costs two cache calls.
+    """
+    interval = seconds * 1000 // requests
+    window = seconds * 1000
+    now = int(time.time() * 1000)
+    try:
+        full_at = cache.incr(key, interval)
+    except ValueError:
+        full_at = None
+    if full_at is None or full_at - interval < now:
+        # A new bucket, or one that filled up again while nobody used it.
+        full_at = now + interval
+        cache.set(key, full_at, seconds + 1)
+    elif full_at - now > window:
+        # Empty: give the token back.
+        cache.decr(key, interval)
+        return math.ceil((full_at - window - now) / 1000) or 1
+    else:
+        cache.touch(key, math.ceil((full_at - now) / 1000) + 1)
+    return 0
+
+def check(request, scope):
+    """
+    Returns how many seconds the request's client has to wait before using
+    scope again, or 0 when it can go ahead.
+    """
+    rate = get_rate(request, scope)
+    if rate is None:
+        return 0
+    return take('throttle:%s:%s' % (scope, client_id(request)), *rate)
+
+def throttled_response(wait):
+    response = HttpResponse("Too many requests, try again in %d seconds." % wait, status=429,
+                            content_type='text/plain')
+    response['Retry-After'] = str(wait)
+    return response
+
+def throttle(scope):
+    """
+    Limits a view function to the THROTTLE_RATES of scope, answering with a
+    429 and Retry-After when the client is over.
+    """
+    def decorator(view):
+        @wraps(view)
+        def throttled_view(request, *args, **kwargs):
+            wait = check(request, scope)
+            if wait:
+                return throttled_response(wait)
+            return view(request, *args, **kwargs)
+        return throttled_view
+    return decorator
+
+
+class ThrottleMixin:
+    """
+    Limits a class based view to the THROTTLE_RATES of throttle_scope.
+    """
+    throttle_scope = None
+
+    def dispatch(self, request, *args, **kwargs):
+        wait = check(request, self.throttle_scope)
+        if wait:
+            return throttled_response(wait)
+        return super().dispatch(request, *args, **kwargs)
+
+
+class BucketThrottle(BaseThrottle):
+    """
+    The token buckets of THROTTLE_RATES for the API, by the view's
+    throttle_scope, 'api' when it has none. DRF answers a denied request with
+    a 429 and Retry-After.
+    """
+    default_scope = 'api'
+
+    def allow_request(self, request, view):
+        self.wait_seconds = check(request, getattr(view, 'throttle_scope', None) or self.default_scope)
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
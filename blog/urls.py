@@ -14,9 +14,14 @@ app_name='blog'
 urlpatterns = [
     path('', views.IndexView.as_view(), name='index'),
     path('Categories', views.CategoriesView.as_view(), name='categories'),
+    path('Categories/suggest', views.category_suggestions, name='category_suggestions'),
     path('Categories/<int:pk>/', views.CategoryView.as_view(), name='category'),
     path('Posts/<int:pk>/', views.PostView.as_view(), name='detail'),
     path('Search/', views.SearchView.as_view(), name='search'),
+    path('feeds/posts.<str:format>', views.FeedView.as_view(), name='feed'),
+    path('feeds/categories/<int:key>.<str:format>', views.FeedView.as_view(kind='category'), name='category_feed'),
+    path('feeds/authors/<str:key>.<str:format>', views.FeedView.as_view(kind='author'), name='author_feed'),
+    path('Search/suggest', views.search_suggestions, name='search_suggestions'),
     path('accounts/', include('django.contrib.auth.urls')),
     path('account', views.ProfileView.as_view(), name='profile_view'),
     path('new_post', views.CreatePostView.as_view(), name='new_post'),
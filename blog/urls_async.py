@@ -0,0 +1,33 @@
+"""
+The urls of blog.urls as served by Blog.asgi, with the read views and the post
+API replaced by async versions that run them on the database threads.
+"""
+from django.urls import URLPattern, URLResolver
+
+from .offload import offloaded
+from .urls import app_name, urlpatterns as sync_urlpatterns
+
+# Url name -> whether the view's pages are in the page cache.
+ASYNC_VIEWS = {
+    'index': True,
+    'detail': True,
+    'search': False,
+    'post-list': False,
+    'post-detail': False,
+}
+
+
+def async_patterns(patterns):
+    result = []
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver) and not isinstance(pattern.urlconf_name, str):
+            # The API router's urls, included as a list.
+            pattern = URLResolver(pattern.pattern, async_patterns(pattern.url_patterns), pattern.default_kwargs,
+                                  pattern.app_name, pattern.namespace)
+        elif isinstance(pattern, URLPattern) and pattern.name in ASYNC_VIEWS:
+            pattern = URLPattern(pattern.pattern, offloaded(pattern.callback, ASYNC_VIEWS[pattern.name]),
+                                 pattern.default_args, pattern.name)
+        result.append(pattern)
+    return result
+
+urlpatterns = async_patterns(sync_urlpatterns)
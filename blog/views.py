@@ -1,84 +1,202 @@
+import hashlib
+import math
 from .models import Category, Post
 from .forms import PostForm
-from .serializers import PostSerializer, UserSerializer
+from .serializers import (PostSerializer, PostSummarySerializer, UserSerializer, post_rows, requested_fields,
+                          serialize_post_rows)
 from .permissions import IsOwnerOrReadOnly
-from django.http import HttpResponse, HttpResponseRedirect, Http404
+from .caching import ConditionalAPIMixin, ConditionalPageMixin
+from .pagination import KeysetCursorPagination, KeysetPage, KeysetPaginationMixin, KeysetPaginator
+from .services import delete_post, normalize_categories, save_post
+from .bulk import create_posts, delete_posts, update_posts
+from .throttling import ThrottleMixin, throttle
+from . import autocomplete, caching, export, feeds, latest, search
+from django.http import HttpResponse, HttpResponseRedirect, Http404, JsonResponse, StreamingHttpResponse
 from django.template import loader
-from django.shortcuts import get_object_or_404, render, redirect, render_to_response
+from django.shortcuts import get_object_or_404, render, redirect
 from django.urls import reverse
 from django.views import generic
 from django.utils import timezone
 from django.forms.utils import ErrorList
 from django.contrib import auth
+from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.models import User
-from django.db.models import Count, Q
+from django.db import DatabaseError
+from django.db.models import Count, Max, Q
 from rest_framework import generics, permissions, viewsets, status
 from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.response import Response
-from bs4 import BeautifulSoup
+from rest_framework.reverse import reverse as api_reverse
+from rest_framework.utils.urls import replace_query_param
 
-VALID_TAGS = ['strong','em','p','ul','li','br','b','h1','h2','h3','h4','h5','h6','ol','i','a','dl','s','hr','sup','sub']
+CATEGORY_LETTERS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+CATEGORY_SUGGESTIONS = 10
+SEARCH_SUGGESTIONS = 5
+TAG_CLOUD_SIZE = 50
 
-class IndexView(generic.ListView):
+class IndexView(ConditionalPageMixin, KeysetPaginationMixin, generic.ListView):
     """
     This will be the home page, displaying the 10 most recent posts.
     """
     template_name = 'blogs/index.html'
     context_object_name = 'latest_posts_list'
 
+    def is_first_page(self):
+        return not self.request.GET.get(self.cursor_query_param)
+
+    def get_validators(self):
+        if self.is_first_page():
+            posts, _, version = latest.latest(self.paginate_by)
+            return max((post['modified_at'] for post in posts), default=None), version
+        published = Post.objects.filter(create_date__lte=timezone.now()).aggregate(
+            last_modified=Max('modified_at'), count=Count('id'))
+        return published['last_modified'], published['count']
+
+    def get_page_cache_timeout(self):
+        """
+        Expires the cached page when the next future dated post is published.
+        """
+        now = timezone.now()
+        upcoming = latest.next_due()
+        timeout = super().get_page_cache_timeout()
+        if upcoming:
+            timeout = min(timeout, max(1, math.ceil((upcoming - now).total_seconds())))
+        return timeout
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        The first page is read from the latest posts feed kept in the cache,
+        the others from the database.
+        """
+        if not self.is_first_page():
+            return super().paginate_queryset(queryset, page_size)
+        posts, has_more, _ = latest.latest(page_size)
+        paginator = KeysetPaginator(queryset, page_size, self.get_keyset_ordering())
+        page = KeysetPage(posts, paginator.encode_cursor(posts[-1]) if has_more and posts else None, None)
+        page.next_url = self.cursor_url(self.request.get_full_path(), page.next_cursor)
+        page.previous_url = None
+        return (paginator, page, page.object_list, page.has_other_pages())
+
     def get_queryset(self):
         """
-        Return the latest 10 posts.
+        Return the published posts, newest first, 10 to a page.
         """
-        return Post.objects.filter(create_date__lte=timezone.now()).order_by('-create_date')[:10]
+        return Post.listed.filter(create_date__lte=timezone.now())
 
-class CategoriesView(generic.ListView):
+class CategoriesView(ConditionalPageMixin, KeysetPaginationMixin, generic.ListView):
     """
     This will display all the catergories and link to a page for each.
     """
     template_name = 'blogs/categories.html'
     context_object_name = 'all_categories_list'
+    paginate_by = 50
+    keyset_ordering = ('name', 'id')
+
+    def get_keyset_ordering(self):
+        """
+        ?sort=popular lists the categories with the most posts first.
+        """
+        if self.request.GET.get('sort') == 'popular':
+            return ('-post_count', 'id')
+        return self.keyset_ordering
+
+    def get_validators(self):
+        categories = Category.objects.aggregate(last_modified=Max('modified_at'), count=Count('id'))
+        return categories['last_modified'], categories['count']
+
+    def get_prefix(self):
+        return self.request.GET.get('prefix', '').strip().upper()
 
     def get_queryset(self):
         """
-        Return all categories.
+        Return the categories, or with ?prefix= those whose name starts with it.
         """
-        return Category.objects.all()
+        categories = Category.objects.all()
+        prefix = self.get_prefix()
+        if prefix:
+            # A range rather than startswith, so the lookup can use the name index.
+            categories = categories.filter(name__gte=prefix, name__lt=prefix_end(prefix))
+        return categories
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(prefix=self.get_prefix(), letters=CATEGORY_LETTERS,
+                       sort=self.request.GET.get('sort', ''))
+        return context
 
-class CategoryView(generic.DetailView):
+class CategoryView(ConditionalPageMixin, KeysetPaginationMixin, generic.DetailView):
     """
     This will display a list of all posts for the category
     """
     model = Category
     template_name = 'blogs/category.html'
 
+    def get_validators(self):
+        category = get_object_or_404(Category.objects.only('modified_at'), pk=self.kwargs['pk'])
+        posts = Post.objects.filter(categories=category).aggregate(
+            last_modified=Max('modified_at'), count=Count('id'))
+        last_modified = max(filter(None, [category.modified_at, posts['last_modified']]))
+        return last_modified, posts['count']
 
-class PostView(generic.DetailView):
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        posts = Post.listed.filter(categories=self.object)
+        paginator, page, posts, is_paginated = self.paginate_queryset(posts, self.paginate_by)
+        context.update(posts=posts, page_obj=page, is_paginated=is_paginated)
+        return context
+
+
+class PostView(ConditionalPageMixin, generic.DetailView):
     """
     This will display the information for an individual post
     """
-    model = Post
+    queryset = Post.listed.defer('content', 'rendered_content')
     template_name = 'blogs/post.html'
 
-class SearchView(generic.ListView):
+    def get_validators(self):
+        return post_validators(self.kwargs['pk'])
+
+class SearchView(ThrottleMixin, KeysetPaginationMixin, generic.ListView):
     """
     This will display the search the user has provided from the search bar on any other page.
     """
+    throttle_scope = 'search'
     context_object_name = 'results'
     template_name = 'blogs/search.html'
+    paginate_by = 10
 
     def get_queryset(self):
-        try:
-            query = self.request.GET.get('search')
-        except:
-            query = ''
-        if (query != ''):
-            results = Post.objects.filter(Q(content__icontains=query) | Q(title__icontains=query)).order_by('-create_date')
-        else:
-            results = Post.objects.all()
-        return results
+        """
+        Return the posts matching the search ranked by the search index, or
+        every post when nothing was searched for.
+        """
+        if self.get_query():
+            return search.SearchResults(search.search(self.get_query()))
+        return Post.listed.all()
 
-class ProfileView(generic.ListView):
+    def get_query(self):
+        return self.request.GET.get('search', '').strip()
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Everything is listed with keyset paging, but search results come ranked
+        from the index, which holds at most SEARCH_MAX_RESULTS ids, so they are
+        paged by number.
+        """
+        if not self.get_query():
+            return super().paginate_queryset(queryset, page_size)
+        paginated = generic.ListView.paginate_queryset(self, queryset, page_size)
+        page = paginated[1]
+        url = self.request.get_full_path()
+        if page.has_next():
+            page.next_url = replace_query_param(url, 'page', page.next_page_number())
+        if page.has_previous():
+            page.previous_url = replace_query_param(url, 'page', page.previous_page_number())
+        return paginated
+
+class ProfileView(KeysetPaginationMixin, generic.ListView):
     """
     This will display users account information.
     """
@@ -87,9 +205,14 @@ class ProfileView(generic.ListView):
 
     def get_queryset(self):
         un = self.request.user
-        posts = Post.objects.filter(create_by=un).order_by('-create_date')
+        posts = Post.listed.filter(create_by=un)
 
         return posts
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['post_count'] = self.object_list.count()
+        return context
         
 class CreatePostView(generic.CreateView):
     """
@@ -101,22 +224,15 @@ class CreatePostView(generic.CreateView):
     form_class = PostForm
     
     def form_valid(self, form):
-        title = self.request.POST.get('title')
-        cont = self.request.POST.get('content')
-        content = sanitize_html(cont).decode('utf-8')
-        cats_as_string = self.request.POST.get('category_csv')
-        user=self.request.user
-        if (cats_as_string == '' or cats_as_string == ' '):
+        categories = normalize_categories(self.request.POST.get('category_csv', ''))
+        if not categories:
             form.add_error(None, "Categories cannot be empty, please add at least 1.")
             print(form.errors)
             return self.render_to_response(self.get_context_data(form=form))
-        time_now = timezone.now()
-        categories = cats_as_string.split(",")
-        post = Post(title=title, content=content, create_date=time_now, create_by=user)
-        post.save()
-        check_categories(categories, post)
-        post_id = Post.objects.filter(title=title, create_by=user, create_date=time_now)[0].id
-        return HttpResponseRedirect("Posts/%s" % post_id)
+        post = Post(title=self.request.POST.get('title'), content=self.request.POST.get('content'),
+                    create_date=timezone.now(), create_by=self.request.user)
+        save_post(post, categories)
+        return HttpResponseRedirect("Posts/%s" % post.id)
                    
 
 class EditPostView(generic.UpdateView):
@@ -133,18 +249,14 @@ class EditPostView(generic.UpdateView):
 
 
     def form_valid(self, form):
-        cats_as_string = self.request.POST.get('category_csv')
-        if (cats_as_string == '' or cats_as_string == ' '):
+        categories = normalize_categories(self.request.POST.get('category_csv', ''))
+        if not categories:
             form.add_error(None, "Categories cannot be empty, please add at least 1.")
             print(form.errors)
             return self.render_to_response(self.get_context_data(form=form))
-        categories = cats_as_string.split(',')
         post = form.save(commit=False)
-        new_content = self.request.POST.get('content')
-        post.content = sanitize_html(new_content).decode('utf-8')
-        post.categories.clear()
-        check_categories(categories, post)
-        post.save()
+        post.content = self.request.POST.get('content')
+        save_post(post, categories)
         return HttpResponseRedirect("/blog/Posts/%s" % post.id)
 
 class DeletePostView(generic.DeleteView):
@@ -157,94 +269,387 @@ class DeletePostView(generic.DeleteView):
         id = self.kwargs.get("pk")
         return get_object_or_404(Post, id=id)
 
-    def post(self, request, *args, **kwargs):
+    def delete(self, request, *args, **kwargs):
         """
         This is being overridden so that we can cleanup categories at the same time.
         When a user deletes a post, if any of the categories were only linked to
         that 1 post, the category itself is deleted. Just as a bit of db maintenance.
         """
-        post = Post.objects.filter(id=self.kwargs.get("pk")).first()
-        for category in post.categories.all():
-            if category.post_set.all().count() == 1:
-                category.delete()
-        return self.delete(request, *args, **kwargs)
+        self.object = self.get_object()
+        success_url = self.get_success_url()
+        delete_post(self.object)
+        return HttpResponseRedirect(success_url)
 
     def get_success_url(self):
         return reverse('blog:index')
 
-class PostViewSet(viewsets.ModelViewSet):
+class PostViewSet(ConditionalAPIMixin, viewsets.ModelViewSet):
     """
     This viewset automatically provides 'list', 'create', 'retrieve'
     'update' and 'destroy' actions.
     """
-    queryset = Post.objects.all()
+    queryset = Post.listed.all()
     serializer_class = PostSerializer
+    pagination_class = KeysetCursorPagination
     permission_classes =  (permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly)
 
+    def get_serializer_class(self):
+        """
+        ?view=summary lists and retrieves posts without their content.
+        """
+        if self.action in ('list', 'retrieve') and self.request.query_params.get('view') == 'summary':
+            return PostSummarySerializer
+        return self.serializer_class
+
+    def get_queryset(self):
+        """
+        Leaves the post bodies, authors and categories out of the queries when
+        the response leaves them out.
+        """
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve'):
+            return queryset
+        fields = set(self.get_serializer_class().Meta.fields)
+        wanted = requested_fields(self.request)
+        if wanted is not None:
+            fields &= wanted
+        if 'content' not in fields:
+            queryset = queryset.defer('content', 'rendered_content')
+        if 'create_by' not in fields:
+            queryset = queryset.select_related(None)
+        if 'categories' not in fields:
+            queryset = queryset.prefetch_related(None)
+        return queryset
+
+    def filter_queryset(self, queryset):
+        """
+        ?author= keeps the posts of the user with that username.
+        """
+        author = self.request.query_params.get('author')
+        if author:
+            queryset = queryset.filter(create_by__username=author)
+        return super().filter_queryset(queryset)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(request, self.get_list_validators(), lambda: self.list_rows(request))
+
+    def list_rows(self, request):
+        """
+        Lists posts from .values() rows built into the same data the serializer
+        gives, rather than through a model and serializer instance per post.
+        """
+        fields = [name for name, field in self.get_serializer().fields.items() if not field.write_only]
+        page = self.paginate_queryset(post_rows(self.filter_queryset(Post.objects.all()), fields))
+        return self.get_paginated_response(serialize_post_rows(page, fields))
+
     def perform_create(self, serializer):
         serializer.save(create_by=self.request.user)
 
+    def get_list_validators(self):
+        posts = self.filter_queryset(Post.objects.all()).aggregate(
+            last_modified=Max('modified_at'), count=Count('id'))
+        return posts['last_modified'], posts['count']
+
+    def get_object_validators(self):
+        return post_validators(self.kwargs['pk'])
+
     def destroy(self, request, *args, **kwargs):
         """
         This is being overridden so that we can cleanup categories at the same time.
         When a user deletes a post, if any of the categories were only linked to
         that 1 post, the category itself is deleted. Just as a bit of db maintenance.
         """
-        post = Post.objects.filter(id=self.kwargs.get("pk")).first()
-        for category in post.categories.all():
-            if category.post_set.all().count() == 1:
-                category.delete()
         try:
             instance = self.get_object()
-            self.perform_destroy(instance)
+            delete_post(instance)
         except Http404:
             pass
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def get_bulk_batches(self, request):
+        """
+        Splits a list payload into batches of (index, item) pairs.
+        """
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of items.']})
+        max_items = getattr(settings, 'BULK_MAX_ITEMS', 10000)
+        if len(items) > max_items:
+            raise ValidationError({'non_field_errors': ['At most %d items can be sent at once.' % max_items]})
+        size = getattr(settings, 'BULK_BATCH_SIZE', 500)
+        indexed = list(enumerate(items))
+        return [indexed[start:start + size] for start in range(0, len(indexed), size)]
+
+    def get_bulk_posts(self, request, batch, results, queryset):
+        """
+        Looks up the posts a batch refers to in one query and checks that the user
+        may change them. Returns (index, post, item) for each item that passed,
+        having recorded a result for each that did not.
+        """
+        ids = [bulk_item_id(item) for _, item in batch]
+        found = queryset.in_bulk([pk for pk in ids if pk is not None])
+        seen = set()
+        checked = []
+        for (index, item), pk in zip(batch, ids):
+            if pk is None:
+                results[index] = bulk_result(index, status.HTTP_400_BAD_REQUEST,
+                                             errors={'id': ['A valid post id is required.']})
+            elif pk in seen:
+                results[index] = bulk_result(index, status.HTTP_400_BAD_REQUEST,
+                                             errors={'id': ['Duplicate id.']})
+            elif pk not in found:
+                results[index] = bulk_result(index, status.HTTP_404_NOT_FOUND,
+                                             errors={'detail': 'Not found.'})
+            else:
+                seen.add(pk)
+                try:
+                    self.check_object_permissions(request, found[pk])
+                except PermissionDenied as exc:
+                    results[index] = bulk_result(index, status.HTTP_403_FORBIDDEN,
+                                                 errors={'detail': exc.detail})
+                else:
+                    checked.append((index, found[pk], item))
+        return checked
+
+    def write_bulk_batch(self, results, written, status_code, write):
+        """
+        Runs write for one batch, which commits or rolls back as a whole, and
+        records a result for each (index, post) pair in written.
+        """
+        if not written:
+            return
+        try:
+            write()
+        except DatabaseError:
+            for index, post in written:
+                results[index] = bulk_result(index, status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                             errors={'detail': 'The batch this item was in could not be saved.'})
+        else:
+            for index, post in written:
+                results[index] = bulk_result(index, status_code, post.pk)
+
+    @action(detail=False, permission_classes=[permissions.IsAuthenticated])
+    def export(self, request):
+        """
+        Streams every post as NDJSON, or CSV with ?type=csv. With ?since= only
+        the posts changed after that time are exported, for incremental syncs.
+        """
+        format = request.query_params.get('type', 'ndjson')
+        if format not in export.FORMATS:
+            raise ValidationError({'type': ['Must be one of %s.' % ', '.join(sorted(export.FORMATS))]})
+        since = None
+        if 'since' in request.query_params:
+            since = export.parse_since(request.query_params['since'])
+            if since is None:
+                raise ValidationError({'since': ['Must be an ISO 8601 date and time.']})
+        records = export.iter_records(export.export_queryset(since))
+        response = StreamingHttpResponse(export.render(records, format), content_type=export.FORMATS[format])
+        response['Content-Disposition'] = 'attachment; filename="posts.%s"' % format
+        return response
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Creates a post for each item of a list payload. Every item gets a result
+        with its own status, and each batch is saved in its own transaction.
+        """
+        results = {}
+        for batch in self.get_bulk_batches(request):
+            written, posts, categories = [], [], {}
+            for index, item in batch:
+                serializer = self.get_serializer(data=item)
+                if not serializer.is_valid():
+                    results[index] = bulk_result(index, status.HTTP_400_BAD_REQUEST,
+                                                 errors=serializer.errors)
+                    continue
+                data = dict(serializer.validated_data)
+                names = serializer.pop_categories(data)
+                if names:
+                    categories[len(posts)] = names
+                post = Post(create_by=request.user, **data)
+                posts.append(post)
+                written.append((index, post))
+            self.write_bulk_batch(results, written, status.HTTP_201_CREATED,
+                                  lambda: create_posts(posts, categories))
+        return Response({'results': [results[index] for index in sorted(results)]})
+
+    @bulk.mapping.patch
+    def bulk_update(self, request):
+        """
+        Partially updates the posts in a list payload, each item carrying the id
+        of the post it changes.
+        """
+        results = {}
+        for batch in self.get_bulk_batches(request):
+            written, fields, categories = [], set(), {}
+            for index, post, item in self.get_bulk_posts(request, batch, results, Post.objects.all()):
+                serializer = self.get_serializer(post, data=item, partial=True)
+                if not serializer.is_valid():
+                    results[index] = bulk_result(index, status.HTTP_400_BAD_REQUEST,
+                                                 errors=serializer.errors)
+                    continue
+                data = dict(serializer.validated_data)
+                names = serializer.pop_categories(data)
+                if names is not None:
+                    categories[post.pk] = names
+                for field in ('title', 'content', 'create_date'):
+                    if field in data:
+                        setattr(post, field, data[field])
+                        fields.add(field)
+                written.append((index, post))
+            self.write_bulk_batch(results, written, status.HTTP_200_OK,
+                                  lambda: update_posts([post for _, post in written], fields, categories))
+        return Response({'results': [results[index] for index in sorted(results)]})
+
+    @bulk.mapping.delete
+    def bulk_destroy(self, request):
+        """
+        Deletes the posts whose ids are listed in the payload, along with any
+        categories left without posts.
+        """
+        results = {}
+        for batch in self.get_bulk_batches(request):
+            batch = [(index, {'id': item}) for index, item in batch]
+            written = [(index, post) for index, post, _ in
+                       self.get_bulk_posts(request, batch, results, Post.objects.only('id', 'create_by'))]
+            self.write_bulk_batch(results, written, status.HTTP_204_NO_CONTENT,
+                                  lambda: delete_posts([post.pk for _, post in written]))
+        return Response({'results': [results[index] for index in sorted(results)]})
+
 
 class UserViewSet(viewsets.ReadOnlyModelViewSet):
     """
     This viewset automatically provides 'list' and 'detail' actions
     for viewing data on users.
     """
-    queryset = User.objects.all()
+    queryset = User.objects.annotate(post_count=Count('posts')).order_by('id')
     serializer_class = UserSerializer
 
 @api_view(['GET'])
 def api_root(request, format=None):
     return Response({
-        'users': reverse('blog:usersapi', request=request, format=format),
-        'posts': reverse('blog:postsapi', request=request, format=format)
+        'users': api_reverse('blog:user-list', request=request, format=format),
+        'posts': api_reverse('blog:post-list', request=request, format=format)
     })
 
-def sanitize_html(value):
+class FeedView(generic.View):
     """
-    Removes 'dangerous' html and only allows content within tags that are
-    pre-approved above in variable VALID_TAGS.
+    RSS, Atom and JSON Feed documents of the newest posts, site wide, for a
+    category or for an author. A document is built from cached items and
+    cached itself until the next write, and carries an ETag, so polling
+    readers mostly get a 304 without a query. ?archive=1 streams every post.
     """
-    soup = BeautifulSoup(value)
+    kind = None
 
-    for tag in soup.findAll(True):
-        if tag.name not in VALID_TAGS:
-            tag = tag.extract()
-    return soup.renderContents()
+    def get(self, request, format, key=None):
+        if format not in feeds.FORMATS:
+            raise Http404("Unknown feed format")
+        if request.GET.get('archive'):
+            return self.archive(request, format, key)
+        cache_key = 'feed:%s:%s' % (caching.page_generation(),
+                                    hashlib.md5(request.build_absolute_uri().encode('utf-8')).hexdigest())
+        cached = cache.get(cache_key)
+        if cached is None:
+            cached = feeds.render_feed(format, request, feeds.get_feed(self.kind, key), feeds.feed_size())
+            cache.set(cache_key, cached, self.get_cache_timeout())
+        content, etag, last_modified = cached
+        return caching.not_modified(request, etag, last_modified) or caching.add_validators(
+            HttpResponse(content, content_type=feeds.FORMATS[format]), etag, last_modified)
+
+    def get_cache_timeout(self):
+        """
+        Expires the cached document when the next future dated post is published.
+        """
+        timeout = caching.page_cache_timeout()
+        upcoming = latest.next_due()
+        if upcoming:
+            timeout = min(timeout, max(1, math.ceil((upcoming - timezone.now()).total_seconds())))
+        return timeout
 
-def check_categories(categories, post):
+    def archive(self, request, format, key):
+        feed = feeds.get_feed(self.kind, key)
+        posts = feeds.published(feed.posts).aggregate(last_modified=Max('modified_at'), count=Count('id'))
+        last_modified = posts['last_modified']
+        etag = caching.make_etag(request.build_absolute_uri(), last_modified, posts['count'])
+        response = caching.not_modified(request, etag, last_modified)
+        if response is None:
+            response = caching.add_validators(StreamingHttpResponse(
+                feeds.stream_feed(format, request, feed), content_type=feeds.FORMATS[format]), etag, last_modified)
+        return response
+
+@throttle('suggest')
+def category_suggestions(request):
     """
-    Takes the categories that are user entered, and if they exist already add
-    them to that post. If not they are added as a new category.
+    Categories as JSON for the category field of the post forms: with ?q= the
+    most used ones with a word starting with q, from the autocomplete index,
+    otherwise the tag cloud, the most used categories with a weight from 1 to 5,
+    cached until the next write.
     """
-    for category in categories:
-            if category == "" or category == " ":
-                pass
-            else:
-                category = category.strip()
-                category = category.upper()
-                cat_exists = Category.objects.filter(name=category).first()
-                if cat_exists:
-                    post.categories.add(cat_exists)
-                else:
-                    slug = category.replace(" ", "-")
-                    cat = Category(name=category, slug=slug)
-                    cat.save()
-                    post.categories.add(cat)
+    query = request.GET.get('q', '')
+    if query.strip():
+        matches = autocomplete.suggest(query, CATEGORY_SUGGESTIONS, (autocomplete.CATEGORY,))
+        return JsonResponse([
+            {'name': name, 'post_count': count} for _, name, count in matches[autocomplete.CATEGORY]
+        ], safe=False)
+    key = 'category-suggestions:%s' % caching.page_generation()
+    cloud = cache.get(key)
+    if cloud is None:
+        cloud = list(Category.objects.filter(post_count__gt=0).order_by('-post_count', 'name')
+                     .values('name', 'post_count')[:TAG_CLOUD_SIZE])
+        if cloud:
+            most = math.log(cloud[0]['post_count'] + 1)
+            for tag in cloud:
+                tag['weight'] = 1 + round(4 * math.log(tag['post_count'] + 1) / most)
+            cloud.sort(key=lambda tag: tag['name'])
+        cache.set(key, cloud, caching.page_cache_timeout())
+    return JsonResponse(cloud, safe=False)
+
+@throttle('suggest')
+def search_suggestions(request):
+    """
+    Post titles and categories with a word starting with ?q=, for the search
+    box, served from the autocomplete index without touching the database.
+    """
+    matches = autocomplete.suggest(request.GET.get('q', ''), SEARCH_SUGGESTIONS)
+    return JsonResponse({
+        'categories': [
+            {'name': name, 'post_count': count, 'url': reverse('blog:category', args=(pk,))}
+            for pk, name, count in matches[autocomplete.CATEGORY]
+        ],
+        'posts': [
+            {'title': title, 'url': reverse('blog:detail', args=(pk,))}
+            for pk, title, _ in matches[autocomplete.POST]
+        ],
+    })
+
+def prefix_end(prefix):
+    """
+    The first string after every string starting with prefix.
+    """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def bulk_item_id(item):
+    try:
+        return int(item['id'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def bulk_result(index, status_code, pk=None, errors=None):
+    result = {'index': index, 'status': status_code}
+    if pk is not None:
+        result['id'] = pk
+    if errors is not None:
+        result['errors'] = errors
+    return result
+
+def post_validators(pk):
+    """
+    Returns the validators for a post page: the later of the post's and its
+    categories' modification times.
+    """
+    post = Post.objects.filter(pk=pk).values('modified_at').annotate(
+        categories_modified=Max('categories__modified_at'), categories=Count('categories')).first()
+    if post is None:
+        raise Http404("No post found matching the query")
+    last_modified = max(filter(None, [post['modified_at'], post['categories_modified']]))
+    return last_modified, post['categories']